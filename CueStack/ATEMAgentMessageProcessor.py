@@ -17,13 +17,17 @@
 
 
 import json
+import time
+import asyncio
 import logging
+import concurrent.futures
 from multiprocessing import Queue
 
 import PyATEMMax
 from typing import Dict, Any
 
 from CSTriggerSources import CSTriggerGenericWebsocket, CSTriggerGenericHTTP, CSTriggerGenericMQTT
+from CSMetrics import CSMetrics, CSHistogram
 
 
 class ATEMAgentMessageProcessor:
@@ -36,6 +40,8 @@ class ATEMAgentMessageProcessor:
         'mqtt': CSTriggerGenericMQTT,
     }
     connection_timeout = 4.0  # seconds, timeout for connecting to the ATEM
+    command_timeout = 2.0  # seconds, how long to wait for switchers to take a command before replying with an error
+    legacy_switcher_name = 'default'  # name given to the switcher configured with atem_ip
 
     def __init__(self, config, log_level, loop):
         logging.debug('Initializing a ATEMAgentMessageProcessor')
@@ -43,15 +49,20 @@ class ATEMAgentMessageProcessor:
         self.loop = loop
         self.log_level = log_level
         self.command_queue = Queue()
+        self.switchers = {}  # switcher name -> PyATEMMax.ATEMMax
+        self.switcher_ips = {}  # switcher name -> ip
+        # switcher name -> single worker executor; commands to one switcher stay in order, but never wait on another switcher
+        self.switcher_executors = {}
+        self.default_switcher = None  # name of the switcher that gets commands which do not name one
+        self.switcher = None  # the default switcher
+        self.metrics = CSMetrics(prefix='atemagent')  # reported by getMetrics, and by http command sources with a metrics_route
+        self.metrics.describe('command_seconds', 'histogram', 'Time taken by a switcher to take a command, once it is that command\'s turn')
+        self.metrics.add_collector(self.collect_switcher_metrics)
+        self.command_times = {}  # switcher name -> CSHistogram, only ever observed into from that switcher's executor
         try:
-            self.atem_ip = self.config['atem_ip']
             self.setup_command_sources()
-            self.switcher = PyATEMMax.ATEMMax()
-            # self.switcher.setLogLevel(self.log_level)  # comment out this line to default PyATEMMax to logging.CRITICAL
-            self.switcher.registerEvent(self.switcher.atem.events.disconnect, self.onDisconnect)
-            self.switcher.registerEvent(self.switcher.atem.events.warning, self.onWarning)
-            self.switcher.connect(self.atem_ip)
-            self.switcher.waitForConnection(infinite=False, waitForFullHandshake=False)
+            self.setup_switchers()
+            self.connect_switchers()
             logging.info('ATEMAgent is ready')
         except Exception as ex:
             logging.error('exception while setting up ATEMAgentMessageProcessor: %s' % ex)
@@ -65,9 +76,62 @@ class ATEMAgentMessageProcessor:
                 self.command_sources[this_source].stop()
             except Exception:
                 pass
-        self.switcher.disconnect()
-
-    def handle(self, _msg):
+        logging.info('disconnecting from switchers')
+        for name, switcher in self.switchers.items():
+            try:
+                switcher.disconnect()
+            except Exception:
+                logging.exception('exception while disconnecting from switcher: %s' % name)
+        for executor in self.switcher_executors.values():
+            executor.shutdown(wait=False)
+
+    def setup_switchers(self):
+        # one ATEMMax per configured switcher; atem_ip (the original single switcher config) is still accepted, alongside or instead of switchers
+        switcher_configs = list(self.config.get('switchers', []))
+        if 'atem_ip' in self.config:
+            switcher_configs.insert(0, {'name': self.legacy_switcher_name, 'ip': self.config['atem_ip']})
+        if len(switcher_configs) < 1:
+            raise Exception('no switchers configured, please set atem_ip or switchers')
+        for this_switcher in switcher_configs:
+            name = this_switcher['name']
+            if name in self.switchers:
+                raise Exception('switcher name %s is used more than once, switcher names must be unique' % name)
+            logging.info('setting up switcher: %s (%s)' % (name, this_switcher['ip']))
+            switcher = PyATEMMax.ATEMMax()
+            # switcher.setLogLevel(self.log_level)  # comment out this line to default PyATEMMax to logging.CRITICAL
+            switcher.registerEvent(switcher.atem.events.disconnect, self.onDisconnect)
+            switcher.registerEvent(switcher.atem.events.warning, self.onWarning)
+            self.switchers[name] = switcher
+            self.switcher_ips[name] = this_switcher['ip']
+            self.switcher_executors[name] = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='atem-%s' % name)
+            self.command_times[name] = CSHistogram()
+        self.default_switcher = self.config.get('default_switcher', switcher_configs[0]['name'])
+        if self.default_switcher not in self.switchers:
+            raise Exception('default_switcher %s is not a configured switcher' % self.default_switcher)
+        self.switcher = self.switchers[self.default_switcher]
+
+    def connect_switchers(self):
+        # start connecting to every switcher, then wait for all of them at once, so an unreachable switcher costs one timeout instead of one each
+        if self.config.get('atem_asyncio', False):
+            # run the switcher connections on our event loop, instead of their own polling threads
+            results = self.loop.run_until_complete(self.connect_switchers_async())
+        else:
+            for name, switcher in self.switchers.items():
+                switcher.connect(self.switcher_ips[name])
+            futures = [self.switcher_executors[name].submit(switcher.waitForConnection, infinite=False, waitForFullHandshake=False) for name, switcher in self.switchers.items()]
+            results = [future.result() for future in futures]
+        for name, connected in zip(self.switchers, results):
+            if not connected:
+                logging.warning('switcher %s (%s) did not respond, will keep trying' % (name, self.switcher_ips[name]))
+
+    async def connect_switchers_async(self):
+        for name, switcher in self.switchers.items():
+            await switcher.connectAsync(self.switcher_ips[name])
+        return await asyncio.gather(*[switcher.waitForConnectionAsync(infinite=False, waitForFullHandshake=False) for switcher in self.switchers.values()])
+
+    async def handle(self, _msg):
+        # a coroutine, so command sources await it on the event loop: waiting for a slow switcher holds up neither the loop
+        #   (which talks to every switcher, with atem_asyncio) nor the command source's workers, so other commands go on meanwhile
         try:
             # logging.debug('received message: %s' % _msg)
             try:
@@ -76,13 +140,33 @@ class ATEMAgentMessageProcessor:
                 logging.error('JSON Decode Failure: %s' % ex)
                 return {'status': 'JSON Decode Failure: %s' % ex}
             if 'atem' in command_message:
+                # a single command, or a list of commands, which are sent to their switchers in parallel
+                commands = command_message['atem']
+                if not isinstance(commands, list):
+                    commands = [commands]
                 try:
-                    result = self.send_command(command_message['atem'])
-                    logging.debug('result of command: %s' % result)
+                    futures = [self.submit_command(command) for command in commands]
                 except Exception as ex:
-                    logging.exception('exception while handling atem command: %s' % ex)
+                    logging.error('exception while handling atem command: %s' % ex)
                     return {'status': 'Exception while handling atem command: %s' % ex}
+                futures = [asyncio.wrap_future(future) for future in futures]
+                not_done = set()
+                if futures:
+                    _, not_done = await asyncio.wait(futures, timeout=self.command_timeout)
+                for future in not_done:
+                    # send_command logs anything it raises, so there is no need to hear about it again once nobody is waiting
+                    future.add_done_callback(lambda late: late.cancelled() or late.exception())
+                errors = []
+                for command, future in zip(commands, futures):
+                    if future in not_done:
+                        errors.append('switcher %s did not take command within %s seconds' % (self.switcher_name(command), self.command_timeout))
+                    elif future.exception() is not None:
+                        errors.append(str(future.exception()))
+                if len(errors) > 0:
+                    return {'status': 'Exception while handling atem command: %s' % '; '.join(errors)}
                 return {'status': 'OK'}
+            elif command_message.get('request') == 'getMetrics':
+                return {'status': 'OK', 'request_id': command_message.get('request_id', 0), 'response': {'metrics': self.metrics.snapshot()}}
             else:
                 return {'status': 'Error: missing a supported command key'}
         except Exception as e:
@@ -108,10 +192,34 @@ class ATEMAgentMessageProcessor:
                 d[k] = v
         return d
 
+    def collect_switcher_metrics(self):
+        return [('command_seconds', {'switcher': name}, histogram) for name, histogram in self.command_times.items()]
+
+    def switcher_name(self, command):
+        # commands pick a switcher with the switcher key, otherwise they go to the default switcher
+        return command.get('switcher', self.default_switcher)
+
+    def submit_command(self, command):
+        # hand a command to its switcher's executor, returns a concurrent.futures.Future
+        name = self.switcher_name(command)
+        if name not in self.switchers:
+            raise Exception('unknown switcher: %s' % name)
+        return self.switcher_executors[name].submit(self.send_command, command)
+
     def send_command(self, command):
-        logging.info('sending atem command: %s' % command)
-        method_to_call = getattr(self.switcher, command['request'])
-        return method_to_call(**command['args'])
+        name = self.switcher_name(command)
+        logging.info('sending atem command to %s: %s' % (name, command))
+        started = time.monotonic()
+        try:
+            method_to_call = getattr(self.switchers[name], command['request'])
+            result = method_to_call(**command['args'])
+            logging.debug('result of command: %s' % result)
+            return result
+        except Exception as ex:
+            logging.exception('exception while handling atem command: %s' % ex)
+            raise
+        finally:
+            self.command_times[name].observe(time.monotonic() - started)
 
     def setup_command_sources(self):
         # setup command sources based on config, populating command_sources
@@ -138,6 +246,7 @@ class ATEMAgentMessageProcessor:
                     'queue': self.command_queue,
                     'handler': self.handle,
                     'loop': self.loop,
+                    'metrics': self.metrics,
                 }
                 self.command_sources[this_source['name']] = self.command_map[this_source['type']](this_config_obj)
             else:
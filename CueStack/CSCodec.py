@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# CueStack JSON Codec
+
+#    Copyright (C) 2021 James Bishop (james@bishopdynamics.com)
+
+# ignore rules:
+#   docstring
+#   too-broad-exception
+#   line-too-long
+#   too-many-branches
+#   too-many-statements
+#   too-many-public-methods
+#   too-many-lines
+#   too-many-nested-blocks
+#   toddos (annotations linter handling this)
+# pylint: disable=C0111,W0703,C0301,R0912,R0915,R0904,C0302,R1702,W0511
+
+import json
+
+from CSCommon import dict_raise_on_duplicates
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def count_keys(obj):
+    # total number of keys in every dict within obj
+    count = 0
+    stack = [obj]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, dict):
+            count += len(item)
+            stack.extend(item.values())
+        elif isinstance(item, list):
+            stack.extend(item)
+    return count
+
+
+def json_dumps(obj):
+    return json.dumps(obj)
+
+
+def json_dumps_indented(obj):
+    return json.dumps(obj, indent=2)
+
+
+def orjson_dumps(obj):
+    try:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+    except TypeError:
+        return json.dumps(obj)  # things orjson refuses but json does not, like integers bigger than 64 bits
+
+
+def orjson_dumps_indented(obj):
+    try:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_INDENT_2).decode('utf-8')
+    except TypeError:
+        return json.dumps(obj, indent=2)
+
+
+# name: (loads, dumps, dumps_indented), loads may take str or bytes, the dumps return str
+JSON_BACKENDS = {'json': (json.loads, json_dumps, json_dumps_indented)}
+if orjson is not None:
+    JSON_BACKENDS['orjson'] = (orjson.loads, orjson_dumps, orjson_dumps_indented)
+
+
+class CSCodec:
+    # decodes trigger messages and encodes replies, using the fastest json library available (backend auto), or the one named
+    # duplicate keys are rejected, as they always have been, without checking every key as it is decoded:
+    #   every key in the text is followed by a colon, so if there are no more colons in the text than keys in what was decoded,
+    #   no key can have been lost to a duplicate. only text with colons elsewhere (inside strings) is decoded again, checking each key
+    def __init__(self, backend='auto'):
+        if backend == 'auto':
+            backend = 'orjson' if 'orjson' in JSON_BACKENDS else 'json'
+        if backend not in JSON_BACKENDS:
+            raise Exception('json backend %s is not available, choose from: %s' % (backend, ', '.join(JSON_BACKENDS)))
+        self.backend = backend
+        self._loads, self._dumps, self._dumps_indented = JSON_BACKENDS[backend]
+
+    def decode(self, text):
+        # raises ValueError if text is not valid json, or has a duplicate key in any object
+        decoded = self._loads(text)
+        colons = text.count(b':' if isinstance(text, bytes) else ':')
+        if colons > 0 and colons != count_keys(decoded):
+            decoded = json.loads(text, object_pairs_hook=dict_raise_on_duplicates)
+        return decoded
+
+    def encode(self, obj):
+        return self._dumps(obj)
+
+    def encode_indented(self, obj):
+        # for files people also edit by hand, like config.json
+        return self._dumps_indented(obj)
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+# CueStack Command Queue
+
+#    Copyright (C) 2021 James Bishop (james@bishopdynamics.com)
+
+# ignore rules:
+#   docstring
+#   too-broad-exception
+#   line-too-long
+#   too-many-branches
+#   too-many-statements
+#   too-many-public-methods
+#   too-many-lines
+#   too-many-nested-blocks
+#   toddos (annotations linter handling this)
+# pylint: disable=C0111,W0703,C0301,R0912,R0915,R0904,C0302,R1702,W0511
+
+import time
+import queue
+import threading
+import collections
+import logging
+import itertools
+import multiprocessing
+
+from CSCommandTargets import TARGET_EXIT_MSG
+from CSMetrics import CSHistogram
+from CSTrace import CSTraceRing, TRACE_DEQUEUED, TRACE_EXPIRED, TRACE_SENT
+
+QUEUE_POLICIES = ['block', 'drop_oldest', 'drop_newest']  # what to do with a new command when the queue is full
+QUEUE_COUNTERS = ['queued', 'dropped', 'expired', 'blocked']
+
+
+def batch_size(payload):
+    # number of commands in what was put on a queue: a single command, or a list of them
+    return len(payload) if isinstance(payload, list) else 1
+
+
+class CSCommandQueue:
+    # the queue between the message processor and a command target, bounded if configured to be
+    #   the message processor calls put, the target takes items off with get / get_nowait and turns them into commands with collect
+    #   commands travel with the time they were queued, so the target can throw away any that have waited longer than expire_ms
+    #   counters live in shared memory, so the target process can count what it expires, and the message processor can report them
+    #   they count commands, so a batch of parts put as one item counts once for each part
+    #     queued - commands accepted onto the queue
+    #     dropped - commands thrown away because the queue was full (the oldest or the newest, depending on policy)
+    #     expired - commands thrown away by the target because they waited too long
+    #     blocked - commands that had to wait for room on the queue
+    # settings is the optional "queue" key of a command target's entry in config:
+    #   maxsize - most commands (or batches of commands) waiting at once, 0 for no limit
+    #   policy - one of QUEUE_POLICIES, drop_oldest by default
+    #   block_ms - with policy block, how long to wait for room before dropping the command anyway, must be more than 0
+    # put is called from the cue scheduler thread, which fires cues for every target, so it never waits:
+    #   with policy block, what does not fit is handed to a thread of this queue's own, which waits for room, keeping the order
+    #   commands were put in, so a stalled target only holds up its own commands
+    #   expire_ms - commands which waited longer than this are not sent, 0 to send them no matter how late
+    # the target also records, in shared histograms, how long what it took off the queue had waited (time_in_queue),
+    #   and how long sending each batch took (send_time)
+    # with trace_size set, batches put on the queue with a trace id are traced: the target records when it took them off
+    #   the queue and when it sent them, in a CSTraceRing of that many events
+    def __init__(self, raw_queue, settings=None, trace_size=0):
+        settings = settings or {}
+        self.queue = raw_queue  # multiprocessing.Queue, or CSEngineQueue, created with the same maxsize
+        self.maxsize = settings.get('maxsize', 0)
+        self.policy = settings.get('policy', 'drop_oldest')
+        self.block_timeout = settings.get('block_ms', 1000) / 1000
+        self.expire = settings.get('expire_ms', 0) / 1000
+        if self.policy not in QUEUE_POLICIES:
+            raise Exception('unknown queue policy: %s, must be one of: %s' % (self.policy, ', '.join(QUEUE_POLICIES)))
+        if self.block_timeout <= 0:
+            raise Exception('queue block_ms must be more than 0, waiting forever would hold up this target for good')
+        self._handoff = collections.deque()  # with policy block, items waiting for room on the queue, oldest first
+        self._handoff_ready = threading.Condition()
+        self._handoff_thread = None
+        self._closed = False
+        self.counters = multiprocessing.Array('q', len(QUEUE_COUNTERS))
+        self.time_in_queue = CSHistogram(shared=True)
+        self.send_time = CSHistogram(shared=True, locked=True)  # a target with requests in flight records them as sent from its worker threads
+        self.trace = CSTraceRing(trace_size) if trace_size > 0 else None
+        self.collected_trace_ids = []  # target side, trace ids of what collect last returned
+
+    def count(self, counter, amount=1):
+        with self.counters.get_lock():
+            self.counters[QUEUE_COUNTERS.index(counter)] += amount
+
+    def stats(self):
+        stats = dict(zip(QUEUE_COUNTERS, self.counters[:]))
+        try:
+            stats['depth'] = self.queue.qsize()
+        except NotImplementedError:  # multiprocessing.Queue on macOS
+            stats['depth'] = None
+        stats.update({'maxsize': self.maxsize, 'policy': self.policy, 'expire_ms': int(self.expire * 1000)})
+        return stats
+
+    def __getstate__(self):
+        # a target in a process of its own gets a copy of this, and never puts anything, so the hand-off is left behind
+        state = self.__dict__.copy()
+        state.update(_handoff=collections.deque(), _handoff_ready=None, _handoff_thread=None)
+        return state
+
+    def put(self, payload, trace_id=0):
+        if payload == TARGET_EXIT_MSG:
+            # the target is being stopped, so if it is stuck with a full queue, what is waiting does not matter anymore
+            with self._handoff_ready:
+                self._closed = True
+                self._handoff.clear()
+                self._handoff_ready.notify()
+            self._put_dropping_oldest(payload)
+            return
+        item = (time.monotonic(), payload, trace_id)
+        size = batch_size(payload)
+        if self.maxsize <= 0:
+            self.queue.put(item)
+        elif self.policy == 'drop_oldest':
+            self._put_dropping_oldest(item)
+            return
+        elif self.policy == 'drop_newest':
+            try:
+                self.queue.put_nowait(item)
+            except queue.Full:
+                self.count('dropped', size)
+                logging.warning('command queue full, dropping newest command: %s' % (payload,))
+                return
+        else:
+            with self._handoff_ready:
+                if not self._handoff:
+                    try:
+                        self.queue.put_nowait(item)
+                        self.count('queued', size)
+                        return
+                    except queue.Full:
+                        pass
+                # full, or there are older commands still waiting for room, which must go first
+                self.count('blocked', size)
+                self._handoff.append(item)
+                if self._handoff_thread is None:
+                    self._handoff_thread = threading.Thread(target=self._run_handoff, name='CommandQueueHandoff', daemon=True)
+                    self._handoff_thread.start()
+                self._handoff_ready.notify()
+            return
+        self.count('queued', size)
+
+    def _run_handoff(self):
+        # with policy block, waits for room for each item put could not fit, for up to block_ms after it was put
+        while True:
+            with self._handoff_ready:
+                while not self._handoff and not self._closed:
+                    self._handoff_ready.wait()
+                if self._closed:
+                    return
+                item = self._handoff[0]  # left in place until it is on the queue, so put does not get ahead of it
+            size = batch_size(item[1])
+            try:
+                self.queue.put(item, timeout=max(0.0, item[0] + self.block_timeout - time.monotonic()))
+                self.count('queued', size)
+            except queue.Full:
+                self.count('dropped', size)
+                logging.warning('command queue still full after %ss, dropping command: %s' % (self.block_timeout, item[1]))
+            with self._handoff_ready:
+                if self._handoff and self._handoff[0] is item:
+                    self._handoff.popleft()
+
+    def _put_dropping_oldest(self, item):
+        while True:
+            try:
+                self.queue.put_nowait(item)
+                if item != TARGET_EXIT_MSG:
+                    self.count('queued', batch_size(item[1]))
+                return
+            except queue.Full:
+                pass
+            try:
+                dropped = self.queue.get_nowait()
+                if dropped != TARGET_EXIT_MSG:
+                    self.count('dropped', batch_size(dropped[1]))
+                    logging.warning('command queue full, dropping oldest command: %s' % (dropped[1],))
+            except queue.Empty:
+                time.sleep(0.001)  # multiprocessing.Queue counts items still on their way into the pipe as queued
+
+    def get(self):
+        return self.queue.get()
+
+    def get_nowait(self):
+        return self.queue.get_nowait()
+
+    def collect(self, items, logger):
+        # flatten what was taken off the queue into a list of commands, stopping at TARGET_EXIT_MSG, and leaving out expired ones
+        #   a cue plan puts the parts it has due at the same time for this target as a single list
+        #   returns (commands, exit_requested)
+        commands = []
+        now = time.monotonic()
+        trace = self.trace
+        self.collected_trace_ids = []
+        for item in items:
+            if item == TARGET_EXIT_MSG:
+                return commands, True
+            queued_at, payload, trace_id = item
+            batch = payload if isinstance(payload, list) else [payload]
+            if self.expire and now - queued_at > self.expire:
+                self.count('expired', len(batch))
+                logger.warning('not sending %s command(s) which waited %.3fs in queue: %s' % (len(batch), now - queued_at, batch))
+                if trace is not None and trace_id:
+                    trace.record(TRACE_EXPIRED, trace_id, now)
+                continue
+            self.time_in_queue.observe(now - queued_at)
+            if trace is not None and trace_id:
+                trace.record(TRACE_DEQUEUED, trace_id, now)
+                self.collected_trace_ids.append(trace_id)
+            commands.extend(batch)
+        return commands, False
+
+    def sent(self, started, in_flight=None):
+        # called by the target once it has sent what collect last returned, or handed it off to be sent
+        #   in_flight is what send_commands returned: None if sending is done, or a list of concurrent.futures.Future for
+        #   sends still going, in which case the time taken is recorded once the last of them is done
+        if not in_flight:
+            self._record_sent(started, time.monotonic(), self.collected_trace_ids)
+            return
+        trace_ids = self.collected_trace_ids
+        done = itertools.count(1)  # next() on this is atomic, so the worker threads finishing these futures need no lock for it
+
+        def _done(_future):
+            if next(done) == len(in_flight):
+                self._record_sent(started, time.monotonic(), trace_ids)
+        for future in in_flight:
+            future.add_done_callback(_done)
+
+    def _record_sent(self, started, finished, trace_ids):
+        self.send_time.observe(finished - started)
+        for trace_id in trace_ids:
+            self.trace.record(TRACE_SENT, trace_id, started, finished - started)
@@ -15,56 +15,124 @@
 #   toddos (annotations linter handling this)
 # pylint: disable=C0111,W0703,C0301,R0912,R0915,R0904,C0302,R1702,W0511
 
-import time
 import json
+import time
+import queue
+import select
 import logging
 import socket
+import threading
+import http.client
 import websocket
 import paho.mqtt.client as mqtt
 from abc import abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 
 from obswebsocket import obsws as obs_client
 from obswebsocket import requests as obs_requests
-from pythonosc import udp_client
-from urllib.request import urlopen
-from urllib.parse import urlencode
-from CSLogger import get_mplogger
+from pythonosc import udp_client, osc_bundle_builder, osc_message_builder
+from urllib.parse import urlencode, urlsplit
+from CSLogger import get_mplogger, LazyJSON
+
+TARGET_EXIT_MSG = 'exit'  # put this on a command target queue to ask process_queue to finish up and return
 
 
 class CSCommandTarget:
     # base implementation of a command target
+    #   normally this is the target of its own multiprocessing.Process, and __init__ runs process_queue until told to exit
+    #   with in_process set in config_obj, it is running on a CSTargetEngine instead: __init__ only sets up, and the engine calls send and stop
     data = {}  # children of this class should attach additional data to this key, instead of attaching directly to self
+    blocking = True  # False if send never blocks, so a CSTargetEngine can call it right on its event loop
+    isolate = False  # True to run in its own process even with the async engine, unless the target config says otherwise
 
     def __init__(self, config_obj):
         self.config_obj = config_obj
         self.should_run = True
         self.description = 'Unnamed Target'
+        self.data = {}  # per instance, as several targets may share a process
+        self.in_flight = []  # futures for sends handed off to other threads by submit, during the current send_commands
+        in_process = self.config_obj.get('in_process', False)
         try:
             self.name = self.config_obj['name']
             self.config = self.config_obj['config']
             self.queue = self.config_obj['queue']
-            self.logger = get_mplogger(name=self.name, level=self.config_obj['log_level'])
+            if in_process:
+                # the multiprocessing logger is one per process, so targets sharing a process each get their own
+                self.logger = logging.getLogger(self.name)
+                self.logger.setLevel(self.config_obj['log_level'])
+            else:
+                self.logger = get_mplogger(name=self.name, level=self.config_obj['log_level'])
             self.setup()
         except Exception as ex:
             self.logger.error('unexpected exception while setting up command target: %s' % ex)
             self.stop()
         else:
             self.logger.info('Starting %s command target: %s' % (self.description, self.name))
-            self.process_queue()
+            if not in_process:
+                self.process_queue()
 
     def process_queue(self):
+        # block until something shows up in the queue, then drain everything that arrived alongside it
+        #   before blocking again, so a burst of parts is handled in a single wakeup, and sent as one batch
         try:
             while self.should_run:
-                if not self.queue.empty():
-                    command = self.queue.get()
-                    self.send(command)
-                time.sleep(0.1)
+                items = [self.queue.get()]
+                while True:
+                    try:
+                        items.append(self.queue.get_nowait())
+                    except queue.Empty:
+                        break
+                commands, exit_requested = self.queue.collect(items, self.logger)
+                if commands:
+                    started = time.monotonic()
+                    in_flight = self.send_commands(commands)
+                    self.queue.sent(started, in_flight)
+                if exit_requested:
+                    self.should_run = False
         except KeyboardInterrupt:
             pass
         except Exception as ex:
             self.logger.error('unexpected exception while process_queue: %s' % ex)
         self.stop()
 
+    def send_commands(self, commands):
+        # send commands which were waiting together, coalescing them first if configured to
+        #   a target which hands sends off to other threads returns their futures, see CSCommandQueue.sent
+        if self.config.get('coalesce', False):
+            commands = self.coalesce(commands)
+        self.in_flight = []
+        if len(commands) == 1:
+            self.send(commands[0])
+        else:
+            self.send_batch(commands)
+        in_flight, self.in_flight = self.in_flight, []
+        return in_flight or None
+
+    def submit(self, executor, func, *args):
+        # hand a send off to executor, so it is not counted as sent until it really has been
+        self.in_flight.append(executor.submit(func, *args))
+
+    def coalesce(self, commands):
+        # last writer wins: of commands with the same coalesce_key, only the last is kept, in the place of the first
+        kept = {}
+        for index, command in enumerate(commands):
+            key = self.coalesce_key(command)
+            kept[index if key is None else (key,)] = command
+        if len(kept) < len(commands):
+            self.logger.debug('coalesced %s commands into %s' % (len(commands), len(kept)))
+        return list(kept.values())
+
+    def coalesce_key(self, command):
+        # commands with the same key overwrite each other when coalescing, None means never coalesce this one
+        #   override this for targets where it makes sense, like the address of an OSC message
+        return None
+
+    def send_batch(self, commands):
+        # send several commands at once, in order
+        #   override this for targets whose protocol can carry several commands in one message
+        for command in commands:
+            self.send(command)
+
     def stop(self):
         self.logger.info('Shutting down %s command target: %s' % (self.description, self.name))
         self.should_run = False
@@ -100,6 +168,7 @@ class CSCommandTarget:
 
 class CSTargetOBS(CSCommandTarget):
     # Control OBS Studio using the obs-websocket plugin
+    isolate = True  # obs-websocket-py runs its own threads and blocks, so by default this gets its own process even with the async engine
     def setup(self):
         self.description = 'OBS Studio (via obs-websocket)'
         self.data['client'] = obs_client(self.config['host'], self.config['port'], self.config['password'])
@@ -122,9 +191,31 @@ class CSTargetOBS(CSCommandTarget):
                 self.retry(command, method_to_call)
 
     def send_command(self, command, method_to_call):
-        self.logger.info('sending obs-websocket command: %s' % json.dumps(command))
+        self.logger.info('sending obs-websocket command: %s', LazyJSON(command))
         self.data['client'].call(method_to_call(**command['args']))
 
+    def send_batch(self, commands):
+        # obs-websocket 4.x takes several requests in one ExecuteBatch, 5.x has no such request so they are sent one at a time
+        if not getattr(self.data['client'], 'legacy', True):
+            super().send_batch(commands)
+            return
+        self.logger.info('sending obs-websocket batch of %s commands: %s', len(commands), LazyJSON(commands))
+        batch = [dict(command['args'], **{'request-type': command['request']}) for command in commands]
+        try:
+            result = self.data['client'].call(obs_requests.ExecuteBatch(requests=batch))
+        except Exception as ex:
+            self.logger.error('failure while trying to send obs-websocket batch: %s' % ex)
+            self.logger.error('will reconnect and retry, one command at a time')
+            self.reconnect()
+            super().send_batch(commands)
+            return
+        if not result.status:
+            self.logger.error('obs-websocket batch failed: %s' % result.datain)
+            return
+        for command, request_result in zip(commands, result.datain.get('results', [])):
+            if request_result.get('status') != 'ok':
+                self.logger.error('obs-websocket request in batch failed: %s, error: %s' % (command['request'], request_result.get('error')))
+
     def retry(self, command, method_to_call):
         try:
             self.reconnect()
@@ -144,6 +235,7 @@ class CSTargetOBS(CSCommandTarget):
 
 class CSTargetGenericOSC(CSCommandTarget):
     # generic OSC target
+    blocking = False  # a single UDP sendto
     def setup(self):
         self.description = 'Generic OSC'
         try:
@@ -162,12 +254,33 @@ class CSTargetGenericOSC(CSCommandTarget):
         else:
             self.logger.debug('no value in command, using default of 1')
             realvalue = 1
-        self.logger.info('sending Generic OSC message %s: %s %s' % (self.data['host'], command['address'], realvalue))
+        self.logger.info('sending Generic OSC message %s: %s %s', self.data['host'], command['address'], realvalue)
         try:
             self.data['client'].send_message(command['address'], realvalue)
         except Exception as ex:
             self.logger.error('exception while trying to send Generic OSC message: %s' % ex)
 
+    def send_batch(self, commands):
+        # everything goes in a single OSC bundle, to be executed immediately on arrival, unless bundle is false in the config
+        if not self.config.get('bundle', True):
+            super().send_batch(commands)
+            return
+        try:
+            bundle = osc_bundle_builder.OscBundleBuilder(osc_bundle_builder.IMMEDIATELY)
+            for command in commands:
+                realvalue = command.get('value', 1)
+                self.logger.info('adding Generic OSC message to bundle for %s: %s %s', self.data['host'], command['address'], realvalue)
+                message = osc_message_builder.OscMessageBuilder(address=command['address'])
+                for value in (realvalue if isinstance(realvalue, list) else [realvalue]):
+                    message.add_arg(value)
+                bundle.add_content(message.build())
+            self.data['client'].send(bundle.build())
+        except Exception as ex:
+            self.logger.error('exception while trying to send Generic OSC bundle: %s' % ex)
+
+    def coalesce_key(self, command):
+        return command['address']
+
 
 class CSTargetGenericTCP(CSCommandTarget):
     # generic TCP target
@@ -193,7 +306,7 @@ class CSTargetGenericTCP(CSCommandTarget):
             self.retry(command)
 
     def send_message(self, message):
-        self.logger.info('sending Generic TCP message to %s: %s' % (self.data['host'], message))
+        self.logger.info('sending Generic TCP message to %s: %s', self.data['host'], message)
         self.data['sock'].sendall(bytes(message, 'utf-8'))
 
     def retry(self, command):
@@ -212,6 +325,7 @@ class CSTargetGenericTCP(CSCommandTarget):
 
 class CSTargetGenericUDP(CSCommandTarget):
     # generic UDP target
+    blocking = False  # a single UDP sendto
     def setup(self):
         self.description = 'Generic UDP'
         try:
@@ -235,24 +349,97 @@ class CSTargetGenericUDP(CSCommandTarget):
 
 class CSTargetGenericHTTP(CSCommandTarget):
     # generic HTTP target
+    #   HTTP/1.1 connections are kept open between commands. with max_in_flight > 1, up to that many requests are sent
+    #   concurrently, each on its own connection. every request is timed: slow ones are logged as they happen, and
+    #   a per-path summary is logged at shutdown
     def setup(self):
         self.description = 'Generic HTTP'
         self.data['host'] = 'http://%s:%s' % (self.config['host'], self.config['port'])
+        timeout = self.config.get('timeout', 5)  # seconds, for connecting and for each read
+        self.data['slow'] = self.config.get('slow_ms', 500) / 1000  # seconds, requests taking longer than this are logged as warnings
+        max_in_flight = max(1, self.config.get('max_in_flight', 1))
+        # connections are not opened until first used, and are reopened by http.client if closed
+        self.data['connections'] = [http.client.HTTPConnection(self.config['host'], self.config['port'], timeout=timeout) for _ in range(max_in_flight)]
+        self.data['pool'] = queue.Queue()  # connections not in use right now
+        for connection in self.data['connections']:
+            self.data['pool'].put(connection)
+        self.data['executor'] = None
+        if max_in_flight > 1:
+            self.data['executor'] = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix=self.name)
+        self.data['latency'] = {}  # path -> [requests, total seconds, max seconds]
+        self.data['latency_lock'] = threading.Lock()
 
     def shutdown(self):
-        # no need
-        pass
+        if self.data.get('executor') is not None:
+            self.data['executor'].shutdown(wait=True)
+        for connection in self.data.get('connections', []):
+            connection.close()
+        for path, (count, total, slowest) in self.data.get('latency', {}).items():
+            self.logger.info('Generic HTTP latency for %s%s: %s requests, average %.1fms, max %.1fms' % (self.data['host'], path, count, total / count * 1000, slowest * 1000))
 
     def send(self, command):
         # command['mesage'] = '/endpoint?foo=bar&beef=dead'
         fullurl = self.conv_msg_type(command)
-        self.logger.info('sending Generic HTTP message: %s' % fullurl)
+        self.logger.info('sending Generic HTTP message: %s', fullurl)
+        if self.data['executor'] is not None:
+            self.submit(self.data['executor'], self.request, fullurl)
+        else:
+            self.request(fullurl)
+
+    def request(self, fullurl):
+        url = urlsplit(fullurl)
+        path = url.path or '/'
+        if url.query:
+            path = '%s?%s' % (path, url.query)
+        connection = self.data['pool'].get()
         try:
-            response = urlopen(url=fullurl)
-            result = response.read()
-            self.logger.debug(result)
+            start = time.monotonic()
+            reused = connection.sock is not None
+            try:
+                status, result = self.get(connection, path)
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError) as ex:
+                # the server dropped an idle keep-alive connection before we got any response, so it never saw the request:
+                #   try once more on a fresh one. anything else (like a timeout) may have reached the server, and is not retried,
+                #   as sending a command twice could fire a cue twice
+                if not reused:
+                    raise
+                self.logger.debug('Generic HTTP request failed (%s), will reconnect and retry' % ex)
+                connection.close()
+                start = time.monotonic()
+                status, result = self.get(connection, path)
+            self.record_latency(url.path, time.monotonic() - start)
+            if status >= 400:
+                self.logger.error('Generic HTTP message got status %s: %s' % (status, result))
+            else:
+                self.logger.debug(result)
         except Exception as ex:
+            connection.close()
             self.logger.error('exception while trying to send Generic HTTP message: %s' % ex)
+        finally:
+            self.data['pool'].put(connection)
+
+    def get(self, connection, path):
+        # the whole body must be read before the connection can be used again
+        connection.request('GET', path)
+        response = connection.getresponse()
+        try:
+            result = response.read()
+        except (ConnectionResetError, BrokenPipeError) as ex:
+            # the server has the request, so this must not look like a connection that went stale before it was sent
+            raise http.client.HTTPException('connection lost while reading response: %s' % ex) from ex
+        if response.will_close:
+            connection.close()
+        return response.status, result
+
+    def record_latency(self, path, elapsed):
+        with self.data['latency_lock']:
+            stats = self.data['latency'].setdefault(path, [0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += elapsed
+            if elapsed > stats[2]:
+                stats[2] = elapsed
+        if elapsed > self.data['slow']:
+            self.logger.warning('slow response from Generic HTTP %s%s: %.1fms' % (self.data['host'], path, elapsed * 1000))
 
     def conv_msg_type(self, command):
         fullurl = '%s%s' % (self.data['host'], command['message'])
@@ -263,8 +450,66 @@ class CSTargetGenericHTTP(CSCommandTarget):
         return fullurl
 
 
+class CSWebsocketConnection:
+    # one connection of a CSTargetGenericWebsocket, opened when first needed and again after it is found dead
+    #   the lock is held while the connection is in use, so the heartbeat never interleaves with a send
+    def __init__(self, host, timeout):
+        self.host = host
+        self.timeout = timeout
+        self.client = None
+        self.lock = threading.Lock()
+        self.last_used = 0.0  # time.monotonic() of the last send or heartbeat
+
+    def is_open(self):
+        return self.client is not None and self.client.connected
+
+    def open(self):
+        if not self.is_open():
+            self.client = websocket.create_connection(self.host, timeout=self.timeout)
+        return self.client
+
+    def close(self):
+        if self.client is not None:
+            try:
+                self.client.close(timeout=0)
+            except Exception:
+                pass
+            self.client = None
+
+    def drain(self):
+        # read whatever the server sent that nobody waited for (replies in fire-and-forget mode), so it does not pile up
+        #   recv_data_frame answers pings; if the server has closed the connection, close our end so it gets reopened
+        while self.is_open() and select.select([self.client.sock], [], [], 0)[0]:
+            opcode, _ = self.client.recv_data_frame(True)
+            if opcode == websocket.ABNF.OPCODE_CLOSE:
+                self.close()
+
+    def send(self, message, wait_for_reply):
+        # returns (opcode, frame) of the reply, or None if not waiting for one
+        client = self.open()
+        self.drain()
+        client.send(message)
+        self.last_used = time.monotonic()
+        if wait_for_reply:
+            return client.recv_data_frame()
+        return None
+
+    def heartbeat(self):
+        # ping, and wait for the pong, skipping anything else that arrives meanwhile
+        self.drain()
+        self.client.ping()
+        self.last_used = time.monotonic()
+        while True:
+            opcode, _ = self.client.recv_data_frame(True)
+            if opcode == websocket.ABNF.OPCODE_PONG:
+                return
+
+
 class CSTargetGenericWebsocket(CSCommandTarget):
     # generic Websocket target
+    #   connections are kept open between commands (unless persistent is false), checked with a ping every heartbeat seconds while idle,
+    #   and reopened when next needed if they have died. with pool_size > 1, that many connections are used to send commands concurrently
+    #   with fire_and_forget, replies are not waited for
 
     # Opcode,Meaning,Reference
     # 0,Continuation Frame,[RFC6455]
@@ -282,45 +527,88 @@ class CSTargetGenericWebsocket(CSCommandTarget):
     def setup(self):
         self.description = 'Generic Websocket'
         self.data['host'] = 'ws://%s:%s' % (self.config['host'], self.config['port'])
-        self.data['client'] = websocket.WebSocket()
+        self.data['persistent'] = self.config.get('persistent', True)
+        self.data['fire_and_forget'] = self.config.get('fire_and_forget', False)
+        self.data['heartbeat'] = self.config.get('heartbeat', 10)  # seconds, 0 to disable
+        timeout = self.config.get('timeout', 5)  # seconds, for connecting and for waiting on a reply
+        pool_size = max(1, self.config.get('pool_size', 1))
+        self.data['connections'] = [CSWebsocketConnection(self.data['host'], timeout) for _ in range(pool_size)]
+        self.data['pool'] = queue.Queue()  # connections not in use right now
+        for connection in self.data['connections']:
+            self.data['pool'].put(connection)
+        self.data['executor'] = None
+        if pool_size > 1:
+            self.data['executor'] = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix=self.name)
+        self.data['stopping'] = threading.Event()
+        if self.data['persistent'] and self.data['heartbeat'] > 0:
+            heartbeat_thread = threading.Thread(target=self.heartbeat, name='%s-heartbeat' % self.name)
+            heartbeat_thread.daemon = True
+            heartbeat_thread.start()
 
     def shutdown(self):
-        self.data['client'].close()
+        if 'stopping' in self.data:
+            self.data['stopping'].set()
+        if self.data.get('executor') is not None:
+            self.data['executor'].shutdown(wait=True)
+        for connection in self.data.get('connections', []):
+            with connection.lock:
+                connection.close()
 
     def send(self, command):
         actual_message = self.conv_msg_type(command)
-        try:
-            self.logger.info('sending Generic Websocket message (%s): %s' % (self.data['host'], actual_message))
-            self.data['client'].connect(self.data['host'])
-            self.data['client'].send(actual_message)
-            reply = self.data['client'].recv_frame()
-            if reply.opcode not in self.ok_opcodes:
-                self.logger.error('reply from Generic Websocket: %s' % reply)
-                raise Exception('reply opcode was not in ok_opcodes, was %s' % reply.opcode)
-            self.logger.debug('reply from Generic Websocket: %s' % reply)
-            self.data['client'].close()
-        except Exception as ex:
-            self.logger.error('exception while trying to send Generic Websocket message: (%s), will reconnect and retry' % ex)
-            self.retry(actual_message)
+        if self.data['executor'] is not None:
+            self.submit(self.data['executor'], self.send_pooled, actual_message)
+        else:
+            self.send_pooled(actual_message)
 
-    def retry(self, message):
+    def send_pooled(self, message):
+        connection = self.data['pool'].get()
         try:
-            self.reconnect()
-            self.logger.info('sending Generic Websocket message (%s): %s' % (self.data['host'], message))
-            self.data['client'].send(message)
-            reply = self.data['client'].recv_frame()
-            if reply.opcode not in self.ok_opcodes:
-                self.logger.error('reply from Generic Websocket: %s' % reply)
-                raise Exception('reply opcode was not in ok_opcodes, was %s' % reply.opcode)
-            self.logger.debug('reply from Generic Websocket (second attempt): %s' % reply)
-            self.data['client'].close()
+            with connection.lock:
+                try:
+                    self.send_message(connection, message)
+                except Exception as ex:
+                    self.logger.error('exception while trying to send Generic Websocket message: (%s), will reconnect and retry' % ex)
+                    self.retry(connection, message)
+                if not self.data['persistent']:
+                    connection.close()
+        finally:
+            self.data['pool'].put(connection)
+
+    def send_message(self, connection, message):
+        self.logger.info('sending Generic Websocket message (%s): %s', self.data['host'], message)
+        reply = connection.send(message, not self.data['fire_and_forget'])
+        if reply is not None:
+            opcode, frame = reply
+            if opcode not in self.ok_opcodes:
+                self.logger.error('reply from Generic Websocket: %s' % frame)
+                raise Exception('reply opcode was not in ok_opcodes, was %s' % opcode)
+            self.logger.debug('reply from Generic Websocket: %s' % frame)
+
+    def retry(self, connection, message):
+        try:
+            self.logger.debug('reconnecting websocket: %s' % self.data['host'])
+            connection.close()
+            self.send_message(connection, message)
         except Exception as ex:
+            connection.close()
             self.logger.error('Generic Websocket send failed (%s) on second attempt, giving up' % ex)
 
-    def reconnect(self):
-        self.logger.debug('reconnecting websocket: %s' % self.data['host'])
-        self.data['client'].close()
-        self.data['client'].connect(self.data['host'])
+    def heartbeat(self):
+        # ping idle connections, so a dead one is found (and closed, to be reopened on the next send) before a cue needs it
+        interval = self.data['heartbeat']
+        while not self.data['stopping'].wait(interval / 2):
+            for connection in self.data['connections']:
+                if not connection.lock.acquire(blocking=False):
+                    continue  # in use, so alive enough
+                try:
+                    if connection.is_open() and time.monotonic() - connection.last_used >= interval:
+                        connection.heartbeat()
+                except Exception as ex:
+                    self.logger.warning('Generic Websocket heartbeat failed (%s), will reconnect on next send' % ex)
+                    connection.close()
+                finally:
+                    connection.lock.release()
 
 
 class CSTargetGenericMQTT(CSCommandTarget):
@@ -336,11 +624,23 @@ class CSTargetGenericMQTT(CSCommandTarget):
 
     def send(self, command):
         host = (self.config['host'], self.config['port'])
-        self.logger.info('sending Generic MQTT message: server: %s, topic: %s, message: %s' % (host, command['topic'], command['message']))
+        self.logger.info('sending Generic MQTT message: server: %s, topic: %s, message: %s', host, command['topic'], command['message'])
         try:
             actual_message = self.conv_msg_type(command)
             self.data['client'].publish(command['topic'], actual_message)
         except Exception as ex:
             self.logger.error('exception while trying to send Generic MQTT message: %s' % ex)
 
+    def send_batch(self, commands):
+        # publish them all, then service the connection once for the whole batch, rather than once per message
+        for command in commands:
+            self.send(command)
+        try:
+            self.data['client'].loop(timeout=0)
+        except Exception as ex:
+            self.logger.error('exception while servicing Generic MQTT connection: %s' % ex)
+
+    def coalesce_key(self, command):
+        return command['topic']
+
 
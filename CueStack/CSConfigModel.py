@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# CueStack Config Model
+
+#    Copyright (C) 2021 James Bishop (james@bishopdynamics.com)
+
+# ignore rules:
+#   docstring
+#   too-broad-exception
+#   line-too-long
+#   too-many-branches
+#   too-many-statements
+#   too-many-public-methods
+#   too-many-lines
+#   too-many-nested-blocks
+#   toddos (annotations linter handling this)
+# pylint: disable=C0111,W0703,C0301,R0912,R0915,R0904,C0302,R1702,W0511
+
+
+class CSConfigModel:
+    # wraps the parsed config, keeping name -> object indexes next to the lists in it, so lookups are O(1)
+    # the config dict itself is still the source of truth (it is what getConfig hands out), so every edit to
+    #   stacks or cues must go through the methods here, otherwise the indexes will go stale
+    # if a name appears more than once, the first one wins
+    # stacks and cues are copied by sharing what they are made of, rather than copying all of it:
+    #   a copied stack shares its list of cues (and its cue index) with the original, and a copied cue shares its parts
+    #   so nothing below a stack is ever changed in place: an edit replaces the list or dict it changes, and the cue above it,
+    #   with an edited copy. this also means a cue runner holding on to a cue keeps seeing it just as it was when it started
+
+    def __init__(self, config):
+        self.config = config
+        self._stacks = {}  # stack name -> stack
+        self._cues = {}  # id(stack) -> {cue name -> cue}, keyed by identity so renaming a stack does not disturb it
+        self._targets = {}  # command target name -> command target
+        self._triggers = {}  # trigger source name -> trigger source
+        self._shared = set()  # id(stack) for stacks whose list of cues may be shared with a copy
+        self.reindex()
+
+    def reindex(self):
+        # rebuild every index from scratch
+        self._stacks = {}
+        self._cues = {}
+        self._targets = {}
+        self._triggers = {}
+        self._shared = set()
+        for stack in self.config['stacks']:
+            self._index_stack(stack)
+        for target in self.config['command_targets']:
+            self._targets.setdefault(target['name'], target)
+        for trigger in self.config['trigger_sources']:
+            self._triggers.setdefault(trigger['name'], trigger)
+
+    def _index_stack(self, stack):
+        self._stacks.setdefault(stack['name'], stack)
+        cue_index = {}
+        for cue in stack['cues']:
+            cue_index.setdefault(cue['name'], cue)
+        self._cues[id(stack)] = cue_index
+
+    def _cue_index(self, stack):
+        # the cue index for a stack object, building it if this stack has not been seen before
+        if id(stack) not in self._cues:
+            self._index_stack(stack)
+        return self._cues[id(stack)]
+
+    def _own_cues(self, stack):
+        # before changing a stack's list of cues, make sure it (and its index) is not shared with a copy of the stack
+        if id(stack) in self._shared:
+            stack['cues'] = list(stack['cues'])
+            self._cues[id(stack)] = dict(self._cue_index(stack))
+            self._shared.discard(id(stack))
+
+    # lookups
+
+    def find_stack(self, stackname):
+        return self._stacks.get(stackname)
+
+    def find_cue(self, stack, cuename):
+        # stack is the actual stack object, as returned by find_stack
+        return self._cue_index(stack).get(cuename)
+
+    def find_target(self, targetname):
+        return self._targets.get(targetname)
+
+    def find_trigger(self, triggername):
+        return self._triggers.get(triggername)
+
+    def stack_names(self):
+        return [stack['name'] for stack in self.config['stacks']]
+
+    # edits
+
+    def add_stack(self, stack):
+        self.config['stacks'].append(stack)
+        self._index_stack(stack)
+        return stack
+
+    def copy_stack(self, stack, new_name):
+        # add a copy of stack, named new_name, which shares the cues of the original until either is edited
+        new_stack = dict(stack, name=new_name)
+        self.config['stacks'].append(new_stack)
+        self._stacks.setdefault(new_name, new_stack)
+        self._cues[id(new_stack)] = self._cue_index(stack)
+        self._shared.update((id(stack), id(new_stack)))
+        return new_stack
+
+    def rename_stack(self, stackname, new_name):
+        stack = self._stacks.pop(stackname)
+        stack['name'] = new_name
+        self._stacks[new_name] = stack
+        self._reveal_stack(stackname)
+        return stack
+
+    def delete_stack(self, stackname):
+        stack = self._stacks.pop(stackname)
+        stacks = self.config['stacks']
+        for i in range(0, len(stacks)):
+            if stacks[i] is stack:
+                del stacks[i]
+                break
+        self._cues.pop(id(stack), None)
+        self._shared.discard(id(stack))
+        self._reveal_stack(stackname)
+        return stack
+
+    def _reveal_stack(self, stackname):
+        # after a stack leaves the index, any later stack with the same name (only possible in a hand-edited config) becomes visible
+        for stack in self.config['stacks']:
+            if stack['name'] == stackname:
+                self._stacks[stackname] = stack
+                break
+
+    def add_cue(self, stack, cue):
+        self._own_cues(stack)
+        stack['cues'].append(cue)
+        self._cue_index(stack).setdefault(cue['name'], cue)
+        return cue
+
+    def delete_cue(self, stack, cuename):
+        self._own_cues(stack)
+        cue_index = self._cue_index(stack)
+        cue = cue_index.pop(cuename)
+        cues = stack['cues']
+        for i in range(0, len(cues)):
+            if cues[i] is cue:
+                del cues[i]
+                break
+        for other in cues:
+            if other['name'] == cuename:
+                cue_index[cuename] = other
+                break
+        return cue
+
+    def copy_cue(self, cue, new_name):
+        # a copy of cue named new_name, sharing its parts, to be added with add_cue
+        return dict(cue, name=new_name)
+
+    def edit_cue(self, stack, cue):
+        # put a copy of cue in its place in stack, and return it, to be changed instead of cue
+        self._own_cues(stack)
+        new_cue = dict(cue)
+        cues = stack['cues']
+        for i in range(0, len(cues)):
+            if cues[i] is cue:
+                cues[i] = new_cue
+                break
+        cue_index = self._cue_index(stack)
+        if cue_index.get(cue['name']) is cue:
+            cue_index[cue['name']] = new_cue
+        return new_cue
+
+    def set_part_enabled(self, stack, cue, part_index, enabled):
+        # part_index counts from zero, returns the edited copy of cue
+        new_cue = self.edit_cue(stack, cue)
+        parts = list(new_cue['parts'])
+        parts[part_index] = dict(parts[part_index], enabled=enabled)
+        new_cue['parts'] = parts
+        return new_cue
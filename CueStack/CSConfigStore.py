@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# CueStack Config Store
+
+#    Copyright (C) 2021 James Bishop (james@bishopdynamics.com)
+
+# ignore rules:
+#   docstring
+#   too-broad-exception
+#   line-too-long
+#   too-many-branches
+#   too-many-statements
+#   too-many-public-methods
+#   too-many-lines
+#   too-many-nested-blocks
+#   toddos (annotations linter handling this)
+# pylint: disable=C0111,W0703,C0301,R0912,R0915,R0904,C0302,R1702,W0511
+
+import os
+import time
+import logging
+import hashlib
+import pathlib
+
+from threading import Thread, Condition, Lock, RLock
+
+
+class CSConfigStore:
+    # writes edits made through the api back to the config file, without making whoever made the edit wait for it
+    #   every edit is appended to a journal next to the config file as it happens, which is a single short line
+    #   the whole config is written out by a thread of its own, at most once every interval, however many edits came in since:
+    #     serialized, written to a temporary file, and renamed over the config file, so it is never left half written
+    #     then the journal is started over, keeping the edits made while the file was being written
+    #   on startup, edits in the journal are replayed on top of the config file, so after a crash nothing is lost
+    #     but what was made in the last interval before a power cut (the journal is flushed, but not synced, on every edit)
+    # the journal starts with the sha256 of the config file it applies to, so a journal left behind after the config file
+    #   was rewritten (or edited by hand) is ignored rather than replayed onto the wrong config
+    # lock must be held while editing the config, and while recording the edit, so the config is never serialized mid edit
+    #   saving holds it only long enough to serialize the config, not while writing it out
+    def __init__(self, config, config_file, codec, interval=1.0):
+        self.config = config
+        self.path = pathlib.Path(config_file)
+        self.journal_path = self.path.with_name(self.path.name + '.journal')
+        self.temp_path = self.path.with_name(self.path.name + '.tmp')
+        self.codec = codec
+        self.interval = interval
+        self.lock = RLock()
+        self._condition = Condition(self.lock)
+        self._save_lock = Lock()  # one save at a time, stop may run while the thread is still saving
+        self._journal = None
+        self._dirty = False
+        self._last_save = 0.0
+        self.should_run = True
+        self._thread = None
+
+    def recover(self):
+        # returns the edits, as api requests, which were journaled against the config file as it is now, to be replayed
+        if not self.journal_path.exists():
+            return []
+        edits = []
+        with open(self.journal_path, 'r', encoding='utf-8') as journal:
+            lines = journal.read().splitlines()
+        if not lines:
+            return []
+        try:
+            base = self.codec.decode(lines[0])['config_sha256']
+        except Exception as ex:
+            logging.warning('ignoring config journal with an unreadable header: %s' % ex)
+            return []
+        if base != self.file_hash():
+            logging.warning('ignoring config journal, it was written for a different version of %s' % self.path)
+            return []
+        for number, line in enumerate(lines[1:], start=2):
+            try:
+                edits.append(self.codec.decode(line))
+            except Exception:
+                if number < len(lines):
+                    logging.error('config journal line %s is corrupt, not replaying it or anything after it' % number)
+                # otherwise it is the last line, cut short by a crash while it was being written
+                break
+        logging.info('replaying %s edits from config journal' % len(edits))
+        return edits
+
+    def start(self, save_now=False):
+        # save_now to write out the config right away, after replaying edits, otherwise just start a new journal for it
+        if save_now:
+            self._save()
+        else:
+            with self.lock:
+                self._start_journal(self.file_hash())
+        self._thread = Thread(target=self._run, name='ConfigStore')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        # write out anything not yet saved, then stop
+        with self._condition:
+            self.should_run = False
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join(5)
+        if self._dirty:
+            self._save()
+        with self.lock:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+
+    def record(self, request, payload):
+        # called with lock held, right after the edit was made to the config
+        self._journal.write(self.codec.encode({'request': request, 'request_payload': payload}) + '\n')
+        self._journal.flush()
+        self._dirty = True
+        self._condition.notify()
+
+    def file_hash(self):
+        with open(self.path, 'rb') as config_file:
+            return hashlib.sha256(config_file.read()).hexdigest()
+
+    def _start_journal(self, base, entries=''):
+        # entries are journal lines, already encoded, for edits the config file does not have yet
+        if self._journal is not None:
+            self._journal.close()
+        self._journal = open(self.journal_path, 'w', encoding='utf-8')
+        self._journal.write(self.codec.encode({'config_sha256': base}) + '\n' + entries)
+        self._journal.flush()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self.should_run and not self._dirty:
+                    self._condition.wait()
+                if not self.should_run:
+                    return
+                wait = self._last_save + self.interval - time.monotonic()
+                if wait > 0:
+                    # give the edits that come in a burst a chance to land in the same save
+                    self._condition.wait(wait)
+                    continue
+            try:
+                self._save()
+            except Exception as ex:
+                logging.error('failed to save config to %s, will try again: %s' % (self.path, ex))
+                with self.lock:
+                    self._dirty = True
+                    self._last_save = time.monotonic()
+
+    def _save(self):
+        # the lock is held only to take a snapshot of the config, and again to start the new journal,
+        #   so edits are not held up by writing the file: whatever is edited meanwhile is journaled after the snapshot,
+        #   and carried over into the new journal
+        with self._save_lock:
+            started = time.monotonic()
+            with self.lock:
+                data = self.codec.encode_indented(self.config).encode('utf-8')
+                position = self._journal.tell() if self._journal is not None else None
+                self._dirty = False
+            with open(self.temp_path, 'wb') as temp_file:
+                temp_file.write(data)
+                temp_file.flush()
+                os.fsync(temp_file.fileno())
+            os.replace(self.temp_path, self.path)
+            # if we crash before the new journal is started, the old one will not match the config file, and is ignored,
+            #   losing only what was edited while the file was being written
+            with self.lock:
+                entries = ''
+                if position is not None:
+                    self._journal.flush()
+                    with open(self.journal_path, 'r', encoding='utf-8') as journal:
+                        journal.seek(position)
+                        entries = journal.read()
+                self._start_journal(hashlib.sha256(data).hexdigest(), entries)
+                self._last_save = time.monotonic()
+            logging.debug('saved config to %s in %.1fms' % (self.path, (self._last_save - started) * 1000))
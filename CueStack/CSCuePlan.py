@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# CueStack Cue Execution Plans
+
+#    Copyright (C) 2021 James Bishop (james@bishopdynamics.com)
+
+# ignore rules:
+#   docstring
+#   too-broad-exception
+#   line-too-long
+#   too-many-branches
+#   too-many-statements
+#   too-many-public-methods
+#   too-many-lines
+#   too-many-nested-blocks
+#   toddos (annotations linter handling this)
+# pylint: disable=C0111,W0703,C0301,R0912,R0915,R0904,C0302,R1702,W0511
+
+import json
+import logging
+
+from collections import namedtuple
+
+# a single part, ready to go
+#   offset - seconds from the start of the cue
+#   part_number - position of this part in execution order, counting disabled parts, as shown in log messages
+#   target - name of the command target, or 'internal'
+#   queue - the command queue for target, or None if target is internal or not currently enabled
+#   command - the command to put on queue
+#   command_text - command, already json-encoded for logging
+CSCuePlanStep = namedtuple('CSCuePlanStep', ['offset', 'part_number', 'target', 'queue', 'command', 'command_text'])
+
+# steps which are fired together: those with the same offset and the same (enabled) command target, or a single other step
+#   offset, target, queue - shared by all of steps
+#   steps - tuple of CSCuePlanStep, in execution order
+#   payload - what to put on queue: the command of a single step, or a list of the commands of several, which the target sends as one batch
+CSCuePlanBatch = namedtuple('CSCuePlanBatch', ['offset', 'target', 'queue', 'steps', 'payload'])
+
+# a whole cue, compiled
+#   cue - the cue object this plan was compiled from
+#   enabled - False if the whole cue is disabled
+#   total_parts - number of parts in the cue, including disabled ones
+#   steps - tuple of CSCuePlanStep, sorted by offset, disabled parts left out
+#   batches - tuple of CSCuePlanBatch, the same steps grouped for firing, sorted by offset
+CSCuePlan = namedtuple('CSCuePlan', ['cue', 'name', 'enabled', 'total_parts', 'steps', 'batches'])
+
+
+def compile_cue_plan(cue, command_queues, command_targets_list):
+    # sort parts by delay (stable, so parts with the same delay keep their order), resolve target queues and serialize commands for logging
+    _sorted_partlist = sorted(cue['parts'], key=lambda i: i.get('delay', 0))
+    #   disabled parts are left out, with a warning for each, once per compile rather than every time the cue fires
+    steps = []
+    total_parts = len(cue['parts'])
+    for part_number, cue_part in enumerate(_sorted_partlist, start=1):
+        if not cue_part.get('enabled', True):
+            logging.warning('ignoring disabled cue part: %s part %s/%s, target: %s, command: %s' % (cue['name'], part_number, total_parts, cue_part['target'], json.dumps(cue_part['command'])))
+            continue
+        target = cue_part['target']
+        queue = None
+        if target != 'internal' and target in command_targets_list:
+            queue = command_queues[target]
+        steps.append(CSCuePlanStep(
+            offset=cue_part.get('delay', 0) / 1000,
+            part_number=part_number,
+            target=target,
+            queue=queue,
+            command=cue_part['command'],
+            command_text=json.dumps(cue_part['command']),
+        ))
+    return CSCuePlan(
+        cue=cue,
+        name=cue['name'],
+        enabled=cue.get('enabled', True),
+        total_parts=total_parts,
+        steps=tuple(steps),
+        batches=group_steps(steps),
+    )
+
+
+def group_steps(steps):
+    # group steps (sorted by offset) which are due at the same time for the same command target
+    #   internal steps, and steps for a target which is not enabled, are each fired on their own
+    groups = {}  # insertion order keeps batches sorted by offset
+    for index, step in enumerate(steps):
+        if step.queue is None:
+            groups[index] = [step]
+        else:
+            groups.setdefault((step.offset, step.target), []).append(step)
+    batches = []
+    for group in groups.values():
+        first = group[0]
+        batches.append(CSCuePlanBatch(
+            offset=first.offset,
+            target=first.target,
+            queue=first.queue,
+            steps=tuple(group),
+            payload=first.command if len(group) == 1 else [step.command for step in group],
+        ))
+    return tuple(batches)
+
+
+class CSCuePlanCache:
+    # compiles each cue into a CSCuePlan the first time it is fired, and hands back the same plan until that cue is edited
+    # anything that edits a cue must call invalidate(cue), and anything that changes the set of enabled command targets must call clear()
+    def __init__(self, command_queues, command_targets_list):
+        self.command_queues = command_queues
+        self.command_targets_list = command_targets_list
+        self._plans = {}  # id(cue) -> CSCuePlan
+
+    def get(self, cue):
+        plan = self._plans.get(id(cue))
+        if plan is None or plan.cue is not cue:  # identity check guards against a deleted cue's id being reused
+            plan = compile_cue_plan(cue, self.command_queues, self.command_targets_list)
+            self._plans[id(cue)] = plan
+        return plan
+
+    def invalidate(self, cue):
+        self._plans.pop(id(cue), None)
+
+    def clear(self):
+        self._plans.clear()
@@ -3,14 +3,16 @@
 # heavily modified
 
 import logging.handlers
+import multiprocessing.util
 import threading
 import platform
 import logging
+import queue
+import json
 import sys
+import os
 import multiprocessing
 
-import io
-
 
 _lock = threading.RLock()
 
@@ -54,6 +56,7 @@ class CustomFormatter(logging.Formatter):
         self.name = name
         self.custom_format = custom_format
         self.FORMATS = self.define_format()
+        self.formatters = {level: logging.Formatter(log_fmt) for level, log_fmt in self.FORMATS.items()}
         # if auto_colorized and custom_format:
         #     print("WARNING: Ignoring auto_colorized argument because you provided a custom_format")
 
@@ -98,21 +101,74 @@ class CustomFormatter(logging.Formatter):
             }
 
     def format(self, record):
-        log_fmt = self.FORMATS.get(record.levelno)
-        formatter = logging.Formatter(log_fmt)
+        formatter = self.formatters.get(record.levelno)
+        if formatter is None:  # a custom level
+            formatter = self.formatters[logging.INFO]
         return formatter.format(record)
 
 
-# Just import this function into your programs
-# "from logger import get_logger"
-# "logger = get_logger(__name__)"
-# Use the variable __name__ so the logger will print the file's name also
-class __NullHandler(io.StringIO):
+class LazyJSON:
+    # json encodes obj only if the log line it is an argument of actually gets written, and then on the listener thread:
+    #   logger.info('sending: %s', LazyJSON(command))
+    def __init__(self, obj):
+        self.obj = obj
+
+    def __str__(self):
+        return json.dumps(self.obj)
+
+
+class CSQueueHandler(logging.handlers.QueueHandler):
+    # hands records to a listener thread, which formats them and writes them out, so whoever is logging never waits on the console
+    #   the record is handed over as it is, so its message (and any LazyJSON in its args) is only built on the listener thread
+    #   a forked process does not get the listener thread, so it starts its own the first time it logs anything
+    def __init__(self, handler):
+        self.handler = handler
+        self.listener = None
+        self.pid = None
+        super().__init__(None)
+        self.start_listener()
+
+    def start_listener(self):
+        self.queue = queue.SimpleQueue()  # after a fork, the old queue may have been left locked by the parent's listener
+        self.listener = logging.handlers.QueueListener(self.queue, self.handler, respect_handler_level=True)
+        self.listener.start()
+        self.pid = os.getpid()
+        # anything still queued is written out on the way out, including from a multiprocessing.Process, which skips atexit
+        multiprocessing.util.Finalize(None, self.stop_listener, exitpriority=100)
+
+    def stop_listener(self):
+        if self.listener is not None and self.pid == os.getpid():
+            self.listener.stop()
+            self.listener = None
+
+    def prepare(self, record):
+        return record
+
     def emit(self, record):
-        pass
+        if self.pid != os.getpid():
+            with _lock:
+                if self.pid != os.getpid():
+                    self.start_listener()
+        super().emit(record)
+
+
+def find_queue_handler(logger):
+    for handler in logger.handlers:
+        if isinstance(handler, CSQueueHandler):
+            return handler
+    return None
+
 
-    def write(self, *args, **kwargs):
-        pass
+def set_queue_handler(logger, formatter, level):
+    # give logger a CSQueueHandler writing to the console, or update the one it already has, so calling this again never duplicates lines
+    with _lock:
+        queue_handler = find_queue_handler(logger)
+        if queue_handler is None:
+            ch = logging.StreamHandler()
+            queue_handler = CSQueueHandler(ch)
+            logger.addHandler(queue_handler)
+        queue_handler.handler.setLevel(level)
+        queue_handler.handler.setFormatter(formatter)
 
 
 class SpecialHandler(logging.StreamHandler):
@@ -134,21 +190,19 @@ class SpecialHandler(logging.StreamHandler):
         print(l_text)
 
 
+# Just import this function into your programs
+# "from logger import get_logger"
+# "logger = get_logger(__name__)"
+# Use the variable __name__ so the logger will print the file's name also
 def get_logger(name, auto_colorized=True, custom_format: str = None, level=logging.INFO):
-    logging.basicConfig(level=level, stream=__NullHandler())
-    root = logging.root
-    ch = logging.StreamHandler()
-    ch.setLevel(level)
-    ch.setFormatter(CustomFormatter(auto_colorized, custom_format, name=name))
-    root.addHandler(ch)
+    logging.root.setLevel(level)
+    set_queue_handler(logging.root, CustomFormatter(auto_colorized, custom_format, name=name), level)
     return logging.getLogger(name)
 
 
 def get_mplogger(name='', auto_colorized=True, level=logging.INFO):
+    # the multiprocessing logger is one per process, and does not propagate to root
     logger = multiprocessing.get_logger()
-    ch = logging.StreamHandler()
-    ch.setLevel(level)
-    ch.setFormatter(CustomFormatter(auto_colorized, name=name))
-    logger.addHandler(ch)
+    set_queue_handler(logger, CustomFormatter(auto_colorized, name=name), level)
     logger.setLevel(level)
     return logger
@@ -18,17 +18,25 @@
 
 import time
 import json
-import copy
 import logging
 
-from datetime import datetime, timedelta
+from datetime import datetime
 from multiprocessing import Process, Queue
-from threading import Thread
+
+from CSScheduler import CSCueScheduler
 
 from CSTriggerSources import CSTriggerGenericWebsocket, CSTriggerGenericHTTP, CSTriggerGenericMQTT
-from CSCommandTargets import CSTargetOBS, CSTargetGenericOSC, CSTargetGenericTCP, CSTargetGenericUDP, CSTargetGenericHTTP, CSTargetGenericWebsocket, CSTargetGenericMQTT
+from CSCommandTargets import CSTargetOBS, CSTargetGenericOSC, CSTargetGenericTCP, CSTargetGenericUDP, CSTargetGenericHTTP, CSTargetGenericWebsocket, CSTargetGenericMQTT, TARGET_EXIT_MSG
 
 from CSCommon import *
+from CSConfigModel import CSConfigModel
+from CSCuePlan import CSCuePlanCache
+from CSCommandQueue import CSCommandQueue, QUEUE_COUNTERS
+from CSCodec import CSCodec
+from CSMetrics import CSMetrics
+from CSTrace import CSTracer, TRACE_SCHEDULED, TRACE_QUEUED
+from CSConfigStore import CSConfigStore
+from CSTargetEngine import CSTargetEngine
 
 
 class CSMessageProcessor:
@@ -37,6 +45,7 @@ class CSMessageProcessor:
     command_targets_list = []  # holds the NAMES of command targets as a list, nothing else
     command_queues = {}  # holds the queues for pushing messages to the process which sends them
     trigger_queue = None  # trigger sources place received messages in this queue, which the message processor then pulls from
+    target_stop_timeout = 2.0  # seconds, how long to wait for a command target to exit cleanly before terminating it
     target_map = {  # this maps command target types to the corresponding class
         'obs_websocket': CSTargetOBS,
         'osc_generic': CSTargetGenericOSC,
@@ -51,18 +60,49 @@ class CSMessageProcessor:
         'http': CSTriggerGenericHTTP,
         'mqtt': CSTriggerGenericMQTT,
     }
+    config_edit_requests = ['addCue', 'deleteCue', 'addStack', 'deleteStack', 'renameStack', 'setDefaultStack', 'setEnabled']  # saved with save_config
 
-    def __init__(self, config, log_level, loop):
+    def __init__(self, config, log_level, loop, config_file=None):
         logging.debug('Initializing a CSMessageProcessor')
         self.config = config
+        self.config_model = CSConfigModel(self.config)  # all lookups and edits of stacks and cues go through this
         self.loop = loop
         self.log_level = log_level
         self.trigger_queue = Queue()
-        self.current_cue_stack = find_stack(self.config, self.config['default_stack'])  # holds actual stack object
+        self.codec = CSCodec(self.config.get('json_backend', 'auto'))  # decodes trigger messages, and is shared with trigger sources for replies
+        self.metrics = CSMetrics()  # reported by getMetrics, and by http trigger sources with a metrics_route
+        # every trigger decodes its own messages, from its own thread: websocket executor, http workers, mqtt client
+        self.decode_time = self.metrics.histogram('trigger_decode_seconds', 'Time taken to decode a trigger message', locked=True)
+        self.metrics.histogram('cue_lateness_seconds', 'How long after it was due each batch of cue parts was put on its target queue')
+        self.metrics.describe('command_queue_depth', 'gauge', 'Commands (or batches of commands) waiting on a command target queue')
+        self.metrics.describe('command_queue_commands_total', 'counter', 'Commands counted by command target queues, by what happened to them')
+        self.metrics.describe('command_time_in_queue_seconds', 'histogram', 'How long commands waited on a command target queue')
+        self.metrics.describe('command_send_seconds', 'histogram', 'Time taken by a command target to send each batch of commands')
+        self.metrics.describe('cue_scheduler_pending', 'gauge', 'Batches of cue parts waiting for the cue scheduler to fire them')
+        self.metrics.describe('cue_lateness_max_seconds', 'gauge', 'Worst lateness of any batch of cue parts fired by the cue scheduler')
+        self.metrics.describe('cue_lateness_last_seconds', 'gauge', 'Lateness of the batch of cue parts the cue scheduler fired most recently')
+        self.metrics.add_collector(self.collect_queue_metrics)
+        self.metrics.add_collector(self.collect_scheduler_metrics)
+        self.trace_size = self.config.get('trace_events', 0)
+        self.tracer = CSTracer(self.trace_size) if self.trace_size > 0 else None  # opt in, records the timeline of every cue part
+        self.scheduler = CSCueScheduler()  # every cue runner hands its parts to this, to be fired on time
+        self.plan_cache = CSCuePlanCache(self.command_queues, self.command_targets_list)  # compiled cues, ready to fire
+        self.current_cue_stack = self.config_model.find_stack(self.config['default_stack'])  # holds actual stack object
+        self.target_engine = None  # with command_target_engine set to async, targets which are not isolated run on this, instead of in a process each
+        if self.config.get('command_target_engine', 'process') == 'async':
+            self.target_engine = CSTargetEngine()
+        self.config_store = None  # with save_config set, edits made through the api are written back to config_file
+        self.replaying_edits = False  # while edits from the config journal are replayed, see recover_config_edits
+        if self.config.get('save_config', False) and config_file is not None:
+            self.config_store = CSConfigStore(self.config, config_file, self.codec, self.config.get('save_interval_ms', 1000) / 1000)
         self.setup_command_targets()
+        if self.config_store is not None:
+            self.recover_config_edits()
         self.setup_trigger_sources()
 
     def stop(self):
+        logging.info('shutting down cue scheduler')
+        self.scheduler.stop()
         logging.info('shutting down trigger sources')
         for this_source in self.trigger_sources:
             try:
@@ -70,24 +110,48 @@ class CSMessageProcessor:
             except Exception:
                 pass
         logging.info('shutting down command targets')
-        for this_target in self.command_targets:
+        for this_target in list(self.command_targets):
             try:
-                logging.debug('shutting down command target process: %s' % this_target)
-                self.command_targets[this_target].terminate()
-                self.command_targets[this_target].join()
+                self.stop_command_target(this_target)
             except Exception:
                 pass
+        if self.target_engine is not None:
+            self.target_engine.stop()
+        if self.config_store is not None:
+            logging.info('saving config')
+            self.config_store.stop()
+
+    def recover_config_edits(self):
+        # replay edits which were journaled but never made it into the config file, then start saving new ones
+        #   only edits which succeeded were journaled, so checks against runtime state (which stack is active) are skipped,
+        #   they passed when the edit was made, against whatever was active then
+        edits = self.config_store.recover()
+        self.replaying_edits = True
+        try:
+            for edit in edits:
+                response = self.run_api_request(edit)
+                if response['status'] != 'OK':
+                    logging.warning('replaying %s from config journal failed: %s' % (edit['request'], response['status']))
+        finally:
+            self.replaying_edits = False
+        if edits:
+            self.current_cue_stack = self.config_model.find_stack(self.config['default_stack'])
+        self.config_store.start(save_now=len(edits) > 0)
 
     def handle(self, _msg):
         # you can have cut, stack, and request all in the same message
+        handle_started = time.monotonic()
         try:
             try:
-                trigger_message = json.loads(_msg, object_pairs_hook=dict_raise_on_duplicates)
-                logging.debug('decoded message: \n%s' % json.dumps(trigger_message, indent=4, sort_keys=True))
+                started = time.monotonic()
+                trigger_message = self.codec.decode(_msg)
+                self.decode_time.observe(time.monotonic() - started)
             except Exception as ex:
                 logging.error('JSON Decode Failure: %s' % ex)
                 logging.debug('the received message: \n%s' % _msg)
                 return {'status': 'JSON Decode Failure: %s' % ex}
+            if logging.getLogger().isEnabledFor(logging.DEBUG):
+                logging.debug('decoded message: \n%s' % json.dumps(trigger_message, indent=4, sort_keys=True))
             response = {'status': 'invalid request'}  # should get overwritten if this is a valid request
             if 'cue' in trigger_message or 'stack' in trigger_message:
                 response = self.handle_api_cuestack(trigger_message)
@@ -98,6 +162,9 @@ class CSMessageProcessor:
         except Exception as e:
             logging.error('unexpected exception while parsing message: %s' % e)
             return {'status': 'Unexpected Exception'}
+        finally:
+            if self.tracer is not None:
+                self.tracer.record('trigger', handle_started, time.monotonic() - handle_started)
 
     def handle_api_cuestack(self, trigger_message):
         # triggering a cue or stack
@@ -106,7 +173,7 @@ class CSMessageProcessor:
             request_id = trigger_message['request_id']
         if 'stack' in trigger_message:
             logging.info('switching to cue stack: %s' % trigger_message['stack'])
-            actual_stack = find_stack(self.config, trigger_message['stack'])
+            actual_stack = self.config_model.find_stack(trigger_message['stack'])
             if actual_stack is not None:
                 self.current_cue_stack = actual_stack
                 # dont return yet
@@ -116,7 +183,7 @@ class CSMessageProcessor:
                 return {'status': 'Stack Not Found: %s' % trigger_message['stack'], 'request_id': request_id}
         if 'cue' in trigger_message:
             logging.debug('received trigger for cue: %s' % trigger_message['cue'])
-            actual_cue = find_cue(self.current_cue_stack, trigger_message['cue'])
+            actual_cue = self.config_model.find_cue(self.current_cue_stack, trigger_message['cue'])
             if actual_cue is not None:
                 if not self.start_cue_runner(actual_cue):
                     logging.error('failed to start cue runner')
@@ -128,8 +195,7 @@ class CSMessageProcessor:
 
     def start_cue_runner(self, actual_cue):
         try:
-            cue_runner = Thread(target=CSCueRunner, args=(self.command_queues, self.command_targets_list, self.current_cue_stack, actual_cue))
-            cue_runner.start()
+            CSCueRunner(self.scheduler, self.config_model, self.plan_cache, self.metrics, self.tracer, self.current_cue_stack, actual_cue)
             return True
         except Exception as ex:
             logging.exception('unexpected exception while starting cue runner: %s' % ex)
@@ -152,6 +218,16 @@ class CSMessageProcessor:
                 raise Exception('no enabled command target exists to handle cue target: %s' % cue_part['target'])
 
     def handle_api_request(self, trigger_message):
+        # edits are made with the config store's lock held, so it never saves the config halfway through one
+        if self.config_store is None or trigger_message.get('request') not in self.config_edit_requests:
+            return self.run_api_request(trigger_message)
+        with self.config_store.lock:
+            response = self.run_api_request(trigger_message)
+            if response['status'] == 'OK':
+                self.config_store.record(trigger_message['request'], trigger_message.get('request_payload', {}))
+        return response
+
+    def run_api_request(self, trigger_message):
         # data api requests
         try:
             request = trigger_message['request']
@@ -167,9 +243,7 @@ class CSMessageProcessor:
                     cuelist.append(cue['name'])
                 response = {'status': 'OK', 'request_id': request_id, 'response': {'cues': cuelist}}
             elif request == 'getStacks':
-                stacklist = []
-                for stack in self.config['stacks']:
-                    stacklist.append(stack['name'])
+                stacklist = self.config_model.stack_names()
                 response = {'status': 'OK', 'request_id': request_id, 'response': {'stacks': stacklist}}
             elif request == 'getConfig':
                 logging.debug('handling request getConfig')
@@ -187,6 +261,19 @@ class CSMessageProcessor:
                 for target in self.command_targets:
                     targetlist.append(target)
                 response = {'status': 'OK', 'request_id': request_id, 'response': {'commandTargets': targetlist}}
+            elif request == 'getQueueStats':
+                stats = {}
+                for target in self.command_queues:
+                    stats[target] = self.command_queues[target].stats()
+                response = {'status': 'OK', 'request_id': request_id, 'response': {'queueStats': stats}}
+            elif request == 'getTrace':
+                if self.tracer is None:
+                    response = {'status': 'Error: tracing is not enabled, set trace_events in config', 'request_id': request_id}
+                else:
+                    rings = {target: command_queue.trace for target, command_queue in list(self.command_queues.items()) if command_queue.trace is not None}
+                    response = {'status': 'OK', 'request_id': request_id, 'response': {'trace': self.tracer.chrome_trace(rings)}}
+            elif request == 'getMetrics':
+                response = {'status': 'OK', 'request_id': request_id, 'response': {'metrics': self.metrics.snapshot()}}
             elif request == 'addCommandTarget':
                 try:
                     logging.info('adding new command target from api->request->addTarget: %s' % payload)
@@ -211,68 +298,64 @@ class CSMessageProcessor:
                 # we do not want to edit cue parts thru api, it should be edited client-side and sent as an entire cue update
                 try:
                     stackname = payload['stack']
+                    cuename = payload['cue']['name']
                     want_replace = False
+                    from_cue = None
                     if 'copyFrom' in payload:
-                        if find_stack(self.config, payload['copyFrom']['stack']) is None:
+                        from_stack = self.config_model.find_stack(payload['copyFrom']['stack'])
+                        if from_stack is None:
                             raise Exception('cannot find stack to copy from: %s' % payload['copyFrom']['stack'])
-                        if find_cue(find_stack(self.config, payload['copyFrom']['stack']), payload['copyFrom']['cue']) is None:
+                        from_cue = self.config_model.find_cue(from_stack, payload['copyFrom']['cue'])
+                        if from_cue is None:
                             raise Exception('cannot find cue to copy from: %s in stack: %s' % (payload['copyFrom']['cue'], payload['copyFrom']['stack']))
-                    if 'replace' in payload:
-                        if payload['replace']:
-                            want_replace = True
-                            if find_cue(find_stack(self.config, stackname), payload['cue']['name']) is None:
-                                raise Exception('cannot find the cue trying to replace: stack: %s, cue: %s' % (stackname, payload['cue']['name']))
-                        else:
-                            if find_cue(find_stack(self.config, stackname), payload['cue']['name']) is not None:
-                                raise Exception('Cue named %s already exists in stack %s' % (payload['cue']['name'], stackname))
+                    stack_obj = self.config_model.find_stack(stackname)
+                    existing_cue = None
+                    if stack_obj is not None:
+                        existing_cue = self.config_model.find_cue(stack_obj, cuename)
+                    if 'replace' in payload and payload['replace']:
+                        want_replace = True
+                        if existing_cue is None:
+                            raise Exception('cannot find the cue trying to replace: stack: %s, cue: %s' % (stackname, cuename))
                     else:
-                        if find_cue(find_stack(self.config, stackname), payload['cue']['name']) is not None:
-                            raise Exception('Cue named %s already exists in stack %s' % (payload['cue']['name'], stackname))
-                    if find_stack(self.config, stackname) is None:
+                        if existing_cue is not None:
+                            raise Exception('Cue named %s already exists in stack %s' % (cuename, stackname))
+                    if stack_obj is None:
                         logging.info('addCue is implicitly adding an empty stack: %s' % stackname)
-                        self.config['stacks'].append(
+                        stack_obj = self.config_model.add_stack(
                             {
                                 'name': stackname,
                                 'cues': []
                             }
                         )
-                    stack_obj = find_stack(self.config, stackname)
-                    if 'copyFrom' in payload:
-                        from_stack = find_stack(self.config, payload['copyFrom']['stack'])
-                        from_cue = find_cue(from_stack, payload['copyFrom']['cue'])
-                        new_cue = copy.deepcopy(from_cue)
+                    if from_cue is not None:
+                        # the copy shares its parts with from_cue, see CSConfigModel
                         if want_replace:
-                            logging.info('replacing cue %s in stack %s, copying from: stack: %s, cue: %s' % (payload['cue']['name'], stackname, payload['copyFrom']['stack'], payload['copyFrom']['cue']))
-                            existing_cue = find_cue(stack_obj, payload['cue']['name'])
-                            existing_cue['parts'] = new_cue['parts']
+                            logging.info('replacing cue %s in stack %s, copying from: stack: %s, cue: %s' % (cuename, stackname, payload['copyFrom']['stack'], payload['copyFrom']['cue']))
+                            self.config_model.edit_cue(stack_obj, existing_cue)['parts'] = from_cue['parts']
+                            self.plan_cache.invalidate(existing_cue)
                         else:
-                            logging.info('adding new cue %s to stack %s, copying from: stack: %s, cue: %s' % (payload['cue']['name'], stackname, payload['copyFrom']['stack'], payload['copyFrom']['cue']))
-                            new_cue['name'] = payload['cue']['name']
-                            stack_obj['cues'].append(new_cue)
+                            logging.info('adding new cue %s to stack %s, copying from: stack: %s, cue: %s' % (cuename, stackname, payload['copyFrom']['stack'], payload['copyFrom']['cue']))
+                            self.config_model.add_cue(stack_obj, self.config_model.copy_cue(from_cue, cuename))
                         response = {'status': 'OK', 'request_id': request_id}
                     else:
                         if want_replace:
-                            logging.info('replacing cue %s in stack %s' % (payload['cue']['name'], stackname))
-                            existing_cue = find_cue(stack_obj, payload['cue']['name'])
-                            existing_cue['parts'] = payload['cue']['parts']
+                            logging.info('replacing cue %s in stack %s' % (cuename, stackname))
+                            self.config_model.edit_cue(stack_obj, existing_cue)['parts'] = payload['cue']['parts']
+                            self.plan_cache.invalidate(existing_cue)
                         else:
-                            logging.info('adding new cue %s to stack %s' % (payload['cue']['name'], stackname))
-                            stack_obj['cues'].append(payload['cue'])
+                            logging.info('adding new cue %s to stack %s' % (cuename, stackname))
+                            self.config_model.add_cue(stack_obj, payload['cue'])
                         response = {'status': 'OK', 'request_id': request_id}
                 except Exception as ex:
                     logging.error('addCue failed: %s' % ex)
                     response = {'status': 'Exception: %s' % ex, 'request_id': request_id}
             elif request == 'deleteCue':
                 try:
-                    if find_stack(self.config, payload['stack']) is not None:
-                        if find_cue(find_stack(self.config, payload['stack']), payload['cue']) is not None:
-                            stack = find_stack(self.config, payload['stack'])
-                            cue_index = find_cue_index(stack, payload['cue'])
-                            if cue_index is not None:
-                                logging.info('handling deleteCue for stack: %s, cue: %s' % (payload['stack'], payload['cue']))
-                                del stack['cues'][cue_index]
-                            else:
-                                Exception('deleteCue failed to find index of cue in list')
+                    stack = self.config_model.find_stack(payload['stack'])
+                    if stack is not None:
+                        if self.config_model.find_cue(stack, payload['cue']) is not None:
+                            logging.info('handling deleteCue for stack: %s, cue: %s' % (payload['stack'], payload['cue']))
+                            self.plan_cache.invalidate(self.config_model.delete_cue(stack, payload['cue']))
                         else:
                             raise Exception('unable to find cue to delete: stack: %s, cue: %s' % (payload['stack'], payload['cue']))
                     else:
@@ -284,19 +367,17 @@ class CSMessageProcessor:
             elif request == 'addStack':
                 try:
                     stackname = payload['stack']
-                    if find_stack(self.config, stackname) is None:
+                    if self.config_model.find_stack(stackname) is None:
                         if 'copyFrom' in payload:
-                            if find_stack(self.config, payload['copyFrom']) is not None:
+                            copy_from = self.config_model.find_stack(payload['copyFrom'])
+                            if copy_from is not None:
                                 logging.info('Adding a new stack: %s, copying from: %s' % (stackname, payload['copyFrom']))
-                                copy_from = find_stack(self.config, payload['copyFrom'])
-                                newstack = copy.deepcopy(copy_from)
-                                newstack['name'] = stackname
-                                self.config['stacks'].append(newstack)
+                                self.config_model.copy_stack(copy_from, stackname)
                             else:
                                 raise Exception('unable to find copyFrom stack: %s' % payload['copyFrom'])
                         else:
                             logging.info('Adding a new empty stack: %s' % stackname)
-                            self.config['stacks'].append(
+                            self.config_model.add_stack(
                                 {
                                     'name': stackname,
                                     'cues': []
@@ -310,15 +391,13 @@ class CSMessageProcessor:
                     response = {'status': 'Exception: %s' % ex, 'request_id': request_id}
             elif request == 'deleteStack':
                 try:
-                    if self.current_cue_stack['name'] == payload['stack']:
+                    if not self.replaying_edits and self.current_cue_stack['name'] == payload['stack']:
                         raise Exception('Cannot delete the currently active stack: %s' % payload['stack'])
-                    if find_stack(self.config, payload['stack']) is not None:
+                    if self.config['default_stack'] == payload['stack']:
+                        raise Exception('Cannot delete the default stack: %s, set another one as default first' % payload['stack'])
+                    if self.config_model.find_stack(payload['stack']) is not None:
                         logging.info('handling deleteStack for stack: %s' % payload['stack'])
-                        stack_index = find_stack_index(self.config, payload['stack'])
-                        if stack_index is not None:
-                            del self.config['stacks'][stack_index]
-                        else:
-                            raise Exception('deleteStack failed to find index of stack in list')
+                        self.config_model.delete_stack(payload['stack'])
                     else:
                         raise Exception('unable to delete stack, cannot find it: %s' % payload['stack'])
                     response = {'status': 'OK', 'request_id': request_id}
@@ -327,13 +406,15 @@ class CSMessageProcessor:
                     response = {'status': 'Exception: %s' % ex, 'request_id': request_id}
             elif request == 'renameStack':
                 try:
-                    if self.current_cue_stack['name'] == payload['stack']:
+                    if not self.replaying_edits and self.current_cue_stack['name'] == payload['stack']:
                         raise Exception('Cannot rename the currently active stack: %s' % payload['stack'])
-                    if find_stack(self.config, payload['stack']) is not None:
-                        if find_stack(self.config, payload['new_name']) is None:
+                    if self.config_model.find_stack(payload['stack']) is not None:
+                        if self.config_model.find_stack(payload['new_name']) is None:
                             logging.info('handling renameStack for stack: %s to: %s' % (payload['stack'], payload['new_name']))
-                            stack = find_stack(self.config, payload['stack'])
-                            stack['name'] = payload['new_name']
+                            self.config_model.rename_stack(payload['stack'], payload['new_name'])
+                            if self.config['default_stack'] == payload['stack']:
+                                logging.info('setting default_stack to: %s' % payload['new_name'])
+                                self.config['default_stack'] = payload['new_name']
                         else:
                             raise Exception('cannot rename because stack: %s already exists' % payload['new_name'])
                     else:
@@ -344,7 +425,7 @@ class CSMessageProcessor:
                     response = {'status': 'Exception: %s' % ex, 'request_id': request_id}
             elif request == 'setDefaultStack':
                 try:
-                    if find_stack(self.config, payload['stack']) is not None:
+                    if self.config_model.find_stack(payload['stack']) is not None:
                         logging.info('setting default_stack to: %s' % payload['stack'])
                         self.config['default_stack'] = payload['stack']
                     else:
@@ -361,10 +442,13 @@ class CSMessageProcessor:
                     if 'cue' in payload:
                         cuename = payload['cue']['name']
                         stackname = payload['cue']['stack']
-                        if find_stack(self.config, stackname) is not None:
-                            if find_cue(find_stack(self.config, stackname), cuename) is not None:
+                        stack = self.config_model.find_stack(stackname)
+                        if stack is not None:
+                            cue = self.config_model.find_cue(stack, cuename)
+                            if cue is not None:
                                 logging.info('setting cue: %s in stack: %s, enabled: %s' % (cuename, stackname, enabled))
-                                find_cue(find_stack(self.config, stackname), cuename)['enabled'] = enabled
+                                self.config_model.edit_cue(stack, cue)['enabled'] = enabled
+                                self.plan_cache.invalidate(cue)
                             else:
                                 raise Exception('unable to find cue: %s in stack: %s' % (cuename, stackname))
                         else:
@@ -375,19 +459,22 @@ class CSMessageProcessor:
                         stackname = payload['part']['stack']
                         cuename = payload['part']['cue']
                         partno = payload['part']['part']
-                        if find_stack(self.config, stackname) is not None:
-                            if find_cue(find_stack(self.config, stackname), cuename) is not None:
-                                cue = find_cue(find_stack(self.config, stackname), cuename)
+                        stack = self.config_model.find_stack(stackname)
+                        if stack is not None:
+                            cue = self.config_model.find_cue(stack, cuename)
+                            if cue is not None:
                                 if 1 <= partno < len(cue['parts']) + 1:
                                     if 'enabled' in cue['parts'][partno - 1]:
                                         if cue['parts'][partno - 1]['enabled'] == enabled:
                                             logging.info('stack: %s, cue: %s, part: %s is already enabled: %s' % (stackname, cuename, partno, enabled))
                                         else:
                                             logging.info('setting stack: %s, cue: %s, part: %s, enabled: %s' % (stackname, cuename, partno, enabled))
-                                            cue['parts'][partno - 1]['enabled'] = enabled
+                                            self.config_model.set_part_enabled(stack, cue, partno - 1, enabled)
+                                            self.plan_cache.invalidate(cue)
                                     else:
                                         logging.info('setting stack: %s, cue: %s, part: %s, enabled: %s' % (stackname, cuename, partno, enabled))
-                                        cue['parts'][partno - 1]['enabled'] = enabled
+                                        self.config_model.set_part_enabled(stack, cue, partno - 1, enabled)
+                                        self.plan_cache.invalidate(cue)
                                 else:
                                     raise Exception('invalid part number: stack: %s, cue: %s, part: %s' % (stackname, cuename, partno))
                             else:
@@ -396,29 +483,29 @@ class CSMessageProcessor:
                             raise Exception('unable to find stack: %s' % stackname)
                     elif 'commandTarget' in payload:
                         targetname = payload['target']['name']
-                        if find_target(self.config, targetname) is not None:
-                            if find_target(self.config, targetname)['enabled'] == enabled:
+                        target = self.config_model.find_target(targetname)
+                        if target is not None:
+                            if target['enabled'] == enabled:
                                 logging.info('command target: %s enabled is already %s' % (targetname, enabled))
                             else:
                                 logging.info('setting command target: %s, enabled: %s' % (targetname, enabled))
-                                find_target(self.config, targetname)['enabled'] = enabled
+                                target['enabled'] = enabled
                                 if enabled:
-                                    self.setup_command_target(find_target(self.config, targetname))
+                                    self.setup_command_target(target)
                                 else:
-                                    self.command_targets[targetname].terminate()
-                                    self.command_targets[targetname].join()
-                                    self.command_targets.pop(targetname)
+                                    self.stop_command_target(targetname)
                         else:
                             raise Exception('command target named: %s does not exist' % targetname)
                     elif 'triggerSource' in payload:
                         # TODO not implemented because it does not work with our current trigger source pattern
                         triggername = payload['trigger']['name']
-                        if find_trigger(self.config, triggername) is not None:
-                            if find_trigger(self.config, triggername)['enabled'] == enabled:
+                        trigger = self.config_model.find_trigger(triggername)
+                        if trigger is not None:
+                            if trigger['enabled'] == enabled:
                                 logging.info('trigger source: %s enabled is already %s' % (triggername, enabled))
                             else:
                                 logging.info('setting trigger source: %s, enabled: %s' % (triggername, enabled))
-                                find_trigger(self.config, triggername)['enabled'] = enabled
+                                trigger['enabled'] = enabled
                                 if enabled:
                                     # TODO not implemented
                                     logging.debug('here is where i would call create_trigger_source but it wont work right now')
@@ -470,20 +557,66 @@ class CSMessageProcessor:
         else:
             logging.info('setting up command target: %s' % this_target['name'])
             if this_target['type'] in self.target_map:
-                self.command_queues[this_target['name']] = Queue()
+                target_class = self.target_map[this_target['type']]
+                # targets get their own process, unless the async engine is in use and the target is not isolated
+                on_engine = self.target_engine is not None and not this_target.get('isolate', target_class.isolate)
+                queue_settings = this_target.get('queue', {})  # bounds and drop policy, see CSCommandQueue
+                if on_engine:
+                    raw_queue = self.target_engine.create_queue(queue_settings.get('maxsize', 0))
+                else:
+                    raw_queue = Queue(queue_settings.get('maxsize', 0))
+                self.command_queues[this_target['name']] = CSCommandQueue(raw_queue, queue_settings, self.trace_size)
                 this_config_obj = {
                     'config': this_target['config'],  # config for this target, straight from config.json
                     'name': 'ct:%s' % this_target['name'],  # this will be the name used in logging
                     'queue': self.command_queues[this_target['name']],  # the queue for passing command messages to this target
                     'log_level': self.log_level  # passing log level to target so it can act accordingly
                 }
-                self.command_targets[this_target['name']] = Process(target=self.target_map[this_target['type']], args=(this_config_obj,))
+                if on_engine:
+                    self.command_targets[this_target['name']] = self.target_engine.create_target(target_class, this_config_obj)
+                else:
+                    self.command_targets[this_target['name']] = Process(target=target_class, args=(this_config_obj,))
                 self.command_targets[this_target['name']].daemon = True
                 self.command_targets[this_target['name']].start()
                 self.command_targets_list.append(this_target['name'])
+                self.plan_cache.clear()  # plans compiled while this target was missing need to pick up its queue
             else:
                 raise Exception('command target %s unknown type: %s' % (this_target['name'], this_target['type']))
 
+    def stop_command_target(self, targetname):
+        # ask the target process (or engine task) to exit by itself, only terminating it if it does not do so in time
+        logging.debug('shutting down command target: %s' % targetname)
+        self.command_queues[targetname].put(TARGET_EXIT_MSG)
+        self.command_targets[targetname].join(self.target_stop_timeout)
+        if self.command_targets[targetname].is_alive():
+            logging.warning('command target %s did not exit in time, terminating it' % targetname)
+            self.command_targets[targetname].terminate()
+            self.command_targets[targetname].join()
+        self.command_targets.pop(targetname)
+        self.command_queues.pop(targetname)
+        if targetname in self.command_targets_list:
+            self.command_targets_list.remove(targetname)
+        self.plan_cache.clear()  # plans hold on to target queues
+
+    def collect_queue_metrics(self):
+        # queue depth and counters are already kept by each CSCommandQueue, they are only gathered up here
+        samples = []
+        for target, command_queue in list(self.command_queues.items()):
+            stats = command_queue.stats()
+            samples.append(('command_queue_depth', {'target': target}, stats['depth']))
+            for counter in QUEUE_COUNTERS:
+                samples.append(('command_queue_commands_total', {'target': target, 'event': counter}, stats[counter]))
+            samples.append(('command_time_in_queue_seconds', {'target': target}, command_queue.time_in_queue))
+            samples.append(('command_send_seconds', {'target': target}, command_queue.send_time))
+        return samples
+
+    def collect_scheduler_metrics(self):
+        return [
+            ('cue_scheduler_pending', {}, self.scheduler.pending()),
+            ('cue_lateness_max_seconds', {}, self.scheduler.stats['late_max']),
+            ('cue_lateness_last_seconds', {}, self.scheduler.stats['late_last']),
+        ]
+
     def setup_trigger_sources(self):
         # setup trigger sources based on config, populating trigger_sources
         logging.info('setting up trigger sources')
@@ -509,6 +642,8 @@ class CSMessageProcessor:
                     'queue': self.trigger_queue,
                     'handler': self.handle,
                     'loop': self.loop,
+                    'codec': self.codec,
+                    'metrics': self.metrics,
                 }
                 self.trigger_sources[this_source['name']] = self.trigger_map[this_source['type']](this_config_obj)
             else:
@@ -517,78 +652,69 @@ class CSMessageProcessor:
 
 class CSCueRunner:
     # manages the execution lifecycle of a cue
-    # this will run inside a thread, and possibly spawn its own children threads
-    # cue part timing is handled here, which is why it runs in a separate thread, to allow multiple cuerunners to execute at once without blocking eachother
-    def __init__(self, command_queues, command_targets_list, current_cue_stack, actual_cue):
-        self.command_queues = command_queues
-        self.command_targets_list = command_targets_list
+    # the runner itself does not wait around; it takes the compiled plan for the cue and hands every batch of steps to the shared cue scheduler
+    #   with an absolute due time, and the scheduler calls back into run_batch when that time arrives.
+    #   many cues can be in flight at once this way, without a thread (or a busy-wait) per cue
+    def __init__(self, scheduler, config_model, plan_cache, metrics, tracer, current_cue_stack, actual_cue):
+        self.scheduler = scheduler
+        self.config_model = config_model
+        self.plan_cache = plan_cache
+        self.metrics = metrics
+        self.tracer = tracer
         self.current_cue_stack = current_cue_stack
         self.cue = actual_cue
         self.run_cue()
 
     def run_cue(self):
-        actual_cue = self.cue
         try:
-            if 'enabled' in actual_cue:
-                if not actual_cue['enabled']:
-                    logging.warning('silently ignoring disabled cue %s' % actual_cue['name'])
-                    return
-            num_parts = 0
-            total_parts = len(actual_cue['parts'])
-            logging.info('running cue: %s (%s parts)' % (actual_cue['name'], total_parts))
-            # first, build a list of cues with delay information defaulting to zero if missing
-            _staging_partlist = []
-            for cue_part in actual_cue['parts']:
-                _part_bundle = {'delay': 0, 'part': cue_part}
-                if 'delay' in cue_part:
-                    _part_bundle['delay'] = cue_part['delay']
-                _staging_partlist.append(_part_bundle)
-            # second, create another list, sorted by that delay
-            _sorted_partlist = sorted(_staging_partlist, key=lambda i: (i['delay']))
-            # third, modify the sorted list, adding absolute execution time
-            start_time = datetime.now() + timedelta(milliseconds=10)  # TODO start time is arbitrarily 10ms in the future, we will pare this down
-            for part_bundle in _sorted_partlist:
-                _abs_gotime = start_time + timedelta(milliseconds=part_bundle['delay'])
-                part_bundle['abs_gotime'] = _abs_gotime
-            # finally, execute each part, safe in the knowledge that we are running them in order, so we can wait for each abs_gotime to arrive
-            for part_bundle in _sorted_partlist:
-                go_time = part_bundle['abs_gotime']
-                cue_part = part_bundle['part']
-                num_parts += 1
-                if 'enabled' in cue_part:
-                    if not cue_part['enabled']:
-                        logging.warning('ignoring disabled cue part: %s part %s/%s, target: %s, command: %s' % (actual_cue['name'], num_parts, total_parts, cue_part['target'], json.dumps(cue_part['command'])))
-                        continue
-                while go_time > datetime.now():
-                    time.sleep(0.001)  # we check every 1ms to see if gotime has passed
-                logging.info('running cue: %s, part: %s of %s, target: %s, command: %s' % (actual_cue['name'], num_parts, total_parts, cue_part['target'], json.dumps(cue_part['command'])))
-                try:
-                    self.run_cue_command(cue_part)
-                except Exception as ex:
-                    logging.error(ex)
-                    pass
+            plan = self.plan_cache.get(self.cue)
+            if not plan.enabled:
+                logging.warning('silently ignoring disabled cue %s' % plan.name)
+                return
+            logging.info('running cue: %s (%s parts)', plan.name, plan.total_parts)
+            start_time = time.monotonic()
+            if self.tracer is None:
+                self.scheduler.schedule_many([(start_time + batch.offset, self.run_batch, (plan, batch)) for batch in plan.batches])
+            else:
+                self.tracer.record('cue', start_time, plan.name, plan.total_parts)
+                entries = []
+                for batch in plan.batches:
+                    trace_id = 0  # internal parts never reach a target queue, so there is nothing to trace
+                    if batch.queue is not None:
+                        trace_id = self.tracer.next_id()
+                        self.tracer.record(TRACE_SCHEDULED, start_time, trace_id, plan.name, [step.part_number for step in batch.steps], batch.target, start_time + batch.offset)
+                    entries.append((start_time + batch.offset, self.run_batch, (plan, batch, trace_id)))
+                self.scheduler.schedule_many(entries)
         except Exception as exe:
             logging.error('unexpected exception while cue runner: %s' % exe)
 
-    def run_cue_command(self, cue_part):
-        if cue_part['target'] == 'internal':
-            # an internal cue part can be used to call another trigger
-            timestamp = str(datetime.now())
-            logging.info('%s Sending an internal trigger: %s' % (timestamp, cue_part['command']))
-            self.handle_internal_target(cue_part['command'])
-        else:
-            if cue_part['target'] in self.command_targets_list:
+    def run_batch(self, lateness, plan, batch, trace_id=0):
+        # called by the scheduler once this batch of steps is due
+        if trace_id:
+            self.tracer.record(TRACE_QUEUED, time.monotonic(), trace_id, lateness)
+        for step in batch.steps:
+            logging.info('running cue: %s, part: %s of %s, target: %s, command: %s', plan.name, step.part_number, plan.total_parts, step.target, step.command_text)
+        logging.debug('cue: %s, part: %s of %s was %.3fms late', plan.name, batch.steps[0].part_number, plan.total_parts, lateness * 1000)
+        self.metrics.histograms['cue_lateness_seconds'].observe(lateness)
+        try:
+            if batch.target == 'internal':
+                # an internal cue part can be used to call another trigger
+                command = batch.steps[0].command
                 timestamp = str(datetime.now())
-                logging.debug('%s adding a cue part to queue' % timestamp)
-                self.command_queues[cue_part['target']].put(cue_part['command'])
+                logging.info('%s Sending an internal trigger: %s' % (timestamp, command))
+                self.handle_internal_target(command)
+            elif batch.queue is not None:
+                batch.queue.put(batch.payload, trace_id)
             else:
-                raise Exception('no enabled command target exists to handle cue target: %s' % cue_part['target'])
+                raise Exception('no enabled command target exists to handle cue target: %s' % batch.target)
+        except Exception as ex:
+            logging.error(ex)
 
     def handle_internal_target(self, trigger_message):
         # triggering a cue
         if 'cue' in trigger_message:
             logging.debug('received trigger for cue: %s' % trigger_message['cue'])
-            actual_cue = find_cue(self.current_cue_stack, trigger_message['cue'])
+            actual_cue = self.config_model.find_cue(self.current_cue_stack, trigger_message['cue'])
             if actual_cue is not None:
                 if not self.start_subcue_runner(actual_cue):
                     logging.error('failed to start sub cue runner')
@@ -597,8 +723,7 @@ class CSCueRunner:
 
     def start_subcue_runner(self, actual_cue):
         try:
-            cue_runner = Thread(target=CSCueRunner, args=(self.command_queues, self.command_targets_list, self.current_cue_stack, actual_cue))
-            cue_runner.start()
+            CSCueRunner(self.scheduler, self.config_model, self.plan_cache, self.metrics, self.tracer, self.current_cue_stack, actual_cue)
             return True
         except Exception as ex:
             logging.exception('unexpected exception while starting subcue runner: %s' % ex)
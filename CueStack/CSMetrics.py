@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# CueStack Metrics
+
+#    Copyright (C) 2021 James Bishop (james@bishopdynamics.com)
+
+# ignore rules:
+#   docstring
+#   too-broad-exception
+#   line-too-long
+#   too-many-branches
+#   too-many-statements
+#   too-many-public-methods
+#   too-many-lines
+#   too-many-nested-blocks
+#   toddos (annotations linter handling this)
+# pylint: disable=C0111,W0703,C0301,R0912,R0915,R0904,C0302,R1702,W0511
+
+import bisect
+import logging
+import threading
+import multiprocessing
+
+# upper bounds, in seconds, from well under a millisecond (decoding a trigger) to seconds (a target that has stopped answering)
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class CSHistogram:
+    # counts observations into fixed buckets, and keeps their total, to be read by whoever reports metrics
+    #   by default there is no lock, for a histogram with a single writer (a target, the scheduler): a reader may see
+    #   a count one observation ahead of the sum, which does not matter for reporting
+    #   with locked set, observe takes a lock, for a histogram written from several threads at once (trigger_decode_seconds,
+    #   observed into by every trigger), where two unlocked increments of the same bucket could lose one of them
+    #   with shared set, the numbers live in shared memory, so a target running in its own process can observe into it,
+    #   and the message processor can still read it; a locked shared histogram takes a lock shared between processes too
+    def __init__(self, buckets=DEFAULT_BUCKETS, shared=False, locked=False):
+        self.buckets = tuple(buckets)
+        size = len(self.buckets) + 3  # one count per bucket, one for everything above the last bucket, then count and sum
+        if shared:
+            self.values = multiprocessing.RawArray('d', size)
+        else:
+            self.values = [0.0] * size
+        self.lock = None
+        if locked:
+            self.lock = multiprocessing.Lock() if shared else threading.Lock()
+        self._count = size - 2
+        self._sum = size - 1
+
+    def observe(self, value):
+        if self.lock is None:
+            self._observe(value)
+        else:
+            with self.lock:
+                self._observe(value)
+
+    def _observe(self, value):
+        values = self.values
+        values[bisect.bisect_left(self.buckets, value)] += 1
+        values[self._count] += 1
+        values[self._sum] += value
+
+    def snapshot(self):
+        # counts are cumulative, as prometheus expects: each bucket counts everything less than or equal to its bound
+        values = self.values[:]
+        buckets = {}
+        total = 0
+        for bound, count in zip(self.buckets, values):
+            total += count
+            buckets[repr(bound)] = int(total)
+        buckets['+Inf'] = int(values[self._count])
+        return {'count': int(values[self._count]), 'sum': values[self._sum], 'buckets': buckets}
+
+
+class CSMetrics:
+    # the registry of what can be reported through getMetrics, or as prometheus text
+    #   histograms are created here, and observed into from wherever the work happens
+    #   collectors are called only when metrics are read, for numbers which already exist elsewhere (queue depth, queue counters),
+    #   and return a list of (name, labels, value) with value a number or a CSHistogram
+    def __init__(self, prefix='cuestack'):
+        self.prefix = prefix
+        self.descriptions = {}  # name -> (type, help)
+        self.histograms = {}  # name -> CSHistogram, for histograms without labels
+        self.collectors = []
+
+    def describe(self, name, metric_type, description):
+        self.descriptions[name] = (metric_type, description)
+
+    def histogram(self, name, description, buckets=DEFAULT_BUCKETS, locked=False):
+        # locked for a histogram observed into from more than one thread, see CSHistogram
+        if name not in self.histograms:
+            self.describe(name, 'histogram', description)
+            self.histograms[name] = CSHistogram(buckets, locked=locked)
+        return self.histograms[name]
+
+    def add_collector(self, collector):
+        self.collectors.append(collector)
+
+    def samples(self):
+        samples = [(name, {}, histogram) for name, histogram in self.histograms.items()]
+        for collector in self.collectors:
+            try:
+                samples.extend(collector())
+            except Exception as ex:
+                logging.error('exception while collecting metrics: %s' % ex)
+        return samples
+
+    def snapshot(self):
+        # {name: {'type': type, 'help': help, 'samples': [{'labels': labels, 'value': value}, ...]}}, histograms in place of value
+        #   have count, sum and cumulative buckets
+        result = {}
+        for name, labels, value in self.samples():
+            metric_type, description = self.descriptions.get(name, ('untyped', ''))
+            metric = result.setdefault(name, {'type': metric_type, 'help': description, 'samples': []})
+            sample = {'labels': labels}
+            if isinstance(value, CSHistogram):
+                sample.update(value.snapshot())
+            else:
+                sample['value'] = value
+            metric['samples'].append(sample)
+        return result
+
+    def prometheus(self):
+        # the same, in the prometheus text exposition format
+        lines = []
+        for name, metric in self.snapshot().items():
+            full_name = '%s_%s' % (self.prefix, name)
+            lines.append('# HELP %s %s' % (full_name, metric['help']))
+            lines.append('# TYPE %s %s' % (full_name, metric['type']))
+            for sample in metric['samples']:
+                labels = sample['labels']
+                if 'buckets' in sample:
+                    for bound, count in sample['buckets'].items():
+                        lines.append('%s_bucket%s %s' % (full_name, format_labels(dict(labels, le=bound)), count))
+                    lines.append('%s_sum%s %s' % (full_name, format_labels(labels), sample['sum']))
+                    lines.append('%s_count%s %s' % (full_name, format_labels(labels), sample['count']))
+                elif sample['value'] is not None:
+                    lines.append('%s%s %s' % (full_name, format_labels(labels), sample['value']))
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = ('%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for key, value in labels.items())
+    return '{%s}' % ','.join(escaped)
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# CueStack Cue Scheduler
+
+#    Copyright (C) 2021 James Bishop (james@bishopdynamics.com)
+
+# ignore rules:
+#   docstring
+#   too-broad-exception
+#   line-too-long
+#   too-many-branches
+#   too-many-statements
+#   too-many-public-methods
+#   too-many-lines
+#   too-many-nested-blocks
+#   toddos (annotations linter handling this)
+# pylint: disable=C0111,W0703,C0301,R0912,R0915,R0904,C0302,R1702,W0511
+
+import time
+import logging
+import platform
+import itertools
+
+from heapq import heappush, heappop
+from threading import Thread, Condition
+
+
+class CSCueScheduler:
+    # a single thread which fires cue parts when they are due, shared by every cue runner
+    # pending parts live in a heap ordered by due time, so scheduling a part is O(log n), and the thread
+    #   sleeps on a condition until the earliest part is due (or something earlier gets scheduled)
+    # all times are time.monotonic(), so wall clock adjustments cannot make parts fire early or late
+    if platform.system() == 'Windows':
+        spin_margin = 0.016  # seconds, windows timer granularity is ~15.6ms, so wait the last bit out by yielding
+    else:
+        spin_margin = 0.0
+
+    def __init__(self, name='CueScheduler'):
+        self._heap = []
+        self._sequence = itertools.count()  # tie-breaker, keeps parts with the same due time in the order they were scheduled
+        self._condition = Condition()
+        self.should_run = True
+        self.stats = {  # reported by getMetrics, along with pending; how many were fired, and how late in total, is in cue_lateness_seconds
+            'late_max': 0.0,  # seconds, worst lateness seen
+            'late_last': 0.0,  # seconds, lateness of the most recent part fired
+        }
+        self._thread = Thread(target=self._run, name=name)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def schedule(self, due, callback, *args):
+        # schedule callback(lateness, *args) to be called at due (time.monotonic() seconds)
+        self.schedule_many([(due, callback, args)])
+
+    def schedule_many(self, entries):
+        # schedule a list of (due, callback, args) at once, taking the lock only once
+        with self._condition:
+            earliest = self._heap[0][0] if self._heap else None
+            for due, callback, args in entries:
+                heappush(self._heap, (due, next(self._sequence), callback, args))
+            if earliest is None or self._heap[0][0] < earliest:
+                self._condition.notify()
+
+    def pending(self):
+        # how many entries (batches of cue parts) are waiting to fire
+        with self._condition:
+            return len(self._heap)
+
+    def stop(self):
+        logging.debug('stopping cue scheduler')
+        with self._condition:
+            self.should_run = False
+            self._heap.clear()
+            self._condition.notify()
+        self._thread.join(1)
+
+    def _next_due(self):
+        # block until at least one part is due, then pop and return every part that is due
+        with self._condition:
+            while self.should_run:
+                now = time.monotonic()
+                if self._heap and self._heap[0][0] <= now + self.spin_margin:
+                    break
+                timeout = None
+                if self._heap:
+                    timeout = self._heap[0][0] - now - self.spin_margin
+                self._condition.wait(timeout)
+            if self.spin_margin:
+                while self.should_run and self._heap[0][0] > time.monotonic():
+                    self._condition.wait(0)
+            if not self.should_run:
+                return []
+            now = time.monotonic()
+            due_entries = []
+            while self._heap and self._heap[0][0] <= now:
+                due_entries.append(heappop(self._heap))
+            return due_entries
+
+    def _run(self):
+        while self.should_run:
+            for due, _, callback, args in self._next_due():
+                lateness = time.monotonic() - due
+                self.stats['late_last'] = lateness
+                if lateness > self.stats['late_max']:
+                    self.stats['late_max'] = lateness
+                try:
+                    callback(lateness, *args)
+                except Exception:
+                    logging.exception('unexpected exception in scheduled cue part')
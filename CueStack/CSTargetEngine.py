@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# CueStack Command Target Engine
+
+#    Copyright (C) 2021 James Bishop (james@bishopdynamics.com)
+
+# ignore rules:
+#   docstring
+#   too-broad-exception
+#   line-too-long
+#   too-many-branches
+#   too-many-statements
+#   too-many-public-methods
+#   too-many-lines
+#   too-many-nested-blocks
+#   toddos (annotations linter handling this)
+# pylint: disable=C0111,W0703,C0301,R0912,R0915,R0904,C0302,R1702,W0511
+
+import time
+import queue
+import asyncio
+import logging
+import functools
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+class CSTargetEngine:
+    # runs command targets as asyncio tasks on one event loop, in a thread of this process, instead of one process each
+    #   each target gets a task which awaits commands on its queue, and a single worker executor for the blocking parts
+    #   (setup, blocking sends, shutdown), so a slow target holds up only itself. targets which never block (blocking = False)
+    #   are sent to right on the loop. commands are handed over as they are, nothing is pickled
+    # CSEngineQueue and CSEngineTarget stand in for the multiprocessing Queue and Process the message processor otherwise uses
+
+    def __init__(self, name='CommandTargetEngine'):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name=name)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def stop(self):
+        logging.debug('stopping command target engine')
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(1)
+
+    def create_queue(self, maxsize=0):
+        return CSEngineQueue(self.loop, maxsize)
+
+    def create_target(self, target_class, config_obj):
+        # config_obj['queue'] must be a CSCommandQueue wrapping one from create_queue()
+        return CSEngineTarget(self, target_class, config_obj)
+
+
+class CSEngineQueue:
+    # a command target queue with the put / put_nowait / get_nowait / qsize of multiprocessing.Queue, usable from any thread,
+    #   which the target's task on the loop waits on with get_batch
+    def __init__(self, loop, maxsize=0):
+        self.loop = loop
+        self.queue = queue.Queue(maxsize)
+        self._ready = None  # asyncio.Event, created on the loop (before the target using it starts, as callbacks run in order)
+        self.loop.call_soon_threadsafe(self._create)
+
+    def _create(self):
+        self._ready = asyncio.Event()
+
+    def _wake(self):
+        self._ready.set()
+
+    def put(self, item, timeout=None):
+        self.queue.put(item, timeout=timeout)
+        self.loop.call_soon_threadsafe(self._wake)
+
+    def put_nowait(self, item):
+        self.queue.put_nowait(item)
+        self.loop.call_soon_threadsafe(self._wake)
+
+    def get_nowait(self):
+        return self.queue.get_nowait()
+
+    def qsize(self):
+        return self.queue.qsize()
+
+    async def get_batch(self):
+        # wait until something is on the queue, then take everything that is there
+        while True:
+            self._ready.clear()
+            items = []
+            while True:
+                try:
+                    items.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if items:
+                return items
+            await self._ready.wait()
+
+
+class CSEngineTarget:
+    # a command target running on a CSTargetEngine, with the parts of the multiprocessing.Process interface the message processor uses
+    def __init__(self, engine, target_class, config_obj):
+        self.engine = engine
+        self.target_class = target_class
+        self.config_obj = dict(config_obj, in_process=True)
+        self.name = config_obj['name']
+        self.daemon = True  # nothing to do, engine targets never outlive the engine
+        self.task = None
+        self._done = threading.Event()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=self.name)
+
+    def start(self):
+        asyncio.run_coroutine_threadsafe(self._start_task(), self.engine.loop)
+
+    async def _start_task(self):
+        self.task = asyncio.ensure_future(self.run())
+        self.task.add_done_callback(self._finished)
+
+    def _finished(self, _task):
+        self._executor.shutdown(wait=False)
+        self._done.set()
+
+    def join(self, timeout=None):
+        self._done.wait(timeout)
+
+    def is_alive(self):
+        return not self._done.is_set()
+
+    def terminate(self):
+        # cancels the task; a blocking call already running in the executor cannot be interrupted, but its result is dropped
+        def _cancel():
+            if self.task is not None:
+                self.task.cancel()
+        self.engine.loop.call_soon_threadsafe(_cancel)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        command_queue = self.config_obj['queue']
+        target = await loop.run_in_executor(self._executor, functools.partial(self.target_class, self.config_obj))
+        if not target.should_run:
+            return  # setup failed, and has already been logged
+        try:
+            exit_requested = False
+            while not exit_requested:
+                # as in CSCommandTarget.process_queue, everything waiting is sent as one batch
+                items = await command_queue.queue.get_batch()
+                commands, exit_requested = command_queue.collect(items, target.logger)
+                if not commands:
+                    continue
+                started = time.monotonic()
+                in_flight = None
+                try:
+                    if target.blocking:
+                        in_flight = await loop.run_in_executor(self._executor, target.send_commands, commands)
+                    else:
+                        in_flight = target.send_commands(commands)
+                except Exception as ex:
+                    target.logger.error('unexpected exception while sending commands: %s' % ex)
+                command_queue.sent(started, in_flight)
+        finally:
+            await loop.run_in_executor(self._executor, target.stop)
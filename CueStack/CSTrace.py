@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# CueStack Trace Recorder
+
+#    Copyright (C) 2021 James Bishop (james@bishopdynamics.com)
+
+# ignore rules:
+#   docstring
+#   too-broad-exception
+#   line-too-long
+#   too-many-branches
+#   too-many-statements
+#   too-many-public-methods
+#   too-many-lines
+#   too-many-nested-blocks
+#   toddos (annotations linter handling this)
+# pylint: disable=C0111,W0703,C0301,R0912,R0915,R0904,C0302,R1702,W0511
+
+import time
+import itertools
+import multiprocessing
+
+# what happened to a batch of cue parts, from being handed to the scheduler until it was sent
+#   the message processor records the first two, the target records the rest
+TRACE_SCHEDULED = 0  # the cue runner handed it to the cue scheduler
+TRACE_QUEUED = 1  # it came due, and was put on its target queue
+TRACE_DEQUEUED = 2  # the target took it off the queue
+TRACE_EXPIRED = 3  # the target threw it away, because it had waited longer than expire_ms
+TRACE_SENT = 4  # the target finished sending it (recorded with the time it started, and how long it took)
+TRACE_NAMES = ['scheduled', 'queued', 'dequeued', 'expired', 'sent']
+TRACE_RING_FIELDS = 4  # time, event, trace id, duration
+
+
+class CSTraceRing:
+    # a fixed number of (time, event, trace id, duration) records in shared memory, overwriting the oldest once full
+    #   only the command target (possibly in a process of its own) writes, but from more than one thread: the target records
+    #   what it dequeued and expired, while a target with requests in flight records them as sent from its worker threads,
+    #   so writers take the lock, otherwise two of them could claim the same slot
+    #   the message processor reads without it, and may read a record while it is being written, which can only garble that one record
+    def __init__(self, size):
+        self.size = size
+        self.values = multiprocessing.RawArray('d', 1 + size * TRACE_RING_FIELDS)  # how many have been recorded, then the records
+        self.lock = multiprocessing.Lock()
+
+    def record(self, event, trace_id, when=None, duration=0.0):
+        with self.lock:
+            self._record(event, trace_id, when, duration)
+
+    def _record(self, event, trace_id, when, duration):
+        values = self.values
+        recorded = int(values[0])
+        offset = 1 + (recorded % self.size) * TRACE_RING_FIELDS
+        values[offset] = time.monotonic() if when is None else when
+        values[offset + 1] = event
+        values[offset + 2] = trace_id
+        values[offset + 3] = duration
+        values[0] = recorded + 1
+
+    def events(self):
+        # oldest first, as (time, event, trace id, duration)
+        values = self.values[:]
+        recorded = int(values[0])
+        first = max(0, recorded - self.size)
+        events = []
+        for index in range(first, recorded):
+            offset = 1 + (index % self.size) * TRACE_RING_FIELDS
+            events.append((values[offset], int(values[offset + 1]), int(values[offset + 2]), values[offset + 3]))
+        return events
+
+
+class CSTracer:
+    # records when each batch of cue parts was scheduled, queued, dequeued and sent, to be exported as chrome trace-event json,
+    #   which can be opened in chrome://tracing or https://ui.perfetto.dev
+    # every batch gets a trace id, which travels with it through the command queue, so what the target records can be matched up
+    # events recorded in the message processor go into a list, preallocated and overwritten in a ring;
+    #   a slot is taken with next() on an itertools.count, which is atomic, so the threads recording here need no lock
+    # each command queue gets a CSTraceRing of the same size, see CSCommandQueue
+    def __init__(self, size):
+        self.size = size
+        self.buffer = [None] * size
+        self._slots = itertools.count()
+        self._ids = itertools.count(1)  # 0 means a batch is not being traced
+
+    def next_id(self):
+        return next(self._ids)
+
+    def record(self, *event):
+        # event is (kind, time, ...): ('trigger', started, duration), ('cue', time, cue name, parts),
+        #   (TRACE_SCHEDULED, time, trace id, cue name, part numbers, target, due), (TRACE_QUEUED, time, trace id, lateness)
+        self.buffer[next(self._slots) % self.size] = event
+
+    def events(self):
+        return [event for event in self.buffer if event is not None]
+
+    def chrome_trace(self, rings):
+        # rings is {target name: CSTraceRing}
+        #   each batch is an async span, from being scheduled until it was sent, with the steps in between as instant events on it,
+        #   each target has a track with what it spent sending, and triggers and cues have a track each
+        trace_events = []
+        tracks = {'triggers': 1, 'cues': 2}
+        for index, target in enumerate(sorted(rings)):
+            tracks[target] = 10 + index
+        for name, tid in tracks.items():
+            trace_events.append({'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': tid, 'args': {'name': name}})
+        batches = {}  # trace id -> (cue name, part numbers, target)
+        for event in sorted(self.events(), key=lambda event: event[1]):
+            kind, when = event[0], event[1] * 1000000
+            if kind == 'trigger':
+                trace_events.append({'name': 'trigger', 'cat': 'trigger', 'ph': 'X', 'ts': when, 'dur': event[2] * 1000000, 'pid': 1, 'tid': tracks['triggers']})
+            elif kind == 'cue':
+                trace_events.append({'name': event[2], 'cat': 'cue', 'ph': 'i', 's': 't', 'ts': when, 'pid': 1, 'tid': tracks['cues'], 'args': {'parts': event[3]}})
+            elif kind == TRACE_SCHEDULED:
+                _, _, trace_id, cue, parts, target, due = event
+                batches[trace_id] = (cue, parts, target)
+                trace_events.append(self._part_event(trace_id, batches, 'b', when, {'target': target, 'parts': parts, 'due_in_ms': (due - event[1]) * 1000}))
+            elif kind == TRACE_QUEUED and event[2] in batches:
+                trace_events.append(self._part_event(event[2], batches, 'n', when, {'step': 'queued', 'late_ms': event[3] * 1000}))
+        for target, ring in rings.items():
+            for when, kind, trace_id, duration in ring.events():
+                if trace_id not in batches:
+                    continue  # scheduled before the oldest event we still have
+                if kind == TRACE_SENT:
+                    trace_events.append({'name': 'send', 'cat': 'send', 'ph': 'X', 'ts': when * 1000000, 'dur': duration * 1000000, 'pid': 1, 'tid': tracks[target], 'args': {'trace_id': trace_id}})
+                    trace_events.append(self._part_event(trace_id, batches, 'e', (when + duration) * 1000000, {}))
+                elif kind == TRACE_EXPIRED:
+                    trace_events.append(self._part_event(trace_id, batches, 'e', when * 1000000, {'step': 'expired'}))
+                else:
+                    trace_events.append(self._part_event(trace_id, batches, 'n', when * 1000000, {'step': TRACE_NAMES[kind]}))
+        return {'traceEvents': trace_events, 'displayTimeUnit': 'ms'}
+
+    @staticmethod
+    def _part_event(trace_id, batches, phase, when, args):
+        cue, parts, _ = batches[trace_id]
+        name = '%s part %s' % (cue, ','.join(str(part) for part in parts))
+        event = {'name': name, 'cat': 'part', 'ph': phase, 'id': trace_id, 'ts': when, 'pid': 1, 'tid': 2}
+        if args:
+            event['args'] = args
+        return event
@@ -15,17 +15,16 @@
 #   toddos (annotations linter handling this)
 # pylint: disable=C0111,W0703,C0301,R0912,R0915,R0904,C0302,R1702,W0511
 
-import time
 import json
 import asyncio
 import logging
 import websockets
 
-from CSJanus import CSSafeQueue
+from CSCodec import CSCodec
 import paho.mqtt.client as mqtt
 
-from threading import Thread
 from aiohttp import web
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urlparse, parse_qs
 
 
@@ -42,132 +41,145 @@ class CSTriggerGenericWebsocket:
     # wraps asyncio websockets library into a simpler callback interface
     # pass port and receive handler to constructor
     # only two methods: send(msg), stop()
-    # you dont really need to stop() since the thread is daemonized
-    inbound_worker = None
-    queue_ws_inbound = None
-    queue_ws_outbound = None
+    # you dont really need to stop() since everything runs on the loop
+    # everything happens on the event loop: each connection reads its messages as they arrive, and hands them to the receive handler
+    #   in an executor (the handler may block, for example while starting a command target); a single worker keeps messages in the order they arrived
+    #   a receive handler which is a coroutine function is awaited on the loop instead, and must not block
+    # the reply to a message goes only to the client that sent it (or to every client, with broadcast_replies)
+    # send(msg) broadcasts an event to every client: msg is put on an asyncio queue, and a single task sleeping on that queue sends it to
+    #   all clients at once; a client which fails, or takes longer than send_timeout to accept a message, is disconnected
+    outbound_queue = None
+    outbound_task = None
     webocket_log_level = logging.INFO  # very rarely actually want to see DEBUG level on these
 
     def __init__(self, config_obj):
         self.config = config_obj['config']
         self.receive_handler = config_obj['handler']
+        self.codec = config_obj.get('codec') or CSCodec()  # for replies
         self.loop = config_obj['loop']
         self.name = config_obj['name']
         self.queue = config_obj['queue']
         self.host = ''
         self.port = int(self.config['port'])
+        self.broadcast_replies = self.config.get('broadcast_replies', False)  # the old behaviour, replies go to every client
+        self.send_timeout = self.config.get('send_timeout', 1)  # seconds a client gets to accept a message before it is disconnected
         self.clients = set()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=self.name)
         logging.info('Starting Websocket Trigger Source on port %s', self.port)
-        self.queue_ws_inbound = CSSafeQueue(loop=self.loop)
-        self.queue_ws_outbound = CSSafeQueue(loop=self.loop)
         # TODO dont know why the linter hates _websocket_handler right now, but it works just fine
         logging.getLogger('websockets.server').setLevel(self.webocket_log_level)
         logging.getLogger('websockets.protocol').setLevel(self.webocket_log_level)
         _ws_instance = websockets.serve(self._websocket_handler, host=self.host, port=self.port, loop=self.loop)
         self.loop.run_until_complete(_ws_instance)
-        logging.debug('Starting worker thread to process inbound websocket message queue')
-        self.inbound_worker = Thread(target=self._process_queue_inbound_ws)
-        self.inbound_worker.setDaemon(True)
-        self.inbound_worker.start()
+        self.loop.run_until_complete(self._start_outbound())
 
     def stop(self):
         logging.info('shutting down Websocket Server')
-        logging.debug('websocket shutdown does nothing at the moment')
+        if self.outbound_task is not None:
+            self.loop.call_soon_threadsafe(self.outbound_task.cancel)
+        self.executor.shutdown(wait=False)
 
-    def _process_queue_inbound_ws(self):
-        _queue = self.queue_ws_inbound
-        while True:
-            if _queue:
-                while not _queue.empty():
-                    try:
-                        _item = _queue.get()
-                        self._websocket_receive(_item)
-                    except Exception:
-                        logging.exception('Error while processing an inbound websocket message queue')
-            time.sleep(0.01)  # lets the outbound task do something
-
-    async def _websocket_handler(self, websocket, path):
-        # this is the handler given to the websocket server to handle in/out
-        try:
-            outbound_task = asyncio.ensure_future(self._websocket_outbound_handler(websocket, path))
-            inbound_task = asyncio.ensure_future(self._websocket_inbound_handler(websocket, path))
-            done, pending = await asyncio.wait(
-                [inbound_task, outbound_task],
-                return_when=asyncio.FIRST_COMPLETED,
-            )
-            for task in pending:
-                task.cancel()
-            await asyncio.sleep(0)
-        except Exception:
-            logging.exception('Unexpected exception in websocket_handler')
+    async def _start_outbound(self):
+        # the queue must be created on the loop it is used from
+        self.outbound_queue = asyncio.Queue()
+        self.outbound_task = asyncio.ensure_future(self._websocket_outbound_handler())
 
-    async def _websocket_inbound_handler(self, websocket, path):
+    async def _websocket_handler(self, websocket, path=None):
+        # this is the handler given to the websocket server, it handles inbound messages for one client until it disconnects
+        self.clients.add(websocket)  # clients is a set, so no duplicates will be allowed
         try:
-            self.clients.add(websocket)  # clients is a set, so no duplicates will be allowed
             async for message in websocket:
-                self.queue_ws_inbound.put(message)
-        except:
+                await self._websocket_receive(websocket, message)
+        except Exception:
             pass  # TODO dont particularly care about errors here
-        await asyncio.sleep(0)
+        finally:
+            self.clients.discard(websocket)
 
-    async def _websocket_outbound_handler(self, websocket, path):
+    async def _websocket_outbound_handler(self):
         while True:
-            while not self.queue_ws_outbound.empty():
-                # note: all messages go to all clients, up to clients to filter by target
-                # if a client has disconnected, they get removed from the list
-                message = self.queue_ws_outbound.get()
-                logging.debug('Sending trigger source reply message')
-                try:
-                    _bad_clients = set()
-                    for _this_client in self.clients:
-                        try:
-                            await _this_client.send(message)
-                        except Exception as exa:
-                            _bad_clients.add(_this_client)
-                            # logging.debug('removing client that failed to send')
-                            # logging.debug('exception was: %s', exa)
-                    for _this_client in _bad_clients:
-                        try:
-                            self.clients.remove(_this_client)
-                        except Exception:
-                            logging.exception('Unexpected exception while trying to remove a bad client from list')
-                            pass
-                except Exception:
-                    logging.exception('Unexpected exception while trying to send ws msg to all clients')
-                    pass
-                await asyncio.sleep(0)
-            await asyncio.sleep(0)  # lets the inbound task do something
-
-    def _websocket_receive(self, msg):
-        # Do something with a received message
+            message = await self.outbound_queue.get()
+            logging.debug('Sending trigger source event to %s clients' % len(self.clients))
+            try:
+                await self._send_to_all(message)
+            except Exception:
+                logging.exception('Unexpected exception while trying to send ws msg to all clients')
+
+    async def _send_to(self, websocket, message):
+        # returns False if the client was disconnected because it could not take the message
+        try:
+            await asyncio.wait_for(websocket.send(message), self.send_timeout)
+            return True
+        except Exception as ex:
+            logging.warning('disconnecting websocket client %s, which failed to take a message: %s' % (websocket.remote_address, repr(ex)))
+            self.clients.discard(websocket)
+            asyncio.ensure_future(websocket.close())
+            return False
+
+    async def _send_to_all(self, message):
+        # message is already serialized, every client is sent the same string, all at the same time
+        await asyncio.gather(*[self._send_to(client, message) for client in list(self.clients)])
+
+    async def _websocket_receive(self, websocket, msg):
+        # Do something with a received message, and reply to whoever sent it
         # logging.debug('Received websocket message: %s', msg)
-        result = self.receive_handler(msg)
-        self.send(json.dumps(result))
+        try:
+            if asyncio.iscoroutinefunction(self.receive_handler):
+                result = await self.receive_handler(msg)
+            else:
+                result = await self.loop.run_in_executor(self.executor, self.receive_handler, msg)
+            reply = self.codec.encode(result)
+            if self.broadcast_replies:
+                await self._send_to_all(reply)
+            else:
+                await self._send_to(websocket, reply)
+        except Exception:
+            logging.exception('Error while processing an inbound websocket message')
 
     def send(self, msg):
-        # queue message to be sent async later
-        # logging.debug('Queueing trigger source reply')
-        self.queue_ws_outbound.put(msg)
+        # broadcast an event to every client, msg can be a string or anything json serializable; can be called from any thread
+        # logging.debug('Queueing trigger source event')
+        if not isinstance(msg, str):
+            msg = self.codec.encode(msg)
+        self.loop.call_soon_threadsafe(self.outbound_queue.put_nowait, msg)
 
 
 class CSTriggerGenericHTTP:
     # This handles API calls only, it does not serve any pages or resources
+    # messages are handled in a pool of workers (the receive handler may block), so a slow request does not hold up the event loop
+    #   a receive handler which is a coroutine function is awaited on the loop instead, and must not block
+    #   requests beyond what the workers can take are queued, up to max_pending, after which they are turned away with a 503
+    #   read-only requests which arrive while the same request is already being handled share its result, instead of being handled again
+    # with metrics_route set, metrics are also served there as prometheus text, straight from the event loop
     app = None
     http_thread = None
     site = None
+    coalesce_requests = ['getCues', 'getStacks', 'getCurrentStack', 'getTriggerSources', 'getCommandTargets', 'getQueueStats', 'getMetrics']
 
     def __init__(self, config_obj):
         self.config = config_obj['config']
         self.receive_handler = config_obj['handler']
+        self.codec = config_obj.get('codec') or CSCodec()  # for replies
         self.loop = config_obj['loop']
         self.name = config_obj['name']
         self.queue = config_obj['queue']
         self.host = ''
         self.port = int(self.config['port'])
+        self.executor = ThreadPoolExecutor(max_workers=self.config.get('workers', 1), thread_name_prefix=self.name)
+        self.max_pending = self.config.get('max_pending', 64)  # requests waiting for, or being handled by, a worker
+        self.pending = 0
+        self.coalesce = self.config.get('coalesce', True)
+        self.in_flight = {}  # request -> future, for read-only requests being handled right now
+        self.metrics = config_obj.get('metrics')  # CSMetrics, if whoever set us up keeps any
+        self.metrics_route = self.config.get('metrics_route')
         try:
             logging.info('Starting HTTP Server on port %s' % self.port)
             self.app = web.Application()
             self.app.add_routes([web.get('/trigger', self.handle_trigger)])
+            if self.metrics_route:
+                if self.metrics is None:
+                    logging.warning('%s has a metrics_route, but there are no metrics to serve' % self.name)
+                else:
+                    self.app.add_routes([web.get(self.metrics_route, self.handle_metrics)])
             self.runner = web.AppRunner(self.app, access_log=None)  # access_log can be set to logging.Logger instance, or None to mute logging
             self.loop.run_until_complete(self.runner.setup())
             self.site = web.TCPSite(self.runner, self.host, self.port)
@@ -175,7 +187,7 @@ class CSTriggerGenericHTTP:
         except Exception as ex:
             logging.error('Unexpected Exception while setting up HTTP Server: %s', ex)
 
-    def handle_trigger(self, request):
+    async def handle_trigger(self, request):
         parsed_url = urlparse(str(request.url))
         parsed_query = parse_qs(parsed_url.query)
         msg = {}
@@ -185,20 +197,57 @@ class CSTriggerGenericHTTP:
         for keyname in parsed_query:
             if len(parsed_query[keyname]) > 1:
                 result = {'status': 'HTTP Query Error: duplicate query param: \'%s\'' % keyname}
-                return web.Response(text=json.dumps(result), status=400)
+                return web.Response(text=self.codec.encode(result), status=400)
             msg[keyname] = parsed_query[keyname][0]
         actual_message = json.dumps(msg)
-        result = self.receive_handler(actual_message)
+        result = await self.handle_message(msg, actual_message)
+        if result is None:
+            result = {'status': 'Busy: too many requests waiting to be handled'}
+            return web.Response(text=self.codec.encode(result), status=503)
         if result['status'] == 'OK':
-            return web.Response(text=json.dumps(result), status=200)
+            return web.Response(text=self.codec.encode(result), status=200)
+        else:
+            return web.Response(text=self.codec.encode(result), status=400)
+
+    async def handle_metrics(self, _request):
+        return web.Response(text=self.metrics.prometheus(), headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+    async def handle_message(self, msg, actual_message):
+        # returns the result from the receive handler, or None if there are already max_pending messages waiting for a worker
+        # a request only for data, with nothing else in it, can share the result of another one for the same data,
+        #   whatever its request_id: each caller gets a copy of the result, with its own request_id put back in
+        can_coalesce = self.coalesce and msg.get('request') in self.coalesce_requests and set(msg) <= {'request', 'request_id'}
+        if can_coalesce and msg['request'] in self.in_flight:
+            result = await asyncio.shield(self.in_flight[msg['request']])
+            return self.with_request_id(result, msg)
+        if self.pending >= self.max_pending:
+            return None
+        self.pending += 1
+        if asyncio.iscoroutinefunction(self.receive_handler):
+            future = asyncio.ensure_future(self.receive_handler(actual_message))
         else:
-            return web.Response(text=json.dumps(result), status=400)
+            future = self.loop.run_in_executor(self.executor, self.receive_handler, actual_message)
+        if can_coalesce:
+            self.in_flight[msg['request']] = future
+        try:
+            return await asyncio.shield(future)
+        finally:
+            self.pending -= 1
+            if can_coalesce:
+                self.in_flight.pop(msg['request'], None)
+
+    @staticmethod
+    def with_request_id(result, msg):
+        # a copy of a shared result, for the caller that sent msg, with a zero request id if it did not provide one
+        if not isinstance(result, dict):
+            return result
+        return dict(result, request_id=msg.get('request_id', 0))
 
     def stop(self):
         logging.info('shutting down HTTP Server...')
         # self.loop.run_until_complete(self.site.stop())
         # self.loop.run_until_complete(self.app.shutdown())
-        logging.debug('shutdown of http server currently does nothing')
+        self.executor.shutdown(wait=False)
 
 
 class CSTriggerGenericMQTT:
@@ -227,8 +276,12 @@ class CSTriggerGenericMQTT:
         self.client.subscribe(self.topic)
 
     def on_message(self, client, userdata, message):
+        # called from the mqtt client's own thread, a receive handler which is a coroutine function is handed to the loop
         msg = message.payload.decode('utf-8')
-        self.receive_handler(msg)
+        if asyncio.iscoroutinefunction(self.receive_handler):
+            asyncio.run_coroutine_threadsafe(self.receive_handler(msg), self.loop)
+        else:
+            self.receive_handler(msg)
 
     def stop(self):
         logging.info('shutting down MQTT Trigger Client...')
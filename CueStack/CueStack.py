@@ -53,7 +53,7 @@ class CueStackService:
             try:
                 logging.info('setting up structures')
                 self.loop = asyncio.new_event_loop()
-                self.msg_processor = CSMessageProcessor(config, log_level, self.loop)
+                self.msg_processor = CSMessageProcessor(config, log_level, self.loop, config_file)
             except Exception as ex:
                 logging.error('exception while setting up structures: %s' % ex)
                 self.stop(1)
@@ -7,15 +7,42 @@ Part of the PyATEMMax library.
 
 # pyright: reportGeneralTypeIssues=false, reportUnknownVariableType=false
 
-from typing import List, Callable, Union
+from typing import Callable, Dict, Tuple, Union
 
 import struct
 
 from .ATEMException import ATEMException
 
 
+# Precompiled (un)packers, keyed by (signed, bits)
+_STRUCTS: Dict[Tuple[bool, int], struct.Struct] = {
+    (True, 8): struct.Struct('!b'),
+    (False, 8): struct.Struct('!B'),
+    (True, 16): struct.Struct('!h'),
+    (False, 16): struct.Struct('!H'),
+    (True, 32): struct.Struct('!l'),
+    (False, 32): struct.Struct('!L'),
+    (True, 64): struct.Struct('!q'),
+    (False, 64): struct.Struct('!Q'),
+}
+
+_S8 = _STRUCTS[(True, 8)]
+_U8 = _STRUCTS[(False, 8)]
+_S16 = _STRUCTS[(True, 16)]
+_U16 = _STRUCTS[(False, 16)]
+_S32 = _STRUCTS[(True, 32)]
+_U32 = _STRUCTS[(False, 32)]
+_S64 = _STRUCTS[(True, 64)]
+_U64 = _STRUCTS[(False, 64)]
+
+
 class ATEMBuffer():
-    """ATEM Buffer manager"""
+    """ATEM Buffer manager
+
+    Data is kept in a bytearray and accessed in place with precompiled
+    struct.Struct objects (unpack_from/pack_into), so no per-call copies or
+    format strings are needed.
+    """
 
 
     # #######################################################################
@@ -30,7 +57,8 @@ class ATEMBuffer():
             size (int): size of the buffer
         """
 
-        self._buf: List[int]
+        self._buf: bytearray
+        self._zeros: bytes = b''
         self.size = size
         self._userOffsetCallback: Callable[[int], int]
         self._userOffsetCallbackSet: bool = False
@@ -59,11 +87,11 @@ class ATEMBuffer():
     #  List methods
     #
 
-    def __getitem__(self, i: Union[int, slice]) -> Union[int, List[int]]:
+    def __getitem__(self, i: Union[int, slice]) -> Union[int, bytearray]:
         return self._buf.__getitem__(i)
 
 
-    def __setitem__(self, i: Union[int, slice], v: int) -> None:
+    def __setitem__(self, i: Union[int, slice], v: Union[int, bytes, bytearray, memoryview]) -> None:
         return self._buf.__setitem__(i, v)
 
     def pop(self, i: int = ...) -> int:
@@ -95,7 +123,13 @@ class ATEMBuffer():
         if size != -1:
             self.size = size
 
-        self._buf = [0 for _ in range(self.size)]
+        if len(self._zeros) != self.size:
+            self._zeros = bytes(self.size)
+
+        if getattr(self, '_buf', None) is not None and len(self._buf) == self.size:
+            self._buf[:] = self._zeros      # Zero in place, no reallocation
+        else:
+            self._buf = bytearray(self.size)
 
 
     def _getFormatChar(self, signed: bool, bits: int) -> str:
@@ -126,51 +160,64 @@ class ATEMBuffer():
     #  Basic value type management
     #
 
-    def getInt(self, offset: int, signed: bool, bits: int) -> int:
-        """Get an integer"""
+    def _getStruct(self, signed: bool, bits: int) -> struct.Struct:
+        """Get the precompiled struct for a signed/unsigned integer size"""
+
+        st = _STRUCTS.get((signed, bits))
+        if st is None:
+            raise ATEMException(f"_getFormatChar(): Invalid number of bits ({bits}) requested")
+        return st
+
+
+    def _unpack(self, st: struct.Struct, offset: int, signed: bool, bits: int) -> int:
+        """Unpack an integer in place"""
 
         if self._userOffsetCallbackSet:
             bufferIndex = self._userOffsetCallback(offset)
         else:
             bufferIndex = offset
 
-        numBytes = int(bits/8)
-
-        if 0 < bufferIndex >= (self.size - numBytes):
+        if 0 < bufferIndex >= (self.size - st.size):
             raise ATEMException(f"ATEMBuffer.getInt(): Can't get" \
                             f" {'S' if signed else 'U'}{bits}" \
                             f" @offset[{offset}]" \
                             f" - buffIndex[{bufferIndex}]" \
-                            f" - numBytes[{numBytes}]" \
+                            f" - numBytes[{st.size}]" \
                             f" - buffLen[{self.size}]")
 
-        packedValue = bytes(self._buf[bufferIndex:bufferIndex+numBytes])
+        return st.unpack_from(self._buf, bufferIndex)[0]
 
-        return struct.unpack(self._getFormatChar(signed, bits), packedValue)[0]
 
-
-    def setInt(self, offset: int, signed: bool, bits: int, value: int) -> None:
-        """Set an integer"""
+    def _pack(self, st: struct.Struct, offset: int, signed: bool, bits: int, value: int) -> None:
+        """Pack an integer in place"""
 
         if self._userOffsetCallbackSet:
             bufferIndex = self._userOffsetCallback(offset)
         else:
             bufferIndex = offset
 
-        numBytes = int(bits/8)
-
-        if 0 < bufferIndex >= (self.size - numBytes):
+        if 0 < bufferIndex >= (self.size - st.size):
             raise ATEMException(f"ATEMBuffer.setInt(): Can't set" \
                             f" {'S' if signed else 'U'}{bits}" \
                             f" @offset[{offset}]" \
                             f" value[{value:X}]" \
                             f" - buffIndex[{bufferIndex}]" \
-                            f" - numBytes[{numBytes}]" \
+                            f" - numBytes[{st.size}]" \
                             f" - buffLen[{self.size}]")
 
-        packedValue = struct.pack(self._getFormatChar(signed, bits), value)
+        st.pack_into(self._buf, bufferIndex, value)
+
+
+    def getInt(self, offset: int, signed: bool, bits: int) -> int:
+        """Get an integer"""
+
+        return self._unpack(self._getStruct(signed, bits), offset, signed, bits)
+
+
+    def setInt(self, offset: int, signed: bool, bits: int, value: int) -> None:
+        """Set an integer"""
 
-        self._buf[bufferIndex:bufferIndex+numBytes] = list(packedValue)
+        self._pack(self._getStruct(signed, bits), offset, signed, bits, value)
 
 
     def changeInt(self, offset: int, signed: bool, bits: int, func: Callable[[int], int]) -> None:
@@ -219,13 +266,11 @@ class ATEMBuffer():
                             f" - numBytes[{numBytes}]" \
                             f" - buffLen[{self.size}]")
 
-        valueBuff = []
-        index = bufferIndex
-        while index < (bufferIndex + numBytes) and self._buf[index]:
-            valueBuff.append(self._buf[index])
-            index += 1
+        endIndex = self._buf.find(0, bufferIndex, bufferIndex + numBytes)
+        if endIndex == -1:
+            endIndex = bufferIndex + numBytes
 
-        cstring = bytes(valueBuff).decode('utf8', "ignore")
+        cstring = self._buf[bufferIndex:endIndex].decode('utf8', "ignore")
         return cstring
 
 
@@ -245,11 +290,9 @@ class ATEMBuffer():
                             f" - numBytes[{numBytes}]" \
                             f" - buffLen[{self.size}]")
 
-        buf = value.encode('utf8')
-        buf += bytes([0 for _ in range(numBytes)])
-        buf = buf[:numBytes]
+        buf = value.encode('utf8')[:numBytes].ljust(numBytes, b'\x00')
 
-        self._buf[bufferIndex:bufferIndex+numBytes-1] = list(buf)
+        self._buf[bufferIndex:bufferIndex+numBytes] = buf
 
 
     # #######################################################################
@@ -265,42 +308,42 @@ class ATEMBuffer():
     def getU8(self, offset: int) -> int:
         """Get an U8 integer"""
 
-        return self.getInt(offset, False, 8)
+        return self._unpack(_U8, offset, False, 8)
 
     def getS8(self, offset: int) -> int:
         """Get an S8 integer"""
 
-        return self.getInt(offset, True, 8)
+        return self._unpack(_S8, offset, True, 8)
 
     def getU16(self, offset: int) -> int:
         """Get an U16 integer"""
 
-        return self.getInt(offset, False, 16)
+        return self._unpack(_U16, offset, False, 16)
 
     def getS16(self, offset: int) -> int:
         """Get an S16 integer"""
 
-        return self.getInt(offset, True, 16)
+        return self._unpack(_S16, offset, True, 16)
 
     def getU32(self, offset: int) -> int:
         """Get an U32 integer"""
 
-        return self.getInt(offset, False, 32)
+        return self._unpack(_U32, offset, False, 32)
 
     def getS32(self, offset: int) -> int:
         """Get an S32 integer"""
 
-        return self.getInt(offset, True, 32)
+        return self._unpack(_S32, offset, True, 32)
 
     def getU64(self, offset: int) -> int:
         """Get an U64 integer"""
 
-        return self.getInt(offset, False, 64)
+        return self._unpack(_U64, offset, False, 64)
 
     def getS64(self, offset: int) -> int:
         """Get an S64 integer"""
 
-        return self.getInt(offset, True, 64)
+        return self._unpack(_S64, offset, True, 64)
 
     # -----------------------------------------------------------------------
     #
@@ -310,42 +353,42 @@ class ATEMBuffer():
     def setU8(self, offset: int, value: int) -> None:
         """Set an U8 integer"""
 
-        self.setInt(offset, False, 8, value)
+        self._pack(_U8, offset, False, 8, value)
 
     def setS8(self, offset: int, value: int) -> None:
         """Set an S8 integer"""
 
-        self.setInt(offset, True, 8, value)
+        self._pack(_S8, offset, True, 8, value)
 
     def setU16(self, offset: int, value: int) -> None:
         """Set an U16 integer"""
 
-        self.setInt(offset, False, 16, value)
+        self._pack(_U16, offset, False, 16, value)
 
     def setS16(self, offset: int, value: int) -> None:
         """Set an S16 integer"""
 
-        self.setInt(offset, True, 16, value)
+        self._pack(_S16, offset, True, 16, value)
 
     def setU32(self, offset: int, value: int) -> None:
         """Set an U32 integer"""
 
-        self.setInt(offset, False, 32, value)
+        self._pack(_U32, offset, False, 32, value)
 
     def setS32(self, offset: int, value: int) -> None:
         """Set an S32 integer"""
 
-        self.setInt(offset, True, 32, value)
+        self._pack(_S32, offset, True, 32, value)
 
     def setU64(self, offset: int, value: int) -> None:
         """Set an U64 integer"""
 
-        self.setInt(offset, False, 64, value)
+        self._pack(_U64, offset, False, 64, value)
 
     def setS64(self, offset: int, value: int) -> None:
         """Set an S64 integer"""
 
-        self.setInt(offset, True, 64, value)
+        self._pack(_S64, offset, True, 64, value)
 
     # -----------------------------------------------------------------------
     #
@@ -381,22 +424,22 @@ class ATEMBuffer():
     def getU8Flag(self, offset: int, bit: int) -> bool:
         """Get an individual bit in an U8 integer"""
 
-        return self.getFlag(offset, False, 8, bit)
+        return True if (self._unpack(_U8, offset, False, 8) & 1<<bit) else False
 
     def getU16Flag(self, offset: int, bit: int) -> bool:
         """Get an individual bit in an U16 integer"""
 
-        return self.getFlag(offset, False, 16, bit)
+        return True if (self._unpack(_U16, offset, False, 16) & 1<<bit) else False
 
     def getU32Flag(self, offset: int, bit: int) -> bool:
         """Get an individual bit in an U32 integer"""
 
-        return self.getFlag(offset, False, 32, bit)
+        return True if (self._unpack(_U32, offset, False, 32) & 1<<bit) else False
 
     def getU64Flag(self, offset: int, bit: int) -> bool:
         """Get an individual bit in an U64 integer"""
 
-        return self.getFlag(offset, False, 64, bit)
+        return True if (self._unpack(_U64, offset, False, 64) & 1<<bit) else False
 
 
     def setU8Flag(self, offset: int, bit: int) -> None:
@@ -9,7 +9,7 @@ Methods do keep the order in https://www.skaarhoj.com/fileadmin/BMDPROTOCOL.html
 # pylint: disable=too-many-lines, wildcard-import, unused-wildcard-import, protected-access
 # pyright: reportPrivateUsage=false, reportUnusedFunction=false, reportUnboundVariable=false
 
-from typing import Callable
+from typing import Callable, Dict
 
 from .ATEMUtils import boolBit, mapValue
 from .ATEMProtocolEnums import *
@@ -44,7 +44,7 @@ class ATEMCommandHandlers():
     """
 
     # These handlers manage their initial buffer read by themselves
-    _AUTOMANAGED_HANDLERS = [ 'AMLv', 'TlSr' ]
+    _AUTOMANAGED_HANDLERS = frozenset([ 'AMLv', 'TlSr' ])
 
     # All command handler methods MUST have this prefix
     _HANDLER_PREFIX = "_handle"
@@ -59,6 +59,14 @@ class ATEMCommandHandlers():
 
         self.cmdStr:str = ""
 
+        # Command name -> bound handler method, resolved once here instead of on every packet
+        self._handlers: Dict[str, Callable[[], None]] = {
+            attr[len(self._HANDLER_PREFIX):]: self.__getattribute__(attr)
+            for attr in dir(self)
+            if attr[:len(self._HANDLER_PREFIX)] == self._HANDLER_PREFIX and
+                attr[len(self._HANDLER_PREFIX):] != 'NOTIMPLEMENTED'
+        }
+
 
     # #######################################################################
     #
@@ -69,13 +77,8 @@ class ATEMCommandHandlers():
     def registerAllHandlers(self):
         """Register all handlers"""
 
-        for attr in dir(self):
-            funcname = attr
-
-            if funcname[:len(self._HANDLER_PREFIX)] == self._HANDLER_PREFIX:
-                funccmd = funcname[len(self._HANDLER_PREFIX):]
-                if funccmd != 'NOTIMPLEMENTED':
-                    self._sw._registerCmdHandler(funccmd, self._mainHandler)
+        for funccmd in self._handlers:
+            self._sw._registerCmdHandler(funccmd, self._mainHandler)
 
         for funccmd in self._p.commands:
             if funccmd not in self._sw._cmdHandlers:
@@ -95,11 +98,7 @@ class ATEMCommandHandlers():
     def _getHandler(self, cmdStr:str) -> Callable[[], None]:
         """Get handler by command name"""
 
-        funcname = self._HANDLER_PREFIX + cmdStr
-        if funcname in dir(self):
-            return self.__getattribute__(funcname)
-        else:
-            return self._handleNOTIMPLEMENTED
+        return self._handlers.get(cmdStr, self._handleNOTIMPLEMENTED)
 
 
     def _getBufEnum(self, offset: int, bits: int, enum: ATEMConstantList) -> ATEMConstant:
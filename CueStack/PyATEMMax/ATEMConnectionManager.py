@@ -7,17 +7,19 @@ Part of the PyATEMMax library.
 
 # pyright: reportGeneralTypeIssues=false, reportUnknownMemberType=false
 
-from typing import Callable, Dict, List, Optional, Any
+from typing import Callable, Dict, List, Optional, Set, Tuple, Any
 
 import abc
 import time
+import asyncio
+import inspect
 import threading
 import queue
 import logging
 
 from .ATEMProtocol import ATEMProtocol
 from .ATEMUtils import hexStr, hasTimedOut
-from .ATEMSocket import ATEMUDPSocket
+from .ATEMSocket import ATEMUDPSocket, ATEMDatagramProtocol
 from .ATEMBuffer import ATEMBuffer
 from .ATEMException import ATEMException
 
@@ -49,6 +51,9 @@ class ATEMConnectionManager():
         # Protocol command handlers
         self._cmdHandlers: Dict[str, Any] = {}
 
+        # Same handlers, keyed by the 4 raw command bytes as they arrive in the command header
+        self._cmdDispatch: Dict[bytes, Tuple[str, Callable[[str], None]]] = {}
+
         # Event subscriptions
         self._eventSubscriptions: Dict[str, List[Any]] = {}
 
@@ -63,6 +68,13 @@ class ATEMConnectionManager():
         # Udp communication object
         self._udp = ATEMUDPSocket()
 
+        # asyncio mode (see connectAsync): the event loop, the timeout timer, and handshake progress for waitForConnectionAsync
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._asyncTimer: Optional[asyncio.TimerHandle] = None
+        self._aliveEvent: Optional[asyncio.Event] = None
+        self._connectedEvent: Optional[asyncio.Event] = None
+        self._eventTasks: Set[asyncio.Task] = set()
+
 
     def registerEvent(self, event: str, callback: Callable[[Dict[Any, Any]], None])-> None:
         """Register an event handler
@@ -82,6 +94,7 @@ class ATEMConnectionManager():
         """Register a command handler"""
 
         self._cmdHandlers[command] = { "callback": callback }
+        self._cmdDispatch[command.encode('latin-1')] = (command, callback)
 
 
     def __del__(self) -> None:
@@ -198,6 +211,46 @@ class ATEMConnectionManager():
             pingMode (bool): connect in "ping" mode? (ignore data, just wait for UDP conn)
         """
 
+        self._prepareConnection(ip, connTimeout, pingMode)
+
+        self._eventThread = threading.Thread(target=self._eventThreadHandler)
+        self._commsThread = threading.Thread(target=self._commsThreadHandler)
+
+        self._eventThread.start()
+        self._commsThread.start()
+        self.started = True
+
+
+    async def connectAsync(self, ip: str, connTimeout: int =5, pingMode: bool = False) -> None:
+        """Connect to the switcher, using the running asyncio event loop instead of threads.
+
+        Received packets are handled as they arrive, and timeouts by loop timers,
+        so nothing polls while the switcher is idle.
+        Event callbacks are called on the loop, and may be coroutine functions.
+
+        Args:
+            ip (str): IP address of the switcher
+            connTimeout (int): connection timeout (seconds)
+            pingMode (bool): connect in "ping" mode? (ignore data, just wait for UDP conn)
+        """
+
+        self._prepareConnection(ip, connTimeout, pingMode)
+
+        self._loop = asyncio.get_running_loop()
+        self._aliveEvent = asyncio.Event()
+        self._connectedEvent = asyncio.Event()
+        await self._loop.create_datagram_endpoint(
+            lambda: ATEMDatagramProtocol(self._udp, self._onDatagram),
+            remote_addr=(ip, self.atem.UDPPort))
+        self.started = True
+
+        # First run sends HELLO, and arms the timeout timer
+        self._onAsyncTimer()
+
+
+    def _prepareConnection(self, ip: str, connTimeout: int, pingMode: bool) -> None:
+        """Connection setup shared by connect() and connectAsync()"""
+
         if self.started:
             self.log.debug("Closing previous connection")
             self.disconnect()
@@ -213,13 +266,6 @@ class ATEMConnectionManager():
 
         self.resetCommandBundle()
 
-        self._eventThread = threading.Thread(target=self._eventThreadHandler)
-        self._commsThread = threading.Thread(target=self._commsThreadHandler)
-
-        self._eventThread.start()
-        self._commsThread.start()
-        self.started = True
-
 
     def disconnect(self) -> None:
         """Close the connection with the switcher."""
@@ -230,6 +276,16 @@ class ATEMConnectionManager():
         self.log.debug("Stopping connection")
         self.started = False
 
+        if self._loop is not None:
+            if self._asyncTimer is not None:
+                self._asyncTimer.cancel()
+                self._asyncTimer = None
+            self._udp.detachTransport()
+            self._loop = None
+            self._udp.stop()
+            self._resetInternalData()
+            return
+
         self._commsThreadCmdQ.put(THREAD_EXIT_MSG)
         self._commsThread.join()
         self._commsThread = threading.Thread(target=self._commsThreadHandler)
@@ -295,9 +351,9 @@ class ATEMConnectionManager():
         self._outBuf.setU8(12, 0x01)    # Expected on first request.
         self._sendCommand(self.atem.headerLen+self.atem.cmdHeaderLen)
 
-        self._eventThreadEventQ.put({"name": "connectAttempt", "args": {
+        self._emitEvent("connectAttempt", {
             "switcher": self,
-            }})
+            })
 
 
     def _commsThreadHandler(self):
@@ -509,9 +565,9 @@ class ATEMConnectionManager():
 
                 if not self._waitingForIncoming:
                     self.connected = True
-                    self._eventThreadEventQ.put({"name": "connect", "args": {
+                    self._emitEvent("connect", {
                         "switcher": self,
-                        }})
+                        })
 
 
             # This makes the first "while True:" behave as a do...while.
@@ -522,9 +578,9 @@ class ATEMConnectionManager():
         if hasTimedOut(self._lastContact, self._connTimeout):
             self.log.warning("Connection has timed out - reconnecting")
             if self.connected:
-                self._eventThreadEventQ.put({"name": "disconnect", "args": {
+                self._emitEvent("disconnect", {
                     "switcher": self,
-                    }})
+                    })
             self._connect()
 
         # Everything OK, continue running
@@ -554,6 +610,62 @@ class ATEMConnectionManager():
         self.log.debug("Event thread FINISHED")
 
 
+    def _emitEvent(self, name: str, args: Dict[str, Any]) -> None:
+        """Deliver an event to its subscribers: through the event thread, or on the loop in asyncio mode"""
+
+        if self._loop is not None:
+            self._loop.call_soon(self._dispatchEvent, name, args)
+        else:
+            self._eventThreadEventQ.put({"name": name, "args": args})
+
+
+    def _dispatchEvent(self, name: str, args: Dict[str, Any]) -> None:
+        """Call the subscribers of an event on the loop, running any coroutines they return as tasks"""
+
+        for cb in self._eventSubscriptions.get(name, []):
+            result = cb(args)
+            if inspect.isawaitable(result):
+                task = asyncio.ensure_future(result)
+                self._eventTasks.add(task)     # Hold a reference until it finishes
+                task.add_done_callback(self._eventTasks.discard)
+
+
+    def _onDatagram(self) -> None:
+        """asyncio mode: parse whatever has been received"""
+
+        self._runLoop()
+        # The very first packet only marks the switcher as alive, it gets parsed on the next pass
+        while self._udp.available() or self._udp.queued():
+            self._runLoop()
+        self._updateAsyncWaiters()
+
+
+    def _onAsyncTimer(self) -> None:
+        """asyncio mode: connect, or reconnect if the switcher has gone quiet for too long"""
+
+        self._asyncTimer = None
+        if not self.started or self._loop is None:
+            return
+
+        self._runLoop()
+        self._updateAsyncWaiters()
+
+        # Check again when the connection would time out, unless packets keep arriving in the meantime
+        remaining = self._lastContact + self._connTimeout - time.time()
+        self._asyncTimer = self._loop.call_later(max(remaining, 0.01), self._onAsyncTimer)
+
+
+    def _updateAsyncWaiters(self) -> None:
+        """asyncio mode: wake up waitForConnectionAsync()"""
+
+        for event, state in ((self._aliveEvent, self.switcherAlive), (self._connectedEvent, self.connected)):
+            if event is not None:
+                if state:
+                    event.set()
+                else:
+                    event.clear()
+
+
     def _emitEvents(self) -> None:
         while not self._eventThreadEventQ.empty():
             event: Dict[str, Any] = self._eventThreadEventQ.get_nowait()
@@ -615,6 +727,41 @@ class ATEMConnectionManager():
         return True
 
 
+    async def waitForConnectionAsync(self, infinite: bool =True, timeout: float =0.0, waitForFullHandshake: bool =True) -> bool:
+        """Waits until the switcher initializes, for connections made with connectAsync().
+
+        Args:
+            infinite (bool, default=True): Infinite wait?
+            timeout (int, optional): max seconds to wait. If not specified will use protocol defaults.
+            waitForFullHandshake (bool, default=True): If False the function will return on initial UDP connection.
+        """
+
+        if self._aliveEvent is None or self._connectedEvent is None:
+            raise ATEMException("waitForConnectionAsync() needs a connection made with connectAsync()")
+
+        if self._pingMode:
+            infinite = False
+            waitForFullHandshake = False
+
+        if timeout:
+            infinite = False
+        elif not infinite:
+            if waitForFullHandshake:
+                timeout = self.atem.defaultConnectionTimeout
+            else:
+                timeout = self.atem.defaultHandshakeTimeout
+
+        event = self._connectedEvent if waitForFullHandshake else self._aliveEvent
+        try:
+            await asyncio.wait_for(event.wait(), None if infinite else timeout)
+        except asyncio.TimeoutError:
+            self.log.debug(f"Timeout waiting for {'connection' if waitForFullHandshake else 'first UDP packet'}")
+            return False
+
+        self.log.debug("Finished waiting for initialization")
+        return True
+
+
     def setSocketLogLevel(self, level: int) -> None:
         """Set the logging output level for the internal socket.
 
@@ -695,6 +842,7 @@ class ATEMConnectionManager():
 
         # If packet is more than an ACK packet (= if its longer than 12 bytes header), lets parse it:
         indexPointer = self.atem.headerLen      # self.atem.headerLen bytes has already been read from the packet...
+        debugEnabled = self.log.isEnabledFor(logging.DEBUG)
         while indexPointer < packetLength:
             # Read the length of segment (first word):
             self._udp.read(self._inBuf, self.atem.cmdHeaderLen)
@@ -702,16 +850,22 @@ class ATEMConnectionManager():
             self._cmdPointer = 0
 
             # Get the "command string", basically this is the 4 char variable name in the ATEM memory holding the various state values of the system:
-            cmdStr = ''.join([chr(x) for x in [ self._inBuf[4], self._inBuf[5], self._inBuf[6], self._inBuf[7]]])
-
-            if cmdStr in self.atem.commands:
-                self.log.debug(f"Received: [{cmdStr}] ({self.atem.commands[cmdStr]})")
+            #  known commands are looked up by their raw bytes, only unknown ones need decoding
+            dispatch = self._cmdDispatch.get(bytes(self._inBuf[4:8]))
+            if dispatch is not None:
+                cmdStr, callback = dispatch
             else:
-                self.log.debug(f"Received: UNKNOWN command [{cmdStr}]")
+                cmdStr, callback = self._inBuf[4:8].decode('latin-1'), None
+
+            if debugEnabled:
+                if cmdStr in self.atem.commands:
+                    self.log.debug(f"Received: [{cmdStr}] ({self.atem.commands[cmdStr]})")
+                else:
+                    self.log.debug(f"Received: UNKNOWN command [{cmdStr}]")
 
             # If length of segment larger than 8 (should always be...!)
             if self._cmdLength > self.atem.cmdHeaderLen:
-                self._parseGetCommands(cmdStr)
+                self._parseGetCommands(cmdStr, callback)
 
                 while self._read2InBuf():   # Empty, if not done yet.
                     pass
@@ -723,20 +877,26 @@ class ATEMConnectionManager():
                 return
 
 
-    def _parseGetCommands(self, cmdStr: str) -> None:
-        """Skårhøj: virtual void _parseGetCommands(const char *cmdString)"""
+    def _parseGetCommands(self, cmdStr: str, callback: Optional[Callable[[str], None]] =None) -> None:
+        """Skårhøj: virtual void _parseGetCommands(const char *cmdString)
+
+        callback is the registered handler for cmdStr, if the caller already looked it up.
+        """
+
+        if callback is None and cmdStr in self._cmdHandlers:
+            callback = self._cmdHandlers[cmdStr]["callback"]
 
-        if cmdStr in self._cmdHandlers:
+        if callback is not None:
             try:
-                self._cmdHandlers[cmdStr]["callback"](cmdStr)  # Call method
+                callback(cmdStr)  # Call method
 
                 # Avoid emitting events for handshake data
                 if self.connected:
-                    self._eventThreadEventQ.put({"name": "receive", "args": {
+                    self._emitEvent("receive", {
                         "switcher": self,
                         "cmd": cmdStr,
                         "cmdName": self.atem.commands[cmdStr] if cmdStr in self.atem.commands else ""
-                        }})
+                        })
 
             except ATEMException as e:
                 self.log.warning(f"{str(e)} - processing [{cmdStr}]")
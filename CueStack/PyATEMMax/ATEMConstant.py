@@ -5,7 +5,7 @@ ATEMConstant: Blackmagic ATEM protocol definitions - constant value base class
 Part of the PyATEMMax library.
 """
 
-from typing import Any, Optional, Union
+from typing import Any, Dict, Optional, Union
 
 from .ATEMException import ATEMException
 
@@ -51,12 +51,31 @@ class ATEMConstantList:
             raise StopIteration
 
 
+    # Per-class caches, shared by every instance of the same list class:
+    #   name -> ATEMConstant and value -> ATEMConstant (first constant wins if values repeat)
+    _classValues: Dict[type, Dict[str, ATEMConstant]] = {}
+    _classValueIndexes: Dict[type, Dict[Any, ATEMConstant]] = {}
+
+
     def __init__(self):
-        self._values = {
-                prop: self.__getattribute__(prop)
-                for prop in self.__class__.__dict__
-                if isinstance(self.__getattribute__(prop), ATEMConstant)
-            }
+        cls = self.__class__
+        values = ATEMConstantList._classValues.get(cls)
+        if values is None:
+            values = {
+                    prop: self.__getattribute__(prop)
+                    for prop in cls.__dict__
+                    if isinstance(self.__getattribute__(prop), ATEMConstant)
+                }
+            valueIndex: Dict[Any, ATEMConstant] = {}
+            for constant in values.values():
+                try:
+                    valueIndex.setdefault(constant.value, constant)
+                except TypeError:
+                    pass    # unhashable value, only reachable through the scan in _byValue
+            ATEMConstantList._classValues[cls] = values
+            ATEMConstantList._classValueIndexes[cls] = valueIndex
+        self._values = values
+        self._valueIndex = ATEMConstantList._classValueIndexes[cls]
 
 
     def __len__(self):
@@ -113,6 +132,10 @@ class ATEMConstantList:
 
         if isinstance(value, ATEMConstant):
             value = value.value
+        try:
+            return self._valueIndex.get(value)
+        except TypeError:
+            pass    # unhashable value, only an unhashable constant value can match it
         found = None
         for k in self._values:
             v = self._values[k].value
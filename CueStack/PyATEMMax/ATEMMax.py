@@ -72,10 +72,10 @@ class ATEMMax(ATEMConnectionManager, ATEMSwitcherState, ATEMSetterMethods):
         if params['cmd'] == "Warn":
             if self.warningText:
                 self.log.debug(f"ATEM warning: {self.warningText}")
-                self._eventThreadEventQ.put({"name": "warning", "args": {
+                self._emitEvent("warning", {
                     "switcher": self,
                     "msg": self.warningText,
-                    }})
+                    })
 
 
     # #######################################################################
@@ -6,10 +6,13 @@ to keep the ATEMConnectionManager class as close as possible to the original.
 Part of the PyATEMMax library.
 """
 
-from typing import Any, List, Optional, Union
+from typing import Any, Callable, Deque, List, Optional, Union, MutableSequence
 
 import socket
+import asyncio
 import logging
+import threading
+import collections
 
 from .ATEMProtocol import ATEMProtocol
 from .ATEMUtils import hexStr
@@ -20,6 +23,14 @@ class ATEMUDPSocket():
     This class emulates the behaviour of Arduino's UDP socket.
 
     Its purpose is to keep the code as close as possible to the original.
+
+    Each datagram is received into a preallocated buffer and kept as a
+    memoryview with a read cursor, so reads are slice copies and never
+    shift the remaining data around.
+
+    When an asyncio transport is attached (see ATEMDatagramProtocol),
+    datagrams are pushed in by the protocol instead of being read from
+    the socket, and writes go out through the transport.
     """
 
     def __init__(self):
@@ -37,7 +48,19 @@ class ATEMUDPSocket():
 
         self.connected = False
 
-        self._buffer = []
+        # Datagrams are received here, without allocating a new object per packet
+        self._rxBuf = bytearray(self.atem.inputBufferLength)
+        self._rxView = memoryview(self._rxBuf)
+
+        # Data not read yet is self._data[self._pos:]
+        self._data: Union[bytes, memoryview] = b''
+        self._pos: int = 0
+
+        # asyncio mode: transport to write to, its loop, and datagrams received but not parsed yet
+        self._transport: Optional[asyncio.DatagramTransport] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loopThreadId: Optional[int] = None
+        self._queued: Deque[bytes] = collections.deque()
 
 
     def connect(self, ip: str) -> None:
@@ -54,10 +77,46 @@ class ATEMUDPSocket():
         port = self.atem.UDPPort
         address = (ip, port)
         self.log.info(f"Connecting to {ip}:{port}")
-        self._socket.connect(address)
+        if self._transport is None:
+            # An attached transport is already bound to the switcher's address
+            self._socket.connect(address)
         self.connected = True
 
 
+    def attachTransport(self, transport: asyncio.DatagramTransport, loop: asyncio.AbstractEventLoop) -> None:
+        """Send and receive through an asyncio datagram transport instead of the socket."""
+
+        self._transport = transport
+        self._loop = loop
+        self._loopThreadId = threading.get_ident()
+        self._queued.clear()
+
+
+    def detachTransport(self) -> None:
+        """Close the asyncio transport, if any, and go back to using the socket."""
+
+        transport = self._transport
+        self._transport = None
+        self._queued.clear()
+        if transport is not None and self._loop is not None:
+            if threading.get_ident() == self._loopThreadId:
+                transport.close()
+            else:
+                self._loop.call_soon_threadsafe(transport.close)
+
+
+    def datagramReceived(self, data: bytes) -> None:
+        """Queue a datagram received by the asyncio transport, for parsePacket() to pick up."""
+
+        self._queued.append(data)
+
+
+    def queued(self) -> int:
+        """Get the number of datagrams received by the asyncio transport and not parsed yet."""
+
+        return len(self._queued)
+
+
     def stop(self) -> Any:
         """
         Disconnect from the server.
@@ -86,15 +145,32 @@ class ATEMUDPSocket():
         From: https://www.arduino.cc/en/Reference/EthernetUDPParsePacket
         """
 
-        try:
-            data, _ = self._socket.recvfrom(10240)
-        except socket.error:
-            data = []
+        # Anything still unread is a view into the receive buffer, so it must be copied out before receiving again
+        leftover = bytes(self._data[self._pos:]) if self.available() else b''
 
-        if data:
-            self._buffer.extend(data)
-            self.log.debug(f"Received {len(data)} new bytes [{hexStr(data)}] - " \
-                            f" {self.available()} bytes available")
+        received: Union[bytes, memoryview] = b''
+        if self._transport is not None:
+            if self._queued:
+                received = self._queued.popleft()
+        else:
+            try:
+                received = self._rxView[:self._socket.recv_into(self._rxBuf)]
+            except socket.error:
+                pass
+        size = len(received)
+
+        if size:
+            if leftover:
+                self._data = leftover + received
+            else:
+                self._data = received
+            self._pos = 0
+            if self.log.isEnabledFor(logging.DEBUG):
+                self.log.debug(f"Received {size} new bytes [{hexStr(self._data[-size:])}] - " \
+                                f" {self.available()} bytes available")
+        elif leftover:
+            self._data = leftover
+            self._pos = 0
 
         return self.available()
 
@@ -108,30 +184,26 @@ class ATEMUDPSocket():
         From: https://www.arduino.cc/en/Reference/EthernetUDPAvailable
         """
 
-        return len(self._buffer)
+        return len(self._data) - self._pos
 
 
-    def read(self, buffer: List[int], maxSize: Optional[int] =None):
+    def read(self, buffer: MutableSequence[int], maxSize: Optional[int] =None):
         """
         Read UDP data from the specified buffer.
 
-        If no arguments are given, it will return the next character in the buffer.
+        The contents of buffer are replaced by up to maxSize bytes
+         (everything available if maxSize is not given).
 
         From: https://www.arduino.cc/en/Reference/EthernetUDPRead
         """
 
-        # Clear buffer before receiving
-        buffer[:] = []
+        count = self.available()
+        if maxSize and maxSize < count:
+            count = maxSize
 
-        # Get data from the internal buffer
-        count = 0
-        maxCount = maxSize if maxSize else 9999999999999
-        while count < maxCount:
-            if self.available():
-                buffer.append(self._buffer.pop(0))
-                count += 1
-            else:
-                break
+        # Replaces the buffer contents with a single slice copy
+        buffer[:] = self._data[self._pos:self._pos+count]
+        self._pos += count
 
         return count
 
@@ -152,24 +224,36 @@ class ATEMUDPSocket():
 
         outbuf = outbuf[:length] if length else outbuf
 
-        self.log.debug(f"Sending buffer [{hexStr(outbuf)}]")
+        if self.log.isEnabledFor(logging.DEBUG):
+            self.log.debug(f"Sending buffer [{hexStr(outbuf)}]")
+
+        if self._transport is not None:
+            # Transports are not thread safe, commands sent from other threads are handed to the loop
+            if threading.get_ident() == self._loopThreadId:
+                self._transport.sendto(outbuf)
+            else:
+                self._loop.call_soon_threadsafe(self._transport.sendto, outbuf)
+            return len(outbuf)
+
         return self._socket.send(outbuf)
 
 
     def flushInputBuffer(self):
         """Flush the input buffer"""
 
-        oldbuffer = [b for b in self._buffer]
-        self._buffer = []
+        oldbuffer = bytes(self._data[self._pos:])
+        self._data = b''
+        self._pos = 0
 
-        self.log.debug(f"Buffer flushed. Data: [{hexStr(oldbuffer)}]")
+        if self.log.isEnabledFor(logging.DEBUG):
+            self.log.debug(f"Buffer flushed. Data: [{hexStr(oldbuffer)}]")
         return oldbuffer
 
 
     def peek(self):
         """Get a copy of the input buffer"""
 
-        return [b for b in self._buffer]
+        return bytes(self._data[self._pos:])
 
 
     def setLogLevel(self, level: int) -> None:
@@ -181,3 +265,34 @@ class ATEMUDPSocket():
         """
 
         self.log.setLevel(level)
+
+
+
+class ATEMDatagramProtocol(asyncio.DatagramProtocol):
+    """
+    asyncio protocol feeding an ATEMUDPSocket.
+
+    Received datagrams are queued on the socket, then onReceive is called
+    so they can be parsed right away, on the event loop.
+    """
+
+    def __init__(self, udp: ATEMUDPSocket, onReceive: Callable[[], None]):
+        """Create a ATEMDatagramProtocol object."""
+
+        super().__init__()
+        self._udp = udp
+        self._onReceive = onReceive
+
+
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
+        self._udp.attachTransport(transport, asyncio.get_event_loop())   # type: ignore
+
+
+    def datagram_received(self, data: bytes, addr: Any) -> None:
+        self._udp.datagramReceived(data)
+        self._onReceive()
+
+
+    def error_received(self, exc: Exception) -> None:
+        # Typically ICMP port unreachable while the switcher is offline, the connection timeout takes care of it
+        self._udp.log.debug(f"Transport error: {exc}")
@@ -17,11 +17,13 @@
 
 
 import json
+import time
 import logging
 from multiprocessing import Queue
 
 from visca import ViscaControl
 from CSTriggerSources import CSTriggerGenericWebsocket, CSTriggerGenericHTTP, CSTriggerGenericMQTT
+from CSMetrics import CSMetrics
 
 # self.v = ViscaControl(portname='/dev/serial/by-id/usb-Twiga_TWIGACam-if03-port0')
 # self.v.cmd_cam_zoom_tele_speed(self.CAM, 7)
@@ -45,6 +47,9 @@ class ViscaAgentMessageProcessor:
         self.loop = loop
         self.log_level = log_level
         self.command_queue = Queue()
+        self.metrics = CSMetrics(prefix='viscaagent')  # reported by getMetrics, and by http command sources with a metrics_route
+        # observed into from whichever command source the command came in on, each with a thread of its own
+        self.command_time = self.metrics.histogram('command_seconds', 'Time from sending a command to the camera until its reply', locked=True)
         try:
             self.setup_command_sources()
             self.serial_port = self.config['serial_port']
@@ -82,6 +87,8 @@ class ViscaAgentMessageProcessor:
                     logging.error('exception while handling visca command: %s' % ex)
                     return {'status': 'Exception while handling visca command: %s' % ex}
                 return {'status': 'OK'}
+            elif command_message.get('request') == 'getMetrics':
+                return {'status': 'OK', 'request_id': command_message.get('request_id', 0), 'response': {'metrics': self.metrics.snapshot()}}
             else:
                 return {'status': 'Error: missing a supported command key'}
         except Exception as e:
@@ -102,7 +109,11 @@ class ViscaAgentMessageProcessor:
     def send_command(self, command):
         logging.debug('sending visca command: %s' % command)
         method_to_call = getattr(self.v, command['request'])
-        return method_to_call(**command['args'])
+        started = time.monotonic()
+        try:
+            return method_to_call(**command['args'])
+        finally:
+            self.command_time.observe(time.monotonic() - started)
 
     def setup_command_sources(self):
         # setup command sources based on config, populating command_sources
@@ -129,6 +140,7 @@ class ViscaAgentMessageProcessor:
                     'queue': self.command_queue,
                     'handler': self.handle,
                     'loop': self.loop,
+                    'metrics': self.metrics,
                 }
                 self.command_sources[this_source['name']] = self.command_map[this_source['type']](this_config_obj)
             else:
@@ -18,13 +18,14 @@ if platform.system() == 'Windows':
     import win32api
 
 
-async def ws_server(websocket, path):
+async def ws_server(websocket, path=None):
+    # reply to every message, for as long as the client keeps the connection open
     try:
-        message = await websocket.recv()
-        timestamp = str(datetime.now())
-        print('%s  received message: %s' % (timestamp, message))
-        reply = {'status': 'OK', 'received_timestamp': timestamp}
-        await websocket.send(json.dumps(reply))
+        async for message in websocket:
+            timestamp = str(datetime.now())
+            print('%s  received message: %s' % (timestamp, message))
+            reply = {'status': 'OK', 'received_timestamp': timestamp}
+            await websocket.send(json.dumps(reply))
     except websockets.ConnectionClosed:
         print(f"warning: got websockets.ConnectionClosed")
 
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# ATEMBuffer benchmark
+#   compares the bytearray-backed PyATEMMax.ATEMBuffer against the list-backed implementation it replaced
+#   run from the repo root: python3 tests/bench-atem-buffer.py
+
+#    Copyright (C) 2021 James Bishop (james@bishopdynamics.com)
+
+# pylint: disable=C0111,W0703,C0301
+
+import sys
+import struct
+import pathlib
+import argparse
+import timeit
+
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent.joinpath('CueStack')))
+
+from PyATEMMax.ATEMBuffer import ATEMBuffer  # noqa: E402
+
+
+class ListATEMBuffer:
+    # the hot paths of the old list-backed ATEMBuffer, kept here for comparison
+    def __init__(self, size):
+        self.size = size
+        self._buf = []
+        self.reset()
+
+    def reset(self):
+        self._buf = [0 for _ in range(self.size)]
+
+    def _getFormatChar(self, signed, bits):
+        fmtChr = {8: 'b', 16: 'h', 32: 'l', 64: 'q'}[bits]
+        if not signed:
+            fmtChr = fmtChr.upper()
+        return f'!{fmtChr}'
+
+    def getInt(self, offset, signed, bits):
+        numBytes = int(bits / 8)
+        packedValue = bytes(self._buf[offset:offset + numBytes])
+        return struct.unpack(self._getFormatChar(signed, bits), packedValue)[0]
+
+    def setInt(self, offset, signed, bits, value):
+        numBytes = int(bits / 8)
+        packedValue = struct.pack(self._getFormatChar(signed, bits), value)
+        self._buf[offset:offset + numBytes] = list(packedValue)
+
+    def getU16(self, offset):
+        return self.getInt(offset, False, 16)
+
+    def setU16(self, offset, value):
+        self.setInt(offset, False, 16, value)
+
+    def getU8Flag(self, offset, bit):
+        return True if (self.getInt(offset, False, 8) & 1 << bit) else False
+
+
+def amlv_levels(buf, num_sources):
+    # roughly what _handleAMLv does for each audio source in an AMLv packet
+    total = 0
+    for a in range(num_sources):
+        total += buf.getU16(1) + buf.getU16(5) + buf.getU16(9) + buf.getU16(13) + a
+    return total
+
+
+def tally_flags(buf, num_sources):
+    # roughly what _handleTlIn does for each video source
+    for a in range(num_sources):
+        buf.getU8Flag(2 + a, 0)
+        buf.getU8Flag(2 + a, 1)
+
+
+def header(buf):
+    # building a packet header, as _setCommandHeaderWithPckId does
+    buf.setU16(0, 0x080C)
+    buf.setU16(2, 0x1234)
+    buf.setU16(4, 0)
+    buf.setU16(10, 42)
+
+
+def bench(name, func, number):
+    seconds = min(timeit.repeat(func, number=number, repeat=3))
+    return seconds / number * 1000000
+
+
+if __name__ == '__main__':
+    ARG_PARSER = argparse.ArgumentParser(description='ATEMBuffer benchmark', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    ARG_PARSER.add_argument('-n', dest='number', type=int, default=2000, help='iterations per measurement')
+    ARG_PARSER.add_argument('--sources', dest='sources', type=int, default=24, help='audio/video sources per simulated packet')
+    ARGS = ARG_PARSER.parse_args()
+
+    buffers = {'list': ListATEMBuffer(10240), 'bytearray': ATEMBuffer(10240)}
+    cases = {
+        'reset (10240 bytes)': lambda b: b.reset(),
+        'AMLv levels': lambda b: amlv_levels(b, ARGS.sources),
+        'TlIn flags': lambda b: tally_flags(b, ARGS.sources),
+        'packet header': header,
+    }
+    print('%-22s %14s %14s %8s' % ('case', 'list (us)', 'bytearray (us)', 'speedup'))
+    for case_name, case in cases.items():
+        results = {}
+        for buf_name, buf in buffers.items():
+            results[buf_name] = bench(case_name, lambda: case(buf), ARGS.number)
+        print('%-22s %14.3f %14.3f %7.1fx' % (case_name, results['list'], results['bytearray'], results['list'] / results['bytearray']))
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+# ATEM initial state replay benchmark
+#   feeds an initial state dump (everything a switcher sends right after HELLO) through PyATEMMax's receive path,
+#   using a fake socket instead of a real switcher, and times how long it takes to decode
+#   with no arguments a dump resembling a large switcher is generated, or pass --dump with a capture:
+#     one datagram per line, hex encoded, switcher -> client direction only, starting with the HELLO response
+#   --compare also runs the replay with the old implementations of what has been optimized patched back in, one at a time
+#   run from the repo root: python3 tests/bench-atem-replay.py
+
+#    Copyright (C) 2021 James Bishop (james@bishopdynamics.com)
+
+# pylint: disable=C0111,W0703,C0301,W0212
+
+import sys
+import time
+import struct
+import pathlib
+import argparse
+
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent.joinpath('CueStack')))
+
+import PyATEMMax  # noqa: E402
+from PyATEMMax.ATEMConstant import ATEMConstant, ATEMConstantList  # noqa: E402
+from PyATEMMax.ATEMProtocol import ATEMProtocol  # noqa: E402
+from PyATEMMax.ATEMCommandHandlers import ATEMCommandHandlers  # noqa: E402
+from PyATEMMax.ATEMConnectionManager import ATEMConnectionManager  # noqa: E402
+
+SESSION_ID = 0x1234
+FLAG_ACK_REQUEST = 0x01
+FLAG_HELLO = 0x02
+MAX_DATAGRAM = 1400
+
+
+class ReplaySocket:
+    # stands in for the switcher's UDP socket: hands out the recorded datagrams one per recv, and swallows whatever is sent
+    #   None in the datagram list means "nothing arrived this time"
+    def __init__(self, datagrams):
+        self.datagrams = list(datagrams)
+        self.index = 0
+        self.sent = 0
+
+    def remaining(self):
+        return len(self.datagrams) - self.index
+
+    def connect(self, _address):
+        pass
+
+    def send(self, data):
+        self.sent += 1
+        return len(data)
+
+    def recv_into(self, buffer):
+        if self.index >= len(self.datagrams):
+            raise BlockingIOError()
+        datagram = self.datagrams[self.index]
+        self.index += 1
+        if datagram is None:
+            raise BlockingIOError()
+        buffer[:len(datagram)] = datagram
+        return len(datagram)
+
+
+def packet(flags, remote_packet_id, payload=b''):
+    return struct.pack('>HHHHHH', (flags << 11) | (12 + len(payload)), SESSION_ID, 0, 0, 0, remote_packet_id) + payload
+
+
+def command(name, payload):
+    return struct.pack('>HH4s', 8 + len(payload), 0, name.encode('ascii')) + payload
+
+
+def generate_dump():
+    # roughly the shape of the initial state of a 4 M/E switcher: every input, every audio source, and the per M/E state
+    atem = ATEMProtocol()
+    videoSources = [c.value for c in atem.videoSources]
+    audioSources = [c.value for c in atem.audioSources]
+    mixEffects = [c.value for c in atem.mixEffects]
+    keyers = [c.value for c in atem.keyers]
+    commands = [
+        command('_ver', struct.pack('>HH', 2, 30)),
+        command('_pin', b'ATEM Constellation 8K'.ljust(44, b'\0')),
+        command('_top', bytes([len(mixEffects), len(videoSources) & 0xFF, 2, 6, 4, 4, 1, 1, 0, 1, 0, 0])),
+    ]
+    for number, source in enumerate(videoSources):
+        name = ('Input %s' % number).encode('ascii')
+        commands.append(command('InPr', struct.pack('>H20s4sxBxBBxxxBBxx', source, name, name[-4:], 0x03, 1, 0, 0x1F, 0x03)))
+    for number, source in enumerate(audioSources):
+        commands.append(command('AMIP', struct.pack('>HBxxxBBBxHhxx', source, 0, 0, number % 3, 1, 32768, 0)))
+    for mE in mixEffects:
+        commands.append(command('PrgI', struct.pack('>BxH', mE, videoSources[1])))
+        commands.append(command('PrvI', struct.pack('>BxHxxxx', mE, videoSources[2])))
+        commands.append(command('TrSS', struct.pack('>BBBBBxxx', mE, 0, 1, 0, 1)))
+        commands.append(command('FtbS', struct.pack('>BBBB', mE, 0, 0, 0)))
+        for keyer in keyers:
+            commands.append(command('KeOn', struct.pack('>BBBx', mE, keyer, 0)))
+    for aux in atem.auxChannels:
+        commands.append(command('AuxS', struct.pack('>BxH', aux.value, videoSources[3])))
+    for dsk in atem.dsks:
+        commands.append(command('DskS', struct.pack('>BBBBBxxx', dsk.value, 0, 0, 0, 0)))
+    tally = bytes(len(videoSources) - 1)
+    commands.append(command('TlIn', struct.pack('>H', len(tally)) + tally + bytes(-(2 + len(tally)) % 4)))
+
+    # HELLO response, then the commands packed into datagrams, then the empty packet that marks the end of the initial payload
+    datagrams = [packet(FLAG_HELLO, 0, bytes([2, 0, 0, 3, 0, 0, 0, 0]))]
+    payload = b''
+    for cmd in commands:
+        if payload and len(payload) + len(cmd) > MAX_DATAGRAM - 12:
+            datagrams.append(packet(FLAG_ACK_REQUEST, len(datagrams), payload))
+            payload = b''
+        payload += cmd
+    if payload:
+        datagrams.append(packet(FLAG_ACK_REQUEST, len(datagrams), payload))
+    datagrams.append(packet(FLAG_ACK_REQUEST, len(datagrams)))
+    return datagrams, len(commands)
+
+
+def load_dump(path):
+    with open(path, 'r', encoding='utf-8') as dumpfile:
+        return [bytes.fromhex(line.strip()) for line in dumpfile if line.strip()]
+
+
+def replay(datagrams):
+    # returns (seconds spent decoding, switcher)
+    switcher = PyATEMMax.ATEMMax()
+    # a real switcher's HELLO response is handled on the poll after it arrives, so leave a gap after it
+    sock = ReplaySocket(datagrams[:1] + [None] + datagrams[1:])
+    switcher._udp._socket = sock
+    switcher.ip = '127.0.0.1'
+    switcher._connTimeout = 60
+    start = time.perf_counter()
+    while sock.remaining():
+        switcher._runLoop()
+    switcher._runLoop()  # one more with nothing to read, so it can decide the initial payload is complete
+    return time.perf_counter() - start, switcher
+
+
+def legacy_getHandler(self, cmdStr):
+    # ATEMCommandHandlers._getHandler as it was before the dispatch table
+    funcname = self._HANDLER_PREFIX + cmdStr
+    if funcname in dir(self):
+        return self.__getattribute__(funcname)
+    return self._handleNOTIMPLEMENTED
+
+
+def legacy_parsePacket(self, packetLength):
+    # ATEMConnectionManager._parsePacket as it was before the dispatch table
+    indexPointer = self.atem.headerLen
+    while indexPointer < packetLength:
+        self._udp.read(self._inBuf, self.atem.cmdHeaderLen)
+        self._cmdLength = self._inBuf.getU16(0)
+        self._cmdPointer = 0
+        cmdStr = ''.join([chr(x) for x in [self._inBuf[4], self._inBuf[5], self._inBuf[6], self._inBuf[7]]])
+        if cmdStr in self.atem.commands:
+            self.log.debug(f"Received: [{cmdStr}] ({self.atem.commands[cmdStr]})")
+        else:
+            self.log.debug(f"Received: UNKNOWN command [{cmdStr}]")
+        if self._cmdLength > self.atem.cmdHeaderLen:
+            self._parseGetCommands(cmdStr)
+            while self._read2InBuf():
+                pass
+            indexPointer += self._cmdLength
+        else:
+            self._udp.flushInputBuffer()
+            return
+
+
+def linear_byValue(self, value):
+    # ATEMConstantList._byValue as it was before the value index
+    if isinstance(value, ATEMConstant):
+        value = value.value
+    found = None
+    for k in self._values:
+        v = self._values[k].value
+        if v == value:
+            found = self._values[k]
+            break
+    return found
+
+
+# the old implementations, by what they replaced: (class, attribute name, old implementation)
+LEGACY = {
+    'linear value lookup': [(ATEMConstantList, '_byValue', linear_byValue)],
+    'dir() handler dispatch': [(ATEMCommandHandlers, '_getHandler', legacy_getHandler), (ATEMConnectionManager, '_parsePacket', legacy_parsePacket)],
+}
+
+
+def best_of(datagrams, repeat, patches=()):
+    # patches the given old implementations in for the duration of the replays
+    saved = [(cls, name, cls.__dict__[name]) for cls, name, _ in patches]
+    for cls, name, func in patches:
+        setattr(cls, name, func)
+    try:
+        results = [replay(datagrams) for _ in range(repeat)]
+    finally:
+        for cls, name, func in saved:
+            setattr(cls, name, func)
+    return min(seconds for seconds, _ in results), results[-1][1]
+
+
+if __name__ == '__main__':
+    ARG_PARSER = argparse.ArgumentParser(description='ATEM initial state replay benchmark', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    ARG_PARSER.add_argument('--dump', dest='dump', type=str, default=None, help='hex datagram dump to replay, instead of a generated one')
+    ARG_PARSER.add_argument('--save', dest='save', type=str, default=None, help='write the generated dump to this file')
+    ARG_PARSER.add_argument('-r', dest='repeat', type=int, default=5, help='replays per measurement, best is reported')
+    ARG_PARSER.add_argument('--compare', dest='compare', action='store_true', help='also replay with each of the old implementations patched back in')
+    ARGS = ARG_PARSER.parse_args()
+
+    if ARGS.dump:
+        DATAGRAMS = load_dump(ARGS.dump)
+        print('loaded %s datagrams from %s' % (len(DATAGRAMS), ARGS.dump))
+    else:
+        DATAGRAMS, NUM_COMMANDS = generate_dump()
+        print('generated %s commands in %s datagrams' % (NUM_COMMANDS, len(DATAGRAMS)))
+        if ARGS.save:
+            with open(ARGS.save, 'w', encoding='utf-8') as f:
+                f.write('\n'.join(datagram.hex() for datagram in DATAGRAMS) + '\n')
+
+    SECONDS, SWITCHER = best_of(DATAGRAMS, ARGS.repeat)
+    print('connected: %s, model: %s' % (SWITCHER.connected, SWITCHER.atemModel))
+    print('%-32s %10.2fms' % ('replay', SECONDS * 1000))
+    if ARGS.compare:
+        ALL_PATCHES = []
+        for LEGACY_NAME, PATCHES in LEGACY.items():
+            ALL_PATCHES.extend(PATCHES)
+            LEGACY_SECONDS, _ = best_of(DATAGRAMS, ARGS.repeat, PATCHES)
+            print('%-32s %10.2fms %6.1fx' % ('replay, ' + LEGACY_NAME, LEGACY_SECONDS * 1000, LEGACY_SECONDS / SECONDS))
+        LEGACY_SECONDS, _ = best_of(DATAGRAMS, ARGS.repeat, ALL_PATCHES)
+        print('%-32s %10.2fms %6.1fx' % ('replay, all of the above', LEGACY_SECONDS * 1000, LEGACY_SECONDS / SECONDS))
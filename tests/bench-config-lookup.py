@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# Config lookup microbenchmark
+#   compares a linear search of the config lists, as CueStack used to do, against the indexed CSConfigModel, on a large generated config
+#   run from the repo root: python3 tests/bench-config-lookup.py
+
+#    Copyright (C) 2021 James Bishop (james@bishopdynamics.com)
+
+# pylint: disable=C0111,W0703,C0301
+
+import sys
+import random
+import pathlib
+import argparse
+import timeit
+
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent.joinpath('CueStack')))
+
+from CSConfigModel import CSConfigModel  # noqa: E402
+
+
+def generate_config(num_stacks, num_cues, num_parts, num_targets):
+    targets = [{'enabled': True, 'name': 'target%s' % t, 'type': 'udp_generic', 'config': {'host': 'localhost', 'port': 9000 + t}} for t in range(num_targets)]
+    stacks = []
+    for s in range(num_stacks):
+        cues = []
+        for c in range(num_cues):
+            parts = [{'target': 'target%s' % (p % num_targets), 'delay': p * 20, 'command': {'message': 'stack%s cue%s part%s' % (s, c, p)}} for p in range(num_parts)]
+            cues.append({'name': 'cue%s' % c, 'parts': parts})
+        stacks.append({'name': 'stack%s' % s, 'cues': cues})
+    return {
+        'default_stack': 'stack0',
+        'stacks': stacks,
+        'command_targets': targets,
+        'trigger_sources': [],
+    }
+
+
+def find_stack(config, stackname):
+    # the linear lookups CSConfigModel replaced, for comparison
+    for stack in config['stacks']:
+        if stack['name'] == stackname:
+            return stack
+    return None
+
+
+def find_cue(stack, cuename):
+    for cue in stack['cues']:
+        if cue['name'] == cuename:
+            return cue
+    return None
+
+
+def find_target(config, targetname):
+    for target in config['command_targets']:
+        if target['name'] == targetname:
+            return target
+    return None
+
+
+def bench(name, func, per):
+    # best of three runs, reported per lookup (or per whatever func did `per` of)
+    seconds = min(timeit.repeat(func, number=1, repeat=3))
+    print('%-28s %12.3fus' % (name, seconds / per * 1000000))
+
+
+if __name__ == '__main__':
+    ARG_PARSER = argparse.ArgumentParser(description='Config lookup microbenchmark', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    ARG_PARSER.add_argument('--stacks', dest='stacks', type=int, default=300, help='number of stacks to generate')
+    ARG_PARSER.add_argument('--cues', dest='cues', type=int, default=300, help='number of cues per stack')
+    ARG_PARSER.add_argument('--parts', dest='parts', type=int, default=4, help='number of parts per cue')
+    ARG_PARSER.add_argument('--targets', dest='targets', type=int, default=30, help='number of command targets')
+    ARG_PARSER.add_argument('-n', dest='number', type=int, default=2000, help='lookups per measurement')
+    ARGS = ARG_PARSER.parse_args()
+
+    config = generate_config(ARGS.stacks, ARGS.cues, ARGS.parts, ARGS.targets)
+    model = CSConfigModel(config)
+    rng = random.Random(1)
+    names = [('stack%s' % rng.randrange(ARGS.stacks), 'cue%s' % rng.randrange(ARGS.cues), 'target%s' % rng.randrange(ARGS.targets)) for _ in range(ARGS.number)]
+    print('generated %s stacks x %s cues x %s parts' % (ARGS.stacks, ARGS.cues, ARGS.parts))
+    bench('index build', lambda: CSConfigModel(config), 1)
+
+    def linear_lookups():
+        for stackname, cuename, targetname in names:
+            find_cue(find_stack(config, stackname), cuename)
+            find_target(config, targetname)
+
+    def indexed_lookups():
+        for stackname, cuename, targetname in names:
+            model.find_cue(model.find_stack(stackname), cuename)
+            model.find_target(targetname)
+
+    bench('linear stack+cue+target', linear_lookups, ARGS.number)
+    bench('indexed stack+cue+target', indexed_lookups, ARGS.number)
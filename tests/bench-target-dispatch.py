@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# Command target dispatch latency benchmark
+#   compares the blocking CSCommandTarget.process_queue against the old 100ms sleep-polling loop
+#   run from the repo root: python3 tests/bench-target-dispatch.py
+
+#    Copyright (C) 2021 James Bishop (james@bishopdynamics.com)
+
+# pylint: disable=C0111,W0703,C0301
+
+import sys
+import time
+import pathlib
+import argparse
+import statistics
+
+from multiprocessing import Process, Queue
+
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent.joinpath('CueStack')))
+
+from CSCommandTargets import CSCommandTarget, TARGET_EXIT_MSG  # noqa: E402
+from CSCommandQueue import CSCommandQueue  # noqa: E402
+
+
+class BenchTarget(CSCommandTarget):
+    # reports how long each command sat in the queue before send() saw it
+    def setup(self):
+        self.description = 'Benchmark'
+        self.results = self.config['results']
+
+    def send(self, command):
+        self.results.put(time.monotonic() - command['sent'])
+
+    def shutdown(self):
+        pass
+
+
+class LegacyBenchTarget(BenchTarget):
+    # the sleep-polling loop that process_queue used to be, reading CSCommandQueue items off the queue underneath it
+    def process_queue(self):
+        while self.should_run:
+            if not self.queue.queue.empty():
+                item = self.queue.get()
+                if item == TARGET_EXIT_MSG:
+                    break
+                self.send(item[1])
+            time.sleep(0.1)
+        self.stop()
+
+
+def run(target_class, count, spacing):
+    command_queue = CSCommandQueue(Queue())
+    results = Queue()
+    config_obj = {
+        'name': 'bench:%s' % target_class.__name__,
+        'config': {'results': results},
+        'queue': command_queue,
+        'log_level': 40,
+    }
+    proc = Process(target=target_class, args=(config_obj,))
+    proc.daemon = True
+    proc.start()
+    time.sleep(0.5)  # let the target settle before we start timing
+    started = time.monotonic()
+    for _ in range(count):
+        command_queue.put({'sent': time.monotonic()})
+        if spacing:
+            time.sleep(spacing)
+    latencies = [results.get() for _ in range(count)]
+    elapsed = time.monotonic() - started
+    command_queue.put(TARGET_EXIT_MSG)
+    proc.join(5)
+    if proc.is_alive():
+        proc.terminate()
+    return latencies, elapsed
+
+
+def report(name, latencies, elapsed):
+    latencies = sorted(latencies)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print('%-20s mean %8.3fms  p50 %8.3fms  p99 %8.3fms  max %8.3fms  %8.1f cmds/s' % (
+        name,
+        statistics.mean(latencies) * 1000,
+        statistics.median(latencies) * 1000,
+        p99 * 1000,
+        latencies[-1] * 1000,
+        len(latencies) / elapsed))
+
+
+if __name__ == '__main__':
+    ARG_PARSER = argparse.ArgumentParser(description='Command target dispatch latency benchmark', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    ARG_PARSER.add_argument('-n', dest='count', type=int, default=200, help='number of commands to send')
+    ARG_PARSER.add_argument('-s', dest='spacing', type=float, default=20, help='milliseconds between commands, 0 for a single burst')
+    ARGS = ARG_PARSER.parse_args()
+    for this_class in [LegacyBenchTarget, BenchTarget]:
+        report(this_class.__name__, *run(this_class, ARGS.count, ARGS.spacing / 1000))
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# Command target engine startup benchmark
+#   starts a CSMessageProcessor with N Generic UDP command targets, once per command_target_engine, and reports
+#   how long it takes until every target has delivered a message, and the memory (RSS) of CueStack plus its target processes
+#   (RSS counts pages shared between forked processes once per process, so it overstates the process engine somewhat)
+#   each engine is measured in a fresh interpreter, so one does not inherit the other's memory
+#   run from the repo root: python3 tests/bench-target-engine.py
+
+#    Copyright (C) 2021 James Bishop (james@bishopdynamics.com)
+
+# pylint: disable=C0111,W0703,C0301
+
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import pathlib
+import argparse
+import subprocess
+
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent.joinpath('CueStack')))
+
+ENGINES = ['process', 'async']
+
+
+def rss_kb(pid):
+    try:
+        with open('/proc/%s/status' % pid, 'r', encoding='utf-8') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def children(pid):
+    found = []
+    for task in os.listdir('/proc/%s/task' % pid):
+        try:
+            with open('/proc/%s/task/%s/children' % (pid, task), 'r', encoding='utf-8') as child_list:
+                found.extend(int(child) for child in child_list.read().split())
+        except OSError:
+            pass
+    return found
+
+
+def run(engine, count, port):
+    # runs in the child interpreter, prints the results as json
+    from CSMessageProcessor import CSMessageProcessor  # pylint: disable=C0415
+
+    sink = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sink.bind(('127.0.0.1', port))
+    sink.settimeout(30)
+    config = {
+        'command_target_engine': engine,
+        'default_stack': 'bench',
+        'stacks': [{'name': 'bench', 'cues': []}],
+        'trigger_sources': [],
+        'command_targets': [{
+            'enabled': True,
+            'name': 'udp%s' % i,
+            'type': 'udp_generic',
+            'config': {'host': '127.0.0.1', 'port': port},
+        } for i in range(count)],
+    }
+    start = time.perf_counter()
+    processor = CSMessageProcessor(config, 40, asyncio.new_event_loop())
+    for name, command_queue in processor.command_queues.items():
+        command_queue.put({'message': name})
+    seen = set()
+    while len(seen) < count:
+        seen.add(sink.recv(1024))
+    seconds = time.perf_counter() - start
+    memory = rss_kb(os.getpid()) + sum(rss_kb(child) for child in children(os.getpid()))
+    processor.stop()
+    print(json.dumps({'seconds': seconds, 'rss_kb': memory}))
+
+
+if __name__ == '__main__':
+    ARG_PARSER = argparse.ArgumentParser(description='Command target engine startup benchmark', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    ARG_PARSER.add_argument('-n', dest='count', type=int, default=50, help='number of command targets')
+    ARG_PARSER.add_argument('-p', dest='port', type=int, default=8031, help='UDP port for the sink all targets send to')
+    ARG_PARSER.add_argument('--engine', dest='engine', choices=ENGINES, default=None, help=argparse.SUPPRESS)  # used for the child interpreters
+    ARGS = ARG_PARSER.parse_args()
+
+    if ARGS.engine:
+        run(ARGS.engine, ARGS.count, ARGS.port)
+        sys.exit(0)
+
+    print('%-10s %10s %12s' % ('engine', 'seconds', 'RSS (MB)'))
+    for ENGINE in ENGINES:
+        OUTPUT = subprocess.run([sys.executable, __file__, '--engine', ENGINE, '-n', str(ARGS.count), '-p', str(ARGS.port)], capture_output=True, text=True, check=True).stdout
+        RESULT = json.loads(OUTPUT.strip().splitlines()[-1])
+        print('%-10s %10.3f %12.1f' % (ENGINE, RESULT['seconds'], RESULT['rss_kb'] / 1024))
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# Trigger message decode benchmark
+#   times decoding typical trigger messages the way CSMessageProcessor.handle used to (a Python callback for every key, to reject
+#   duplicates, and the message pretty-printed for a debug log line whether or not anything is logged at DEBUG), against CSCodec
+#   with each json backend available, and the same for encoding replies
+#   run from the repo root: python3 tests/bench-trigger-decode.py
+
+#    Copyright (C) 2021 James Bishop (james@bishopdynamics.com)
+
+# pylint: disable=C0111,W0703,C0301
+
+import sys
+import json
+import timeit
+import pathlib
+import argparse
+
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent.joinpath('CueStack')))
+
+from CSCommon import dict_raise_on_duplicates  # noqa: E402
+from CSCodec import CSCodec, JSON_BACKENDS  # noqa: E402
+
+
+def make_cue(name, parts):
+    return {'name': name, 'parts': [{'target': 'osc%s' % (i % 4), 'delay': i * 100, 'command': {'address': '/fader/%s' % i, 'value': i}} for i in range(parts)]}
+
+
+MESSAGES = {
+    'cue trigger': json.dumps({'cue': 'winter_ball', 'stack': 'StackA'}),
+    'data request': json.dumps({'request': 'getCues', 'request_id': 42}),
+    'addCue, 100 parts': json.dumps({'request': 'addCue', 'request_id': 43, 'request_payload': {'stack': 'StackA', 'cue': make_cue('big', 100)}}),
+    'command, url in string': json.dumps({'request': 'command', 'request_payload': {'target': 'http', 'command': {'path': '/api?t=12:30', 'args': {}}}}),
+}
+REPLIES = {
+    'status': {'status': 'OK', 'request_id': 0},
+    'getConfig, 50 cues': {'status': 'OK', 'request_id': 1, 'response': {'config': {'stacks': [{'name': 'StackA', 'cues': [make_cue('cue%s' % i, 10) for i in range(50)]}]}}},
+}
+
+
+def legacy_decode(text):
+    decoded = json.loads(text, object_pairs_hook=dict_raise_on_duplicates)
+    json.dumps(decoded, indent=4, sort_keys=True)  # built for logging.debug, even when it is not logged
+    return decoded
+
+
+def bench(func, arg, number):
+    return min(timeit.repeat(lambda: func(arg), number=number, repeat=5)) / number * 1000000
+
+
+if __name__ == '__main__':
+    ARG_PARSER = argparse.ArgumentParser(description='Trigger message decode benchmark', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    ARG_PARSER.add_argument('-n', dest='number', type=int, default=2000, help='iterations per measurement')
+    ARGS = ARG_PARSER.parse_args()
+
+    CODECS = {name: CSCodec(name) for name in JSON_BACKENDS}
+    for codec in CODECS.values():
+        for text in MESSAGES.values():
+            assert codec.decode(text) == json.loads(text)
+        try:
+            codec.decode('{"cue": "a", "cue": "b"}')
+            raise AssertionError('%s backend accepted a duplicate key' % codec.backend)
+        except ValueError:
+            pass
+
+    HEADER = '%-26s %10s' % ('decode (us)', 'before') + ''.join(' %10s' % name for name in CODECS)
+    print(HEADER)
+    for MESSAGE_NAME, TEXT in MESSAGES.items():
+        print('%-26s %10.2f' % (MESSAGE_NAME, bench(legacy_decode, TEXT, ARGS.number)) + ''.join(' %10.2f' % bench(codec.decode, TEXT, ARGS.number) for codec in CODECS.values()))
+    print()
+    print(HEADER.replace('decode', 'encode'))
+    for REPLY_NAME, REPLY in REPLIES.items():
+        print('%-26s %10.2f' % (REPLY_NAME, bench(json.dumps, REPLY, ARGS.number)) + ''.join(' %10.2f' % bench(codec.encode, REPLY, ARGS.number) for codec in CODECS.values()))
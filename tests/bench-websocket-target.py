@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# Generic Websocket command target throughput benchmark
+#   pushes a burst of commands through CSTargetGenericWebsocket against the bundled WebsocketTestTarget,
+#   once per connection mode, and reports commands per second
+#   persistent=false is the old behaviour of connecting (and closing) for every command
+#   run from the repo root: python3 tests/bench-websocket-target.py
+
+#    Copyright (C) 2021 James Bishop (james@bishopdynamics.com)
+
+# pylint: disable=C0111,W0703,C0301
+
+import sys
+import time
+import asyncio
+import pathlib
+import argparse
+
+from multiprocessing import Process, Queue, Value
+
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent.joinpath('CueStack')))
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent.joinpath('WebsocketTestTarget')))
+
+import websockets  # noqa: E402
+from WebsocketTestTarget import ws_server  # noqa: E402
+from CSCommandTargets import CSTargetGenericWebsocket, TARGET_EXIT_MSG  # noqa: E402
+from CSCommandQueue import CSCommandQueue  # noqa: E402
+
+MODES = {
+    'connect per command': {'persistent': False},
+    'persistent': {},
+    'persistent, fire_and_forget': {'fire_and_forget': True},
+    'pool_size 4': {'pool_size': 4},
+}
+
+
+class ReceivedCounter:
+    # stands in for stdout in the server process: WebsocketTestTarget prints a line for every message it receives,
+    #   which is counted instead, so the benchmark can tell that every command really arrived
+    def __init__(self, received):
+        self.received = received
+
+    def write(self, text):
+        count = text.count('received message:')
+        if count:
+            with self.received.get_lock():
+                self.received.value += count
+
+    def flush(self):
+        pass
+
+
+def run_server(port, received):
+    sys.stdout = ReceivedCounter(received)
+
+    async def handler(websocket, path=None):
+        await ws_server(websocket, path)
+
+    async def serve():
+        async with websockets.serve(handler, 'localhost', port):
+            await asyncio.Future()
+
+    asyncio.run(serve())
+
+
+def run(port, count, options, received):
+    command_queue = CSCommandQueue(Queue())
+    config = {'host': 'localhost', 'port': port}
+    config.update(options)
+    config_obj = {
+        'name': 'bench:websocket',
+        'config': config,
+        'queue': command_queue,
+        'log_level': 40,
+    }
+    proc = Process(target=CSTargetGenericWebsocket, args=(config_obj,))
+    proc.daemon = True
+    proc.start()
+    time.sleep(0.5)  # let it get going before the clock starts
+    received_before = received.value
+    start = time.perf_counter()
+    for i in range(count):
+        command_queue.put({'message': 'benchmark command %s' % i})
+    command_queue.put(TARGET_EXIT_MSG)
+    proc.join()
+    elapsed = time.perf_counter() - start
+    deadline = time.monotonic() + 5  # fire_and_forget can finish before the server has read everything
+    while received.value - received_before < count and time.monotonic() < deadline:
+        time.sleep(0.01)
+    if received.value - received_before != count:
+        raise Exception('server received %s of %s commands' % (received.value - received_before, count))
+    return elapsed
+
+
+if __name__ == '__main__':
+    ARG_PARSER = argparse.ArgumentParser(description='Generic Websocket command target throughput benchmark', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    ARG_PARSER.add_argument('-n', dest='count', type=int, default=1000, help='number of commands to send per mode')
+    ARG_PARSER.add_argument('-p', dest='port', type=int, default=8021, help='port for the WebsocketTestTarget')
+    ARGS = ARG_PARSER.parse_args()
+
+    RECEIVED = Value('q', 0)
+    SERVER = Process(target=run_server, args=(ARGS.port, RECEIVED))
+    SERVER.daemon = True
+    SERVER.start()
+    time.sleep(1)
+    try:
+        print('%-30s %10s %12s' % ('mode', 'seconds', 'commands/s'))
+        for MODE_NAME, OPTIONS in MODES.items():
+            SECONDS = run(ARGS.port, ARGS.count, OPTIONS, RECEIVED)
+            print('%-30s %10.3f %12.0f' % (MODE_NAME, SECONDS, ARGS.count / SECONDS))
+    finally:
+        SERVER.terminate()
@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+# CueStack trigger -> target latency load test
+#   starts CueStack (as its own process, with a generated config) with a UDP, TCP, OSC and HTTP command target, each sending to a
+#   local sink which timestamps every arrival, then fires cues at those targets through a trigger source at a steady rate,
+#   and reports the latency from sending the trigger to the target's message arriving at the sink, as p50 / p99 / p99.9,
+#   along with how many messages arrived and how fast
+#   with --find-max, the rate is doubled for as long as CueStack keeps up, to find the most it can sustain
+#   each message has its own cue: cue load_udp_17 sends "17" to the UDP sink, and so on. cues are reused every --window messages,
+#     so a message that takes longer than that to arrive (window / rate seconds) can be counted against the wrong trigger
+#   send times are when each trigger was due, not when it actually went out, so a load generator falling behind shows up as latency
+#   run from the repo root: python3 tests/loadtest-cuestack.py -t http -r 100 200 400
+
+#    Copyright (C) 2021 James Bishop (james@bishopdynamics.com)
+
+# pylint: disable=C0111,W0703,C0301
+
+import os
+import sys
+import json
+import time
+import queue
+import socket
+import pathlib
+import argparse
+import tempfile
+import threading
+import subprocess
+import http.client
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+import websocket
+import paho.mqtt.client as mqtt
+from pythonosc.osc_packet import OscPacket
+
+PATH_CUESTACK = pathlib.Path(__file__).parent.parent.joinpath('CueStack')
+TARGET_TYPES = {'udp': 'udp_generic', 'tcp': 'tcp_generic', 'osc': 'osc_generic', 'http': 'http_generic'}
+TRIGGER_TYPES = ['websocket', 'http', 'mqtt']
+
+
+class Sink:
+    # receives what a command target sends, and notes the time each sequence number arrived
+    def __init__(self, port):
+        self.port = port
+        self.arrivals = {}  # sequence number -> perf_counter at arrival
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.setup()
+        self.thread.start()
+
+    def arrived(self, sequence):
+        self.arrivals[int(sequence)] = time.perf_counter()
+
+    def setup(self):
+        pass
+
+    def run(self):
+        pass
+
+
+class UDPSink(Sink):
+    def setup(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+        self.sock.bind(('127.0.0.1', self.port))
+
+    def run(self):
+        while True:
+            self.arrived(self.sock.recv(65535))
+
+
+class OSCSink(UDPSink):
+    def run(self):
+        while True:
+            for message in OscPacket(self.sock.recv(65535)).messages:
+                self.arrived(message.message.params[0])
+
+
+class TCPSink(Sink):
+    # messages are newline terminated, as TCP does not keep them apart
+    def setup(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(('127.0.0.1', self.port))
+        self.sock.listen()
+
+    def run(self):
+        while True:
+            connection, _address = self.sock.accept()
+            threading.Thread(target=self.read, args=(connection,), daemon=True).start()
+
+    def read(self, connection):
+        buffered = b''
+        while True:
+            data = connection.recv(65535)
+            if not data:
+                return
+            buffered += data
+            *lines, buffered = buffered.split(b'\n')
+            for line in lines:
+                self.arrived(line)
+
+
+class HTTPSink(Sink):
+    def setup(self):
+        sink = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                sink.arrived(parse_qs(urlsplit(self.path).query)['seq'][0])
+                self.send_response(200)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, *_args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', self.port), Handler)
+        self.server.daemon_threads = True
+
+    def run(self):
+        self.server.serve_forever()
+
+
+SINKS = {'udp': UDPSink, 'tcp': TCPSink, 'osc': OSCSink, 'http': HTTPSink}
+
+
+def command_for(target_type, sequence):
+    if target_type == 'osc':
+        return {'address': '/load', 'value': sequence}
+    if target_type == 'http':
+        return {'message': '/load?seq=%s' % sequence}
+    if target_type == 'tcp':
+        return {'message': '%s\n' % sequence}
+    return {'message': str(sequence)}
+
+
+def make_config(args):
+    cues = []
+    for target_type in args.targets:
+        for sequence in range(args.window):
+            cues.append({'name': 'load_%s_%s' % (target_type, sequence), 'parts': [{'target': 'load_%s' % target_type, 'command': command_for(target_type, sequence)}]})
+    config = {
+        'command_target_engine': args.engine,
+        'default_stack': 'load',
+        'stacks': [{'name': 'load', 'cues': cues}],
+        'command_targets': [{
+            'enabled': True,
+            'name': 'load_%s' % target_type,
+            'type': TARGET_TYPES[target_type],
+            'config': {'host': '127.0.0.1', 'port': args.sink_port + index},
+        } for index, target_type in enumerate(args.targets)],
+        'trigger_sources': [
+            {'enabled': args.trigger == 'websocket', 'name': 'load_websocket', 'type': 'websocket', 'config': {'port': args.trigger_port}},
+            {'enabled': args.trigger == 'http', 'name': 'load_http', 'type': 'http', 'config': {'port': args.trigger_port}},
+            {'enabled': args.trigger == 'mqtt', 'name': 'load_mqtt', 'type': 'mqtt', 'config': {'host': args.mqtt_host, 'port': args.mqtt_port, 'topic': 'CueStackLoadTest'}},
+        ],
+    }
+    return config
+
+
+class WebsocketTrigger:
+    def __init__(self, args):
+        self.connection = websocket.create_connection('ws://127.0.0.1:%s' % args.trigger_port)
+        threading.Thread(target=self.drain, daemon=True).start()
+
+    def drain(self):
+        # replies are not what is being measured, but they have to be read
+        try:
+            while True:
+                self.connection.recv()
+        except Exception:
+            pass
+
+    def fire(self, cue):
+        self.connection.send(json.dumps({'cue': cue}))
+
+
+class HTTPTrigger:
+    # HTTP waits for each reply, so requests are spread over a pool of keep-alive connections, each with its own thread
+    def __init__(self, args):
+        self.port = args.trigger_port
+        self.pending = queue.Queue()
+        for _ in range(args.http_connections):
+            threading.Thread(target=self.worker, daemon=True).start()
+
+    def worker(self):
+        connection = http.client.HTTPConnection('127.0.0.1', self.port)
+        while True:
+            cue = self.pending.get()
+            try:
+                connection.request('GET', '/trigger?cue=%s' % cue)
+                connection.getresponse().read()
+            except (http.client.HTTPException, OSError):
+                connection.close()
+
+    def fire(self, cue):
+        self.pending.put(cue)
+
+
+class MQTTTrigger:
+    def __init__(self, args):
+        try:
+            self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+        except AttributeError:  # paho-mqtt before 2.0
+            self.client = mqtt.Client()
+        self.client.connect(args.mqtt_host, args.mqtt_port)
+        self.client.loop_start()
+
+    def fire(self, cue):
+        self.client.publish('CueStackLoadTest', json.dumps({'cue': cue}))
+
+
+TRIGGERS = {'websocket': WebsocketTrigger, 'http': HTTPTrigger, 'mqtt': MQTTTrigger}
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return float('nan')
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def run_rate(args, trigger, sinks, rate, sequence_start):
+    # fire triggers round robin across the targets at rate per second, for duration seconds, then wait for stragglers
+    count = int(rate * args.duration)
+    sent = {target_type: {} for target_type in args.targets}  # sequence -> due time
+    start = time.perf_counter() + 0.1
+    for number in range(count):
+        due = start + number / rate
+        delay = due - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        target_type = args.targets[number % len(args.targets)]
+        sequence = sequence_start + number
+        sent[target_type][sequence] = due
+        trigger.fire('load_%s_%s' % (target_type, sequence % args.window))
+    time.sleep(args.settle)
+    results = {}
+    for target_type in args.targets:
+        arrivals = sinks[target_type].arrivals
+        latencies = []
+        last_arrival = start
+        for sequence, due in sent[target_type].items():
+            # the sink only knows sequence modulo window, so match each send with the arrival recorded for its slot, if it came after
+            arrived = arrivals.get(sequence % args.window)
+            if arrived is not None and arrived >= due:
+                latencies.append(arrived - due)
+                last_arrival = max(last_arrival, arrived)
+        latencies.sort()
+        results[target_type] = {
+            'sent': len(sent[target_type]),
+            'received': len(latencies),
+            'throughput': len(latencies) / max(last_arrival - start, 1e-9),
+            'p50': percentile(latencies, 0.5) * 1000,
+            'p99': percentile(latencies, 0.99) * 1000,
+            'p99.9': percentile(latencies, 0.999) * 1000,
+        }
+    for sink in sinks.values():
+        sink.arrivals.clear()
+    return results, sequence_start + count
+
+
+def wait_for_port(port, deadline):
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+            return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+if __name__ == '__main__':
+    ARG_PARSER = argparse.ArgumentParser(description='CueStack trigger -> target latency load test', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    ARG_PARSER.add_argument('-t', dest='trigger', choices=TRIGGER_TYPES, default='http', help='trigger source to drive')
+    ARG_PARSER.add_argument('-r', dest='rates', type=float, nargs='+', default=[50, 100, 200], help='trigger rates to run, per second, across all targets')
+    ARG_PARSER.add_argument('-d', dest='duration', type=float, default=5, help='seconds to run each rate for')
+    ARG_PARSER.add_argument('--targets', dest='targets', nargs='+', choices=list(TARGET_TYPES), default=list(TARGET_TYPES), help='command target types to send to')
+    ARG_PARSER.add_argument('--engine', dest='engine', choices=['process', 'async'], default='process', help='command_target_engine for CueStack')
+    ARG_PARSER.add_argument('--find-max', dest='find_max', action='store_true', help='after the given rates, keep doubling the rate until CueStack cannot keep up')
+    ARG_PARSER.add_argument('--max-p99', dest='max_p99', type=float, default=50, help='with --find-max, p99 latency in ms above which a rate is not sustainable')
+    ARG_PARSER.add_argument('--max-loss', dest='max_loss', type=float, default=0.001, help='with --find-max, fraction of messages lost above which a rate is not sustainable')
+    ARG_PARSER.add_argument('--window', dest='window', type=int, default=2000, help='cues per target, each message uses the next one')
+    ARG_PARSER.add_argument('--settle', dest='settle', type=float, default=2, help='seconds to wait for stragglers after each rate')
+    ARG_PARSER.add_argument('--http-connections', dest='http_connections', type=int, default=8, help='connections for the HTTP trigger')
+    ARG_PARSER.add_argument('--trigger-port', dest='trigger_port', type=int, default=8181, help='port for the websocket or HTTP trigger source')
+    ARG_PARSER.add_argument('--sink-port', dest='sink_port', type=int, default=9181, help='first port for the sinks, one per target type')
+    ARG_PARSER.add_argument('--mqtt-host', dest='mqtt_host', type=str, default='localhost', help='MQTT broker, for the mqtt trigger')
+    ARG_PARSER.add_argument('--mqtt-port', dest='mqtt_port', type=int, default=1883, help='MQTT broker port')
+    ARG_PARSER.add_argument('--log', dest='log', type=str, default=os.devnull, help='file for CueStack output')
+    ARGS = ARG_PARSER.parse_args()
+
+    SINKS_BY_TYPE = {}
+    for INDEX, TARGET_TYPE in enumerate(ARGS.targets):
+        SINKS_BY_TYPE[TARGET_TYPE] = SINKS[TARGET_TYPE](ARGS.sink_port + INDEX)
+        SINKS_BY_TYPE[TARGET_TYPE].start()
+
+    with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as CONFIG_FILE:
+        json.dump(make_config(ARGS), CONFIG_FILE)
+    with open(ARGS.log, 'w', encoding='utf-8') as LOG_FILE:
+        CUESTACK = subprocess.Popen([sys.executable, 'CueStack.py', '-c', CONFIG_FILE.name], cwd=str(PATH_CUESTACK), stdout=LOG_FILE, stderr=subprocess.STDOUT)
+    try:
+        if ARGS.trigger != 'mqtt' and not wait_for_port(ARGS.trigger_port, time.time() + 30):
+            sys.exit('CueStack did not start listening on port %s, see --log' % ARGS.trigger_port)
+        time.sleep(1)  # let the command targets finish connecting
+        TRIGGER = TRIGGERS[ARGS.trigger](ARGS)
+        print('trigger: %s, engine: %s, %ss per rate' % (ARGS.trigger, ARGS.engine, ARGS.duration))
+        print('%8s %-6s %8s %8s %10s %9s %9s %9s' % ('rate/s', 'target', 'sent', 'received', 'msgs/s', 'p50 ms', 'p99 ms', 'p99.9 ms'))
+        RATES = list(ARGS.rates)
+        SEQUENCE = 0
+        SUSTAINED = {TARGET_TYPE: None for TARGET_TYPE in ARGS.targets}  # highest rate each target kept up with, in messages to that target per second
+        while RATES:
+            RATE = RATES.pop(0)
+            RESULTS, SEQUENCE = run_rate(ARGS, TRIGGER, SINKS_BY_TYPE, RATE, SEQUENCE)
+            KEPT_UP = False
+            for TARGET_TYPE, RESULT in RESULTS.items():
+                print('%8.0f %-6s %8s %8s %10.1f %9.2f %9.2f %9.2f' % (RATE, TARGET_TYPE, RESULT['sent'], RESULT['received'], RESULT['throughput'], RESULT['p50'], RESULT['p99'], RESULT['p99.9']))
+                LOSS = 1 - RESULT['received'] / max(RESULT['sent'], 1)
+                if LOSS <= ARGS.max_loss and RESULT['p99'] <= ARGS.max_p99:
+                    SUSTAINED[TARGET_TYPE] = max(SUSTAINED[TARGET_TYPE] or 0, RATE / len(ARGS.targets))
+                    KEPT_UP = True
+            if ARGS.find_max and not RATES and KEPT_UP:
+                RATES.append(RATE * 2)
+        if ARGS.find_max:
+            print('highest sustained rate per target (p99 <= %sms, loss <= %s%%):' % (ARGS.max_p99, ARGS.max_loss * 100))
+            for TARGET_TYPE, TARGET_RATE in SUSTAINED.items():
+                print('  %-6s %s' % (TARGET_TYPE, 'none of the rates tried' if TARGET_RATE is None else '%.0f/s' % TARGET_RATE))
+    finally:
+        CUESTACK.terminate()
+        CUESTACK.wait()
+        os.unlink(CONFIG_FILE.name)